@@ -122,6 +122,7 @@ class Configuration(Component, dict):
              "upload_science_logs": True,
              "science_server": "mnemosyne-proj.dyndns.org:80",
              "max_log_size_before_upload": 64000, # For testability.
+             "science_log_chunk_size": 1000, # Log entries dumped at once.
              "show_daily_tips": True,
              "current_tip": 0,
              "font": {}, # [card_type.id][fact_key]
@@ -176,6 +177,17 @@ class Configuration(Component, dict):
              "shown_learn_new_cards_help": False,
              "shown_schedule_help": False,
              "asynchronous_database": False,
+             "identity_map_size": 0, # Number of cached cards, 0 = disabled.
+             "wal_mode": False, # Read while writing, not for network drives.
+             "database_readers": 4, # Max. number of read-only connections.
+             "database_profiling": False, # Collect statistics on queries.
+             "slow_query_threshold": 0, # In seconds, 0 = don't log.
+             "defer_pregenerated_data": False, # Render browser data in bulk.
+             "check_counters": False, # Debug: compare counters with database.
+             "prefetch_n_cards": 3, # Render upcoming cards in the background.
+             "log_buffer_size": 100, # Log entries written in one batch.
+             "log_archive_chunk_size": 10000, # Log entries archived at once.
+             "compact_log_after_days": None, # Store older repetitions compactly.
              "author_name": "",
              "author_email": "",
              "import_dir": os.path.expanduser("~"),
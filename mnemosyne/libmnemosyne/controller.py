@@ -41,6 +41,9 @@ class Controller(Component):
             tag_names, check_for_duplicates=True, save=True):
         raise NotImplementedError
 
+    def create_new_cards_bulk(self, facts_data, save=True):
+        raise NotImplementedError
+
     def show_edit_card_dialog(self):
         raise NotImplementedError
 
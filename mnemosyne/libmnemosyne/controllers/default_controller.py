@@ -78,11 +78,31 @@ class DefaultController(Controller):
             if abs(next_rollover - previous_rollover) < HOUR:
                 next_rollover += DAY
             self.next_rollover = next_rollover
-        if db_maintenance and \
-           (time.time() > self.config()["last_db_maintenance"] + 90 * DAY):
-            self.component_manager.current("database_maintenance").run()
-            self.config()["last_db_maintenance"] = time.time()
-            self.config().save()
+        if self.database() and self.database().is_loaded() and \
+            self.database().is_accessible():
+            # We commit our own changes at the end, but not those of e.g. an
+            # edit which is still in progress.
+            in_transaction = self.database().in_transaction()
+            # Archive old logs a chunk at a time, instead of blocking the
+            # program until everything is archived and defragmented.
+            if db_maintenance and (self.database().is_archiving_old_logs() or \
+                time.time() > self.config()["last_db_maintenance"] + 90 * DAY):
+                if not self.database().is_archiving_old_logs():
+                    self.config()["last_db_maintenance"] = time.time()
+                    self.config().save()
+                self.database().archive_old_logs(\
+                    max_count=self.config()["log_archive_chunk_size"])
+            # Catch up on postponed rendering of the card browser data. This
+            # happens in the GUI thread every second, so only render a few
+            # cards at a time, so as not to make the GUI sluggish.
+            self.database().regenerate_pregenerated_data(max_count=10)
+            # Don't let the statistics summaries fall too far behind.
+            self.database().update_statistics_summary()
+            if not in_transaction:
+                if self.database().in_transaction():
+                    self.database().save()
+                # Keep the write-ahead log small.
+                self.database().checkpoint()
 
     def do_db_maintenance(self):
         if time.time() < self.config()["last_db_maintenance"] + 30 * DAY:
@@ -124,10 +144,10 @@ class DefaultController(Controller):
         self.flush_sync_server()
         self.component_manager.current("add_cards_dialog")\
             (component_manager=self.component_manager).activate()
-        # This dialog calls 'create_new_cards' at some point.
+        # This dialog calls 'create_new_cards' at some point, which also
+        # updates the counters.
         self.database().save()
         review_controller = self.review_controller()
-        review_controller.reload_counters()
         if review_controller.card is None:
             review_controller.show_new_question()
         else:
@@ -232,6 +252,7 @@ class DefaultController(Controller):
                     self.component_manager.current("edit_card_dialog")\
                         (card, component_manager=self.component_manager,
                          allow_cancel=False).activate()
+                    self.review_controller().reload_counters()
                     return db.cards_from_fact(fact)
         # Create cards.
         cards = card_type.create_sister_cards(fact)
@@ -243,12 +264,58 @@ class DefaultController(Controller):
             self.scheduler().set_initial_grade(cards, grade)
             for card in cards:
                 db.update_card(card, repetition_only=True)
+        self.review_controller().adjust_counters((0, 0, 0),
+            self.scheduler().counts_for_cards(cards))
         if save:
             db.save()
         if self.review_controller().learning_ahead == True:
             self.reset_study_mode()
         return cards
 
+    def create_new_cards_bulk(self, facts_data, save=True):
+
+        """Bulk version of 'create_new_cards', typically used by importers.
+        'facts_data' is an iterable of (fact_data, card_type, grade,
+        tag_names) tuples. Returns a list with for each fact the list of its
+        sister cards.
+
+        All the facts, cards, tags and log entries are added to the database in
+        bulk in a single transaction. There is no check for duplicates.
+
+        """
+
+        db = self.database()
+        facts, cards_for_fact, tags_for_tag_names = [], [], {}
+        for fact_data, card_type, grade, tag_names in facts_data:
+            assert grade in [-1, 2, 3, 4, 5] # Use -1 for yet to learn cards.
+            assert card_type.is_fact_data_valid(fact_data)
+            # Many facts will have the same tags, e.g. during import.
+            key = tuple(tag_names)
+            if key not in tags_for_tag_names:
+                tags_for_tag_names[key] = db.get_or_create_tags_with_names(\
+                    self._retain_only_child_tags(tag_names))
+            fact = Fact(fact_data)
+            cards = card_type.create_sister_cards(fact)
+            for card in cards:
+                card.tags = set(tags_for_tag_names[key])
+            facts.append(fact)
+            cards_for_fact.append((cards, grade))
+        db.add_facts_and_cards(facts,
+            [card for cards, grade in cards_for_fact for card in cards])
+        for cards, grade in cards_for_fact:
+            if grade >= 2:
+                self.scheduler().set_initial_grade(cards, grade)
+                for card in cards:
+                    db.update_card(card, repetition_only=True)
+        self.review_controller().adjust_counters((0, 0, 0),
+            self.scheduler().counts_for_cards(card for cards, grade in \
+            cards_for_fact for card in cards))
+        if save:
+            db.save()
+        if self.review_controller().learning_ahead == True:
+            self.reset_study_mode()
+        return [cards for cards, grade in cards_for_fact]
+
     def show_edit_card_dialog(self):
         self.stopwatch().pause()
         self.flush_sync_server()
@@ -261,7 +328,6 @@ class DefaultController(Controller):
         if not accepted:
             self.stopwatch().unpause()
             return
-        review_controller.reload_counters()
         # Our current card could have disappeared from the database here,
         # e.g. when converting a front-to-back card to a cloze card, which
         # deletes the old cards and their learning history.
@@ -291,8 +357,11 @@ class DefaultController(Controller):
         if old_card_type == new_card_type:
             return 0
         db = self.database()
+        sch = self.scheduler()
+        review_controller = self.review_controller()
         cards_from_fact = db.cards_from_fact(fact)
         assert cards_from_fact[0].card_type == old_card_type
+        old_counts = sch.counts_for_cards(cards_from_fact)
         if not new_card_type.is_fact_data_valid(new_fact_data):
             self.main_widget().show_error(\
         _("Card data not correctly formatted for conversion.\n\nSkipping ") +\
@@ -318,6 +387,8 @@ class DefaultController(Controller):
                     card.card_type = new_card_type
                     card.fact_view = new_fact_view_for[card.fact_view]
                     db.update_card(card)
+                review_controller.adjust_counters(old_counts,
+                    sch.counts_for_cards(edited_cards))
                 return 0
             else:
                 if warn:
@@ -341,6 +412,8 @@ class DefaultController(Controller):
                 # progress bars (e.g. from change_card_type) are not
                 # supported.
                 self.delete_facts_and_their_cards([fact], progress_bar=False)
+                # 'create_new_cards' takes care of the new cards.
+                review_controller.adjust_counters(old_counts, (0, 0, 0))
                 new_cards = self.create_new_cards(new_fact_data,
                     new_card_type, grade=-1, tag_names=tag_names)
                 # User cancelled in create_new_cards.
@@ -377,6 +450,8 @@ class DefaultController(Controller):
                 db.add_card(card)
             for card in edited_cards:
                 db.update_card(card)
+            review_controller.adjust_counters(old_counts,
+                sch.counts_for_cards(db.cards_from_fact(fact)))
             if new_cards and self.review_controller().learning_ahead:
                 self.reset_study_mode()
             return 0
@@ -403,6 +478,9 @@ class DefaultController(Controller):
         # be recreated from the new fact data. In that case, it is needed to
         # reload the fact from the database.
         fact = db.fact(card.fact._id, is_id_internal=True)
+        # Editing can create or delete cards, or change their activity (e.g.
+        # by adding a forbidden tag).
+        old_counts = sch.counts_for_cards(db.cards_from_fact(fact))
         # Update fact and create, delete and update cards.
         new_cards, edited_cards, deleted_cards = \
             new_card_type.edit_fact(fact, new_fact_data)
@@ -440,6 +518,9 @@ _("This card has different tags than its sister cards. Update tags for current c
             db.update_card(sister_card)
         for tag in old_tags:
             db.delete_tag_if_unused(tag)
+        self.review_controller().adjust_counters(old_counts,
+            sch.counts_for_cards(db.cards_from_fact(fact)))
+        self.review_controller().invalidate_prefetched_cards()
         db.save()
         return 0
 
@@ -521,8 +602,10 @@ _("This will add a tag 'Starred' to the current card, so that you can find it ba
         if answer == 0:  # Cancel.
             self.stopwatch().unpause()
             return
+        old_counts = self.scheduler().counts_for_cards(\
+            db.cards_from_fact(fact))
         self.delete_facts_and_their_cards([fact])
-        review_controller.reload_counters()
+        review_controller.adjust_counters(old_counts, (0, 0, 0))
         review_controller.show_new_question()
         self.stopwatch().unpause()
 
@@ -530,14 +613,18 @@ _("This will add a tag 'Starred' to the current card, so that you can find it ba
         assert len(facts) == len([fact.id for fact in facts])
         db = self.database()
         w = self.main_widget()
+        # Construct all the cards in bulk, instead of one fact at a time.
+        cards = list(db.cards_from_facts(facts))
         if progress_bar:
             w.set_progress_text(_("Deleting cards..."))
-            w.set_progress_range(len(facts))
+            w.set_progress_range(len(cards) + len(facts))
             w.set_progress_update_interval(50)
+        for card in cards:
+            self.scheduler().remove_from_queue_if_present(card)
+            db.delete_card(card, check_for_unused_tags=False)
+            if progress_bar:
+                w.increase_progress(1)
         for fact in facts:
-            for card in db.cards_from_fact(fact):
-                self.scheduler().remove_from_queue_if_present(card)
-                db.delete_card(card, check_for_unused_tags=False)
             db.delete_fact(fact)
             if progress_bar:
                 w.increase_progress(1)
@@ -840,6 +927,7 @@ _("The configuration database cannot be used to store cards."))
     def show_browse_cards_dialog(self):
         self.stopwatch().pause()
         self.flush_sync_server()
+        self.database().regenerate_pregenerated_data()
         review_controller = self.review_controller()
         self.component_manager.current("browse_cards_dialog")\
             (component_manager=self.component_manager).activate()
@@ -858,9 +946,9 @@ _("The configuration database cannot be used to store cards."))
             (component_manager=self.component_manager).activate()
 
     def show_activate_cards_dialog_post(self):
+        # This also reloads the counters.
         review_controller = self.review_controller()
         review_controller.reset_but_try_to_keep_current_card()
-        review_controller.reload_counters()
         review_controller.update_status_bar_counters()
         self.update_title()
         self.stopwatch().unpause()
@@ -875,7 +963,6 @@ _("This will tag all the cards in a given card type which have the same question
         self.database().tag_all_duplicates()
         review_controller = self.review_controller()
         review_controller.reset_but_try_to_keep_current_card()
-        review_controller.reload_counters()
         review_controller.update_status_bar_counters()
         self.stopwatch().unpause()
 
@@ -994,9 +1081,7 @@ _("This will tag all the cards in a given card type which have the same question
             (component_manager=self.component_manager).activate()
         self.database().save()
         self.log().saved_database()
-        review_controller = self.review_controller()
-        review_controller.reload_counters()
-        # Importing can edit the current card.
+        # Importing can edit the current card. This also reloads the counters.
         self.review_controller().reset_but_try_to_keep_current_card()
         self.review_controller().update_dialog(redraw_all=True)
         self.stopwatch().unpause()
@@ -121,3 +121,27 @@ class CriterionApplier(Component):
     def apply_to_database(self, criterion):
         raise NotImplementedError
 
+    def apply_to_cards(self, criterion, _card_ids=None, _tag_ids=None):
+
+        """Apply the criterion only to the cards with internal ids in
+        '_card_ids' and to the cards having a tag with internal id in
+        '_tag_ids', e.g. after the tags of these cards have changed.
+
+        By default, the criterion is applied to the entire database.
+
+        """
+
+        self.apply_to_database(criterion)
+
+    def apply_criterion_change(self, previous_criterion, criterion):
+
+        """Apply 'criterion' to a database to which 'previous_criterion' was
+        applied last, which allows an applier to only update the cards
+        affected by the difference between both.
+
+        By default, the criterion is applied to the entire database.
+
+        """
+
+        self.apply_to_database(criterion)
+
@@ -68,6 +68,34 @@ class Database(Component):
 
         raise NotImplementedError
 
+    def in_transaction(self):
+
+        """Returns True if there are changes which have not been saved yet,
+        e.g. because an operation is still in progress.
+
+        """
+
+        return False
+
+    def checkpoint(self):
+
+        """Move changes from the write-ahead log (if any) to the main database
+        file, so that the log does not keep growing.
+
+        """
+
+        pass
+
+    def regenerate_pregenerated_data(self, max_count=None):
+
+        """Fill in pregenerated data (e.g. the question and answer strings
+        used by the card browser) which has been postponed. Returns the
+        number of cards updated.
+
+        """
+
+        return 0
+
     def new(self, path):
         raise NotImplementedError
 
@@ -137,6 +165,12 @@ class Database(Component):
     def add_fact(self, fact):
         raise NotImplementedError
 
+    def add_facts(self, facts):
+        raise NotImplementedError
+
+    def add_facts_and_cards(self, facts, cards):
+        raise NotImplementedError
+
     def fact(self, id, is_id_internal):
         raise NotImplementedError
 
@@ -149,11 +183,17 @@ class Database(Component):
     def has_fact_with_id(self, id):
         return NotImplementedError
 
+    def facts_with_internal_ids(self, _fact_ids):
+        raise NotImplementedError
+
     # Cards.
 
     def add_card(self, card):
         raise NotImplementedError
 
+    def add_cards(self, cards):
+        raise NotImplementedError
+
     def card(self, id, is_id_internal):
         raise NotImplementedError
 
@@ -163,6 +203,9 @@ class Database(Component):
     def delete_card(self, card):
         raise NotImplementedError
 
+    def cards_with_internal_ids(self, _card_ids):
+        raise NotImplementedError
+
     def tags_from_cards_with_internal_ids(self, _card_ids):
         raise NotImplementedError
 
@@ -252,6 +295,12 @@ class Database(Component):
 
         raise NotImplementedError
 
+    def cards_from_facts(self, facts):
+
+        """Return an iterator over the cards deriving from a list of facts."""
+
+        raise NotImplementedError
+
     def duplicates_for_fact(self, fact, card_type):
 
         """Return facts with same 'card_type.unique_fact_keys' data as 'fact'."""
@@ -261,6 +310,15 @@ class Database(Component):
     def card_types_in_use(self):
         raise NotImplementedError
 
+    def search_cards(self, search_string, limit=None, offset=0):
+
+        """Return the _card_ids of the cards matching 'search_string', the
+        best matches first.
+
+        """
+
+        raise NotImplementedError
+
     # Card queries used by the scheduler. Returns tuples of internal ids
     # (_card_id, _fact_id) Should function as an iterator in order to save
     # memory. "sort_key" is a string of an attribute of Card to be used for
@@ -293,6 +351,15 @@ class Database(Component):
     # Extra queries for custom schedulers.
 
     def set_scheduler_data(self, scheduler_data):
+
+        """Set the scheduler data of all cards by starting a new session, in
+        which all cards without data of their own have 'scheduler_data'.
+
+        """
+
+        raise NotImplementedError
+
+    def set_scheduler_data_for_card(self, card, scheduler_data):
         raise NotImplementedError
 
     def cards_with_scheduler_data(self, scheduler_data, sort_key="", limit=-1,
@@ -356,6 +423,7 @@ class DatabaseMaintenance(Component):
     def run(self):
         self.main_widget().set_progress_text(_("Compacting database..."))
         self.database().archive_old_logs()
+        self.database().merge_archive_dir()
         self.database().defragment()
         self.main_widget().close_progress()
 
@@ -7,6 +7,7 @@ import sys
 import time
 import string
 import datetime
+import threading
 import copy as objcopy
 
 from openSM2sync.log_entry import EventTypes
@@ -49,6 +50,8 @@ SCHEMA = string.Template("""
     );
 
     create index i_data_for_fact on data_for_fact (_fact_id);
+    create index i_data_for_fact_2 on data_for_fact (key, value); /* for
+    duplicates_for_fact */
 
     create table cards(
         _id integer primary key,
@@ -199,14 +202,158 @@ pregenerated_data = """
         tags text,
 """
 
+# Lets 'regenerate_pregenerated_data' find the cards which still need to be
+# rendered without scanning the entire cards table.
+UNRENDERED_CARDS_INDEX = """
+    create index if not exists i_cards_4 on cards (_id) where question is null
+"""
+
+# Full text index on the pregenerated data, kept up to date by triggers. The
+# table and the triggers are always (re)created together, as triggers without
+# a matching index corrupt it, and an index without triggers gets out of date.
+# The trigram tokenizer allows matching in the middle of words and in scripts
+# without spaces between the words, like the 'like' search it replaces.
+
+FULL_TEXT_INDEX_TRIGGERS = ["cards_fts_insert", "cards_fts_delete",
+    "cards_fts_update"]
+
+# These are lists of separate statements, so that they can be executed
+# inside an existing transaction, which 'executescript' would commit.
+
+DROP_FULL_TEXT_INDEX = [
+    "drop trigger if exists cards_fts_insert",
+    "drop trigger if exists cards_fts_delete",
+    "drop trigger if exists cards_fts_update",
+    "drop table if exists cards_fts"]
+
+FULL_TEXT_INDEX = ["""
+    create virtual table cards_fts using fts5(question, answer, tags,
+        content='cards', content_rowid='_id', tokenize='trigram')
+    ""","""
+    create trigger cards_fts_insert after insert on cards begin
+        insert into cards_fts(rowid, question, answer, tags)
+            values(new._id, new.question, new.answer, new.tags);
+    end
+    ""","""
+    create trigger cards_fts_delete after delete on cards begin
+        insert into cards_fts(cards_fts, rowid, question, answer, tags)
+            values('delete', old._id, old.question, old.answer, old.tags);
+    end
+    ""","""
+    create trigger cards_fts_update after update of question, answer, tags
+        on cards begin
+        insert into cards_fts(cards_fts, rowid, question, answer, tags)
+            values('delete', old._id, old.question, old.answer, old.tags);
+        insert into cards_fts(rowid, question, answer, tags)
+            values(new._id, new.question, new.answer, new.tags);
+    end
+    """]
+
+# Daily summaries of the log, so that the statistics don't need to scan the
+# entire log. They are brought up to date incrementally, starting from the
+# last log _id which was processed (see SQLite_statistics.py). 'day' is the
+# local date in ISO format, taking 'day_starts_at' into account.
+
+STATISTICS_SUMMARY = """
+    create table if not exists repetitions_for_day(
+        day text,
+        grade integer,
+        reps integer,
+        scheduled_reps integer, /* scheduled_interval!=0 */
+        learned_reps integer, /* grade>=2 and ret_reps==0 */
+        thinking_time integer,
+        primary key (day, grade)
+    );
+
+    /* Counts for all the other event types. */
+
+    create table if not exists events_for_day(
+        day text,
+        event_type integer,
+        count integer,
+        primary key (day, event_type)
+    );
+
+    /* Largest scheduled count logged by each machine when loading or saving
+       the database, '' for machines which did not log their id. */
+
+    create table if not exists scheduled_count_for_day(
+        day text,
+        machine text,
+        scheduled_count integer,
+        primary key (day, machine)
+    );
+"""
+
+# Scheduler data which is only valid during a session, e.g. the state of the
+# cards in the cramming scheduler. Starting a new session just increases the
+# session number kept in 'global_variables', after which all cards without a
+# row for the current session have the default value for that session. That
+# way, only the cards which are actually seen get a row written.
+
+SCHEDULER_DATA_FOR_SESSION = """
+    create table if not exists scheduler_data_for_session(
+        _card_id integer primary key,
+        session integer,
+        data integer
+    );
+"""
+
+# Compact storage for old repetitions, see 'compact_log'. The card ids are
+# stored only once in 'log_object_ids', the event type is implied and next_rep
+# is stored relative to the timestamp, which makes for smaller integers.
+# Queries which need to see all of the log read from the view 'log_all',
+# which has the same columns as 'log'.
+
+COMPACT_LOG = string.Template("""
+    create table if not exists log_object_ids(
+        _id integer primary key,
+        object_id text unique
+    );
+
+    create table if not exists log_compact(
+        _id integer primary key,
+        timestamp integer,
+        _object_id integer,
+        grade integer,
+        easiness real,
+        acq_reps integer,
+        ret_reps integer,
+        lapses integer,
+        acq_reps_since_lapse integer,
+        ret_reps_since_lapse integer,
+        scheduled_interval integer,
+        actual_interval integer,
+        thinking_time integer,
+        next_rep_interval integer,
+        scheduler_data integer
+    );
+    create index if not exists i_log_compact_timestamp on
+        log_compact (timestamp);
+    create index if not exists i_log_compact_object_id on
+        log_compact (_object_id);
+
+    create view if not exists log_all as
+        select * from log
+        union all
+        select log_compact._id, $repetition, timestamp, object_id, grade,
+        easiness, acq_reps, ret_reps, lapses, acq_reps_since_lapse,
+        ret_reps_since_lapse, scheduled_interval, actual_interval,
+        thinking_time, timestamp + next_rep_interval, scheduler_data
+        from log_compact join log_object_ids
+        on log_object_ids._id=log_compact._object_id;
+""").substitute(repetition=EventTypes.REPETITION)
+
 from mnemosyne.libmnemosyne.databases.SQLite_sync import SQLiteSync
 from mnemosyne.libmnemosyne.databases.SQLite_media import SQLiteMedia
 from mnemosyne.libmnemosyne.databases.SQLite_logging import SQLiteLogging
 from mnemosyne.libmnemosyne.databases.SQLite_statistics import SQLiteStatistics
+from mnemosyne.libmnemosyne.databases.SQLite_identity_map import \
+     SQLiteIdentityMap
 
 
 class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
-             SQLiteStatistics):
+             SQLiteStatistics, SQLiteIdentityMap):
 
     """Note that most of the time, commiting is done elsewhere, e.g. by
     calling save in the main controller, in order to have a better control
@@ -227,8 +374,20 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
     def __init__(self, component_manager):
         Database.__init__(self, component_manager)
         self._connection = None
+        self._connection_thread_id = None
+        self._readers = None
+        self._query_statistics = None
+        # Settings with which '_query_statistics' was created.
+        self._query_statistics_settings = None
         self._path = None # Needed for lazy creation of connection.
         self._current_criterion = None # Cached for performance reasons.
+        # Whether there are cards with stale pregenerated data, None if
+        # unknown.
+        self._pregenerated_data_stale = None
+        self._has_full_text_index = False
+        # Class and data of the criterion last applied to the entire
+        # database, None if unknown.
+        self._applied_criterion = None
         # Some operations have side-effects which cause additional log events,
         # like in _process_media, or when updating criteria as side effects of
         # e.g. adding tags.
@@ -240,6 +399,8 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
         # effects to be disabled/enabled.
         self.importing = False
         self.importing_with_learning_data = False
+        # Cache for hydrated objects, only enabled after loading a database.
+        self._create_identity_maps()
 
     #
     # File operations.
@@ -252,11 +413,46 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
 
         if not self._connection:
             from mnemosyne.libmnemosyne.databases._sqlite3 import _Sqlite3
-            self._connection = _Sqlite3(self.component_manager, self._path)
+            self._connection = _Sqlite3(self.component_manager, self._path,
+                wal=self.config()["wal_mode"],
+                query_statistics=self.query_statistics(),
+                max_deferred=self.config()["log_buffer_size"])
+            self._connection_thread_id = threading.get_ident()
             #from mnemosyne.libmnemosyne.databases._apsw import _APSW
             #self._connection = _APSW(self.component_manager, self._path)
         return self._connection
 
+    @property
+    def read_con(self):
+
+        """Connection for queries which only read from the database.
+
+        In WAL mode, threads other than the one holding the (writing)
+        connection get a read-only connection from a pool, such that they can
+        read while e.g. a sync is writing to the database. They will only see
+        changes which have been committed.
+
+        The thread holding the connection uses that connection, so that it
+        sees its own uncommitted changes.
+
+        """
+
+        if not self.config()["wal_mode"] or not self._connection or \
+            self._connection_thread_id == threading.get_ident():
+            return self.con
+        if self._readers is None:
+            from mnemosyne.libmnemosyne.databases._sqlite3 import \
+                 _Sqlite3ReaderPool
+            self._readers = _Sqlite3ReaderPool(self.component_manager,
+                self._path, self.config()["database_readers"],
+                self.query_statistics())
+        return self._readers.connection()
+
+    def _close_readers(self):
+        if self._readers is not None:
+            self._readers.close()
+            self._readers = None
+
     def release_connection(self):
 
         """Release the connection, so that it may be recreated in a separate
@@ -264,10 +460,93 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
 
         """
 
+        self._close_readers()
         if self._connection:
             self._connection.commit()
             self._connection.close()
             self._connection = None
+            self._connection_thread_id = None
+
+    def query_statistics(self):
+
+        """Statistics about the executed queries, or None if neither
+        'database_profiling' nor 'slow_query_threshold' is set in the config.
+        Queries slower than the threshold are also logged to
+        'slow_queries.txt' in the data directory.
+
+        Changes to these settings take effect the next time this gets called,
+        e.g. when a connection gets created. The statistics collected so far
+        are discarded then.
+
+        """
+
+        settings = (self.config()["database_profiling"],
+            self.config()["slow_query_threshold"], self.config().data_dir)
+        if settings == self._query_statistics_settings:
+            return self._query_statistics
+        self._close_query_statistics()
+        self._query_statistics_settings = settings
+        if self.config()["database_profiling"] or \
+            self.config()["slow_query_threshold"] > 0:
+            from mnemosyne.libmnemosyne.databases._sqlite3 import \
+                 QueryStatistics
+            self._query_statistics = QueryStatistics(\
+                self.config()["slow_query_threshold"],
+                os.path.join(self.config().data_dir, "slow_queries.txt"))
+        # Existing connections should use the new settings too.
+        if self._connection:
+            self._connection.query_statistics = self._query_statistics
+        if self._readers is not None:
+            self._readers.set_query_statistics(self._query_statistics)
+        return self._query_statistics
+
+    def _close_query_statistics(self):
+        if self._query_statistics is not None:
+            self._query_statistics.close()
+            self._query_statistics = None
+        self._query_statistics_settings = None
+
+    def dump_query_statistics(self, filename=None):
+
+        """Write the query statistics to 'filename' (by default
+        'query_statistics.txt' in the data directory), sorted by the total
+        time spent in each query. Returns the filename, or None if there are
+        no statistics.
+
+        """
+
+        if self._query_statistics is None:
+            return None
+        if filename is None:
+            filename = os.path.join(self.config().data_dir,
+                "query_statistics.txt")
+        with open(filename, "w", encoding="utf-8") as f:
+            self._query_statistics.dump(f)
+        return filename
+
+    def reset_query_statistics(self):
+        if self._query_statistics is not None:
+            self._query_statistics.reset()
+
+    def in_transaction(self):
+        return self._connection is not None and self.con.in_transaction
+
+    def checkpoint(self, mode="passive"):
+
+        """Copy the contents of the write-ahead log to the database file.
+
+        A "passive" checkpoint does as much as it can without waiting for
+        readers or writers, "truncate" also resets the log file afterwards.
+        Does nothing if the connection is held by another thread, or if a
+        transaction is in progress, as we don't want to commit half of it.
+
+        """
+
+        if not self.config()["wal_mode"] or not self._connection or \
+            self._connection_thread_id != threading.get_ident() or \
+            self.con.in_transaction:
+            return
+        self.con.execute("pragma wal_checkpoint(%s)" % mode)
 
     def path(self):
         return self._path
@@ -287,6 +566,11 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
 
     def defragment(self):
         self.main_widget().set_progress_text(_("Defragmenting database..."))
+        self.compact_log()
+        self.con.commit()
+        # Switching older databases to incremental auto_vacuum only takes
+        # effect during a full vacuum.
+        self.con.execute("pragma auto_vacuum=incremental")
         self.con.execute("vacuum")
         # Make sure the "Untagged" tag does not show up together with
         # different tags (not sure if bug causing this has been fixed).
@@ -303,6 +587,7 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
         # Make sure no orphaned card tags exist (not sure if bug causing
         # this has been fixed).
         self.con.execute("delete from tags_for_card where _card_id is null")
+        self._forget_all()
         self.main_widget().close_progress()
 
     def new(self, path):
@@ -310,14 +595,28 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
         self._path = expand_path(path, self.config().data_dir)
         if os.path.exists(self._path):
             os.remove(self._path)
+        self._create_identity_maps(self.config()["identity_map_size"])
+        self._pregenerated_data_stale = None
+        self._has_full_text_index = False
+        self._applied_criterion = None
         self.create_media_dir_if_needed()
+        # Allow archiving logs to give back space a bit at a time. Since the
+        # file already got created when setting the journal mode, this needs
+        # a vacuum, which is instantaneous at this point.
+        self.con.execute("pragma auto_vacuum=incremental")
+        self.con.execute("vacuum")
         # Create tables.
         if self.store_pregenerated_data:
             self.con.executescript(\
                 SCHEMA.substitute(pregenerated_data=pregenerated_data))
+            self.con.execute(UNRENDERED_CARDS_INDEX)
+            self._create_full_text_index()
         else:
             self.con.executescript(\
                 SCHEMA.substitute(pregenerated_data=""))
+        self.con.executescript(STATISTICS_SUMMARY)
+        self._create_scheduler_data_for_session()
+        self.con.executescript(COMPACT_LOG)
         self.con.execute(\
             "insert into global_variables(key, value) values(?,?)",
             ("version", self.version))
@@ -345,6 +644,10 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
         self._path = expand_path(path, self.config().data_dir)
         if not os.path.exists(self._path):
             return self.new(path)
+        self._create_identity_maps(self.config()["identity_map_size"])
+        self._pregenerated_data_stale = None
+        self._has_full_text_index = False
+        self._applied_criterion = None
         # Check database version.
         try:
             sql_res = self.con.execute("""select value from global_variables
@@ -367,8 +670,33 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
                 raise RuntimeError(_("Database upgrade failed."))
         self.create_media_dir_if_needed()
         # Upgrade.
+        if self.con.execute("pragma auto_vacuum").fetchone()[0] != 2:
+            # Older databases only switch to incremental auto_vacuum during
+            # a full vacuum, which we do once here, as otherwise archiving old
+            # logs never gives any space back to the file system.
+            self.main_widget().set_progress_text(_("Upgrading database..."))
+            self.con.commit()
+            self.con.execute("pragma auto_vacuum=incremental")
+            self.con.execute("vacuum")
+            self.main_widget().close_progress()
         self.con.execute("""create index if not exists
             i_cards_3 on cards (_fact_id);""")
+        self.con.execute("""create index if not exists
+            i_data_for_fact_2 on data_for_fact (key, value);""")
+        self.con.executescript(STATISTICS_SUMMARY)
+        self._create_scheduler_data_for_session()
+        self.con.executescript(COMPACT_LOG)
+        if self.store_pregenerated_data:
+            # E.g. a binary download from a server which does not store the
+            # pregenerated data has no question column.
+            if "question" in [cursor[1] for cursor in \
+                self.con.execute("pragma table_info(cards)")]:
+                self.con.execute(UNRENDERED_CARDS_INDEX)
+            else:
+                self._pregenerated_data_stale = False
+            self._has_full_text_index = self._full_text_index_is_complete()
+            if not self._has_full_text_index:
+                self._create_full_text_index()
         # Activate all the plugins needed for all the card types.
         # Sometimes corruption keeps the global_variables table intact,
         # but not the cards table...
@@ -413,8 +741,9 @@ class SQLite(Database, SQLiteSync, SQLiteMedia, SQLiteLogging,
                 if ctypes.windll.kernel32.GetDriveTypeW("%s\\" % drive) == 4:
                     raise RuntimeError(\
 _("Putting a database on a network drive is forbidden under Windows to avoid data corruption."))
-            copy(self._path, dest_path)
+            self.con.copy_to(dest_path)
             self._path = dest_path
+            self._close_readers()
         self.config()["last_database"] \
             = contract_path(path, self.config().data_dir)
         # We don't log every save, as that could result in an event after
@@ -435,7 +764,7 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         backupfile = os.path.join(backupdir, backupfile)
         failed = False
         try:
-            copy(self._path, backupfile)
+            self.con.copy_to(backupfile)
         except:
             failed = True
         if failed or not os.path.exists(backupfile) or \
@@ -482,19 +811,27 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
                 f.run()
             self.log().dump_to_science_log()
             self.backup()  # Saves too.
+            self._close_readers()
             self._connection.close()
         except Exception as e:
             pass
         finally:
             self._connection = None
+            self._connection_thread_id = None
             self._path = None
+            self._close_query_statistics()
+            self._forget_all()
         return True
 
     def abandon(self):
+        self._close_readers()
         if self._connection:
             self._connection.close()
         self._connection = None
+        self._connection_thread_id = None
         self._path = None
+        self._close_query_statistics()
+        self._forget_all()
 
     def is_loaded(self):
         return self._connection is not None
@@ -511,6 +848,22 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
             accessible = False
         return accessible
 
+    def _global_variable(self, key):
+        sql_res = self.con.execute(\
+            "select value from global_variables where key=?",
+            (key, )).fetchone()
+        return sql_res[0] if sql_res else None
+
+    def _set_global_variable(self, key, value):
+        if self._global_variable(key) is None:
+            self.con.execute(\
+                "insert into global_variables(key, value) values(?,?)",
+                (key, value))
+        else:
+            self.con.execute(\
+                "update global_variables set value=? where key=?",
+                (value, key))
+
     def is_empty(self):
         return self.tag_count() == 1 and self.fact_count() == 0 and \
             self.con.execute("""select count() from log where event_type=? or
@@ -627,18 +980,26 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         # save some time.
 
     def tag(self, id, is_id_internal):
+        tag = self._tag_map.get(id, is_id_internal)
+        if tag is not None:
+            return tag
         if is_id_internal:
             sql_res = self.con.execute("""select _id, id, name, extra_data
                 from tags where _id=?""", (id, )).fetchone()
         else:
             sql_res = self.con.execute("""select _id, id, name, extra_data
                 from tags where id=?""", (id, )).fetchone()
+        return self._construct_tag(sql_res)
+
+    def _construct_tag(self, sql_res):
         tag = Tag(sql_res[2], sql_res[1])
         tag._id = sql_res[0]
         self._construct_extra_data(sql_res[3], tag)
+        self._tag_map.add(tag)
         return tag
 
     def update_tag(self, tag):
+        self._forget_tag(tag._id)
         self.log().edited_tag(tag)
         # Corner case: change tag name into the name of an existing tag.
         new_name = tag.name
@@ -687,24 +1048,29 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
 
     def _update_tag_strings(self, _card_ids):
         # To speed up the process, we don't construct the entire card object,
-        # but take shortcuts.
-        for _card_id in _card_ids:
-            tag_names = []
-            for cursor in self.con.execute("""select _tag_id from
-                tags_for_card where _card_id=?""", (_card_id, )):
-                tag_name = self.con.execute(\
-                    "select name from tags where _id=?",
-                    (cursor[0], )).fetchone()[0]
+        # but fetch the tag names of all the cards at once, 500 cards at a
+        # time to deal with sqlite limitations.
+        _card_ids = list(set(_card_ids))
+        tag_names_for_card = {}
+        for i in range(0, len(_card_ids), 500):
+            chunk = _card_ids[i:i+500]
+            for _card_id in chunk:
+                tag_names_for_card[_card_id] = []
+            for _card_id, tag_name in self.con.execute(\
+                """select tags_for_card._card_id, tags.name from tags_for_card
+                join tags on tags._id=tags_for_card._tag_id where
+                tags_for_card._card_id in (%s)""" % \
+                ",".join([str(_card_id) for _card_id in chunk])):
                 if tag_name != "__UNTAGGED__":
-                    tag_names.append(tag_name)
-            sorted_tag_names = sorted(tag_names, key=numeric_string_cmp_key)
-            tag_string = ", ".join(sorted_tag_names)
-            self.con.execute("update cards set tags=? where _id=?",
-                (tag_string, _card_id))
+                    tag_names_for_card[_card_id].append(tag_name)
+        self.con.executemany("update cards set tags=? where _id=?",
+            ((", ".join(sorted(tag_names, key=numeric_string_cmp_key)),
+            _card_id) for _card_id, tag_names in tag_names_for_card.items()))
 
     def delete_tag(self, tag):
         if tag.id == "__UNTAGGED__":
             return
+        self._forget_tag(tag._id)
         self.con.execute("delete from tags where _id=?", (tag._id, ))
         _card_ids_affected = [cursor[0] for cursor in self.con.execute(
             "select _card_id from tags_for_card where _tag_id=?",
@@ -721,8 +1087,6 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
             self._update_tag_strings(_card_ids_affected)
         # Update criteria, as e.g. deleting a forbidden tag needs to
         # reactive the cards having this tag.
-        # TODO: some speed-up could be had here be only running the applier
-        # if the tag was relevant for the current criterion.
         self.log().deleted_tag(tag)
         # When syncing, don't bother to check for updates to criteria here, as
         # there will be separate log events coming later to deal with this
@@ -733,10 +1097,7 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         for criterion in self.criteria():
             criterion.tag_deleted(tag)
             self.update_criterion(criterion)
-        criterion = self.current_criterion()
-        applier = self.component_manager.current("criterion_applier",
-            used_for=criterion.__class__)
-        applier.apply_to_database(criterion)
+        self._apply_current_criterion(_card_ids=_card_ids_affected)
         del tag
 
     def delete_tag_if_unused(self, tag):
@@ -787,7 +1148,58 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         # Process media files.
         self._process_media(fact)
 
+    def add_facts(self, facts):
+
+        """Bulk version of 'add_fact', which inserts all the facts and their
+        data using a fixed number of queries.
+
+        """
+
+        facts = list(facts)
+        if len(facts) == 0:
+            return
+        self._insert_facts(facts)
+        self.log().added_facts(facts)
+        # Process media files.
+        for fact in facts:
+            self._process_media(fact)
+
+    def add_facts_and_cards(self, facts, cards):
+
+        """Combination of 'add_facts' and 'add_cards', which logs each fact
+        followed by its cards, as adding them one at a time would.
+
+        """
+
+        facts, cards = list(facts), list(cards)
+        self._insert_facts(facts)
+        self._insert_cards(cards)
+        self.log().added_facts_and_cards(facts, cards)
+        for fact in facts:
+            self._process_media(fact)
+        if self.store_pregenerated_data:
+            self._pregenerate_data(cards)
+
+    def _insert_facts(self, facts):
+        if len(facts) == 0:
+            return
+        # We assign the _ids ourselves, such that we can use executemany.
+        # These are the same _ids sqlite would choose.
+        _fact_id = self.con.execute(\
+            "select max(_id) from facts").fetchone()[0] or 0
+        for fact in facts:
+            _fact_id += 1
+            fact._id = _fact_id
+        self.con.executemany("insert into facts(_id, id) values(?,?)",
+            ((fact._id, fact.id) for fact in facts))
+        self.con.executemany("""insert into data_for_fact(_fact_id, key, value)
+            values(?,?,?)""", ((fact._id, fact_key, value) for fact in facts
+            for fact_key, value in fact.data.items() if value))
+
     def fact(self, id, is_id_internal):
+        fact = self._fact_map.get(id, is_id_internal)
+        if fact is not None:
+            return fact
         if is_id_internal:
             sql_res = self.con.execute("""select _id, id, extra_data from
                 facts where _id=?""", (id, )).fetchone()
@@ -802,20 +1214,77 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         fact = Fact(fact_data, id=sql_res[1])
         fact._id = sql_res[0]
         self._construct_extra_data(sql_res[2], fact)
+        self._fact_map.add(fact)
         return fact
 
+    def facts_with_internal_ids(self, _fact_ids):
+
+        """Return an iterator over the facts with internal ids '_fact_ids',
+        in the same order, constructed in chunks with a fixed number of
+        queries per chunk. Ids of facts which no longer exist are skipped.
+
+        """
+
+        _fact_ids = list(_fact_ids)
+        for i in range(0, len(_fact_ids), 500):
+            chunk = _fact_ids[i:i+500]
+            fact_for__id = self._facts_with_internal_ids(chunk)
+            for _fact_id in chunk:
+                if _fact_id in fact_for__id:
+                    yield fact_for__id[_fact_id]
+
+    def _facts_with_internal_ids(self, _fact_ids):
+        fact_for__id = {}
+        _fact_ids_to_fetch = []
+        for _fact_id in set(_fact_ids):
+            fact = self._fact_map.get(_fact_id, is_id_internal=True)
+            if fact is None:
+                _fact_ids_to_fetch.append(_fact_id)
+            else:
+                fact_for__id[_fact_id] = fact
+        if len(_fact_ids_to_fetch) == 0:
+            return fact_for__id
+        _ids = ",".join([str(_fact_id) for _fact_id in _fact_ids_to_fetch])
+        data_for__id = {}
+        for _fact_id, key, value in self.con.execute("""select _fact_id, key,
+            value from data_for_fact where _fact_id in (%s)""" % _ids):
+            data_for__id.setdefault(_fact_id, {})[key] = value
+        for _id, id, extra_data in self.con.execute(\
+            "select _id, id, extra_data from facts where _id in (%s)" % _ids):
+            fact = Fact(data_for__id.get(_id, {}), id=id)
+            fact._id = _id
+            self._construct_extra_data(extra_data, fact)
+            self._fact_map.add(fact)
+            fact_for__id[_id] = fact
+        return fact_for__id
+
     def update_fact(self, fact):
+        new_data = dict((key, value) for key, value in fact.data.items()
+            if value)
+        data_changed = new_data != dict(self.con.execute(\
+            "select key, value from data_for_fact where _fact_id=?",
+            (fact._id, )).fetchall())
         # Delete data_for_fact and recreate it.
         self.con.execute("delete from data_for_fact where _fact_id=?",
             (fact._id, ))
         self.con.executemany("""insert into data_for_fact(_fact_id, key, value)
             values(?,?,?)""", ((fact._id, key, value)
-                for key, value in fact.data.items() if value))
+                for key, value in new_data.items()))
         self.log().edited_fact(fact)
+        # With deferred rendering, 'update_card' only marks the question and
+        # answer as stale if the card type, fact or fact view changed, so
+        # changes to the fact data are dealt with here.
+        if data_changed and self.store_pregenerated_data and \
+            self.config()["defer_pregenerated_data"]:
+            self.con.execute("""update cards set question=null, answer=null
+                where _fact_id=?""", (fact._id, ))
+            self._pregenerated_data_stale = True
         # Process media files.
         self._process_media(fact)
+        self._forget_fact(fact._id)
 
     def delete_fact(self, fact):
+        self._forget_fact(fact._id)
         self.con.execute("delete from facts where _id=?", (fact._id, ))
         self.con.execute("delete from data_for_fact where _fact_id=?",
             (fact._id, ))
@@ -873,10 +1342,7 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
             card.active,))
         card._id = self.con.last_insert_rowid()
         if self.store_pregenerated_data:
-            self.con.execute(\
-                "update cards set question=?, answer=?, tags=? where _id=?",
-                (card.question("plain_text"), card.answer("plain_text"),
-                card.tag_string(), card._id))
+            self._pregenerate_data([card])
         # Link card to its tags. The tags themselves have already been created
         # by default_controller calling get_or_create_tag_with_name.
         # Note: using executemany here is often slower here as cards mostly
@@ -886,20 +1352,205 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
                 _card_id) values(?,?)""", (tag._id, card._id))
         self.log().added_card(card)
 
+    def add_cards(self, cards):
+
+        """Bulk version of 'add_card', which inserts all the cards, their tags
+        and their log entries using a fixed number of queries. The facts of
+        the cards should already be in the database.
+
+        """
+
+        cards = list(cards)
+        if len(cards) == 0:
+            return
+        self._insert_cards(cards)
+        self.log().added_cards(cards)
+        # Render the pregenerated data only once all the cards are in.
+        if self.store_pregenerated_data:
+            self._pregenerate_data(cards)
+
+    def _insert_cards(self, cards):
+        if len(cards) == 0:
+            return
+        criterion = self.current_criterion()
+        untagged = None
+        for card in cards:
+            if len(card.tags) == 0:
+                if untagged is None:
+                    untagged = \
+                        self.get_or_create_tag_with_name("__UNTAGGED__")
+                card.tags.add(untagged)
+            criterion.apply_to_card(card)
+        _card_id = self.con.execute(\
+            "select max(_id) from cards").fetchone()[0] or 0
+        for card in cards:
+            _card_id += 1
+            card._id = _card_id
+        self.con.executemany("""insert into cards(_id, id, card_type_id,
+            _fact_id, fact_view_id, grade, next_rep, last_rep, easiness,
+            acq_reps, ret_reps, lapses, acq_reps_since_lapse,
+            ret_reps_since_lapse, creation_time, modification_time,
+            extra_data, scheduler_data, active) values(?,?,?,?,?,?,?,?,?,?,
+            ?,?,?,?,?,?,?,?,?)""", ((card._id, card.id, card.card_type.id,
+            card.fact._id, card.fact_view.id, card.grade, card.next_rep,
+            card.last_rep, card.easiness, card.acq_reps, card.ret_reps,
+            card.lapses, card.acq_reps_since_lapse, card.ret_reps_since_lapse,
+            card.creation_time, card.modification_time,
+            self._repr_extra_data(card.extra_data), card.scheduler_data,
+            card.active) for card in cards))
+        self.con.executemany("""insert into tags_for_card(_tag_id, _card_id)
+            values(?,?)""", ((tag._id, card._id) for card in cards
+            for tag in card.tags))
+
+    def _pregenerate_data(self, cards, render=True):
+
+        """Store the tag strings of the cards. If 'render' is True, their
+        question and answer are rendered immediately, or, if
+        'defer_pregenerated_data' is set in the config, set to null, to be
+        rendered in bulk later by 'regenerate_pregenerated_data'.
+
+        """
+
+        if not render:
+            self.con.executemany("update cards set tags=? where _id=?",
+                [(card.tag_string(), card._id) for card in cards])
+        elif self.config()["defer_pregenerated_data"]:
+            self.con.executemany("""update cards set question=null,
+                answer=null, tags=? where _id=?""",
+                [(card.tag_string(), card._id) for card in cards])
+            self._pregenerated_data_stale = True
+        else:
+            self.con.executemany(\
+                "update cards set question=?, answer=?, tags=? where _id=?",
+                [(card.question("plain_text"), card.answer("plain_text"),
+                card.tag_string(), card._id) for card in cards])
+
+    def regenerate_pregenerated_data(self, max_count=None):
+
+        """Render the question and answer of the cards which are still
+        missing them. If 'max_count' is given, at most that many cards get
+        rendered. Returns the number of cards rendered.
+
+        """
+
+        if not self.store_pregenerated_data or \
+            self._pregenerated_data_stale == False:
+            return 0
+        query = "select _id from cards where question is null"
+        if max_count:
+            query += " limit %d" % max_count
+        _card_ids = [cursor[0] for cursor in self.con.execute(query)]
+        for i in range(0, len(_card_ids), 500):
+            self.con.executemany(\
+                "update cards set question=?, answer=? where _id=?",
+                [(card.question("plain_text"), card.answer("plain_text"),
+                card._id) for card in \
+                self.cards_with_internal_ids(_card_ids[i:i+500])])
+        if not max_count or len(_card_ids) < max_count:
+            self._pregenerated_data_stale = False
+        return len(_card_ids)
+
+    def _full_text_index_is_complete(self):
+        sql_for_name = dict(self.con.execute(\
+            """select name, sql from sqlite_master where (type='table' and
+            name='cards_fts') or (type='trigger' and tbl_name='cards' and
+            name like 'cards_fts_%')""").fetchall())
+        # Older versions used a tokenizer which only matched whole words.
+        return set(sql_for_name) == \
+            set(["cards_fts"] + FULL_TEXT_INDEX_TRIGGERS) and \
+            "trigram" in sql_for_name["cards_fts"]
+
+    def _create_full_text_index(self):
+        # Not all builds of SQLite have the FTS5 extension, in which case
+        # 'search_cards' falls back to a slower search. Make sure no triggers
+        # are left behind then, as they would make every write to the cards
+        # table fail.
+        try:
+            for statement in DROP_FULL_TEXT_INDEX + FULL_TEXT_INDEX:
+                self.con.execute(statement)
+            self.con.execute(\
+                "insert into cards_fts(cards_fts) values('rebuild')")
+        except Exception:
+            for statement in DROP_FULL_TEXT_INDEX:
+                self.con.execute(statement)
+            self._has_full_text_index = False
+        else:
+            self._has_full_text_index = True
+
+    def full_text_query(self, search_string):
+
+        """Convert a search string from the user into a full text query which
+        matches cards containing each of the words in the search string, also
+        in the middle of a word. The index cannot match words shorter than
+        three characters, or SQL wildcards, in which case None is returned
+        and the caller needs to fall back to 'like'.
+
+        """
+
+        words = search_string.split()
+        if not words or any(len(word) < 3 or "%" in word or "_" in word \
+            for word in words):
+            return None
+        return " ".join('"%s"' % word.replace('"', '""') for word in words)
+
+    def search_cards(self, search_string, limit=None, offset=0):
+
+        """Return the _card_ids of the cards whose question, answer or tags
+        contain each of the words in 'search_string', the best matches first.
+
+        """
+
+        if not search_string.split():
+            return []
+        self.regenerate_pregenerated_data()
+        if limit is None:
+            limit = -1
+        if self._has_full_text_index and \
+            self.full_text_query(search_string) is not None:
+            return [cursor[0] for cursor in self.con.execute(\
+                """select rowid from cards_fts where cards_fts match ?
+                order by rank limit ? offset ?""",
+                (self.full_text_query(search_string), limit, offset))]
+        query = "select _id from cards where "
+        args = []
+        for word in search_string.split():
+            query += "(question like ? or answer like ? or tags like ?) and "
+            args += 3 * ["%" + word + "%"]
+        query = query.rsplit(" and ", 1)[0] + " limit ? offset ?"
+        return [cursor[0] for cursor in self.con.execute(\
+            query, args + [limit, offset])]
+
     def card(self, id, is_id_internal):
+        # The scheduler data comes from the current session, see
+        # 'set_scheduler_data'.
         query = """select _id, id, card_type_id, _fact_id, fact_view_id,
             grade, next_rep, last_rep, easiness, acq_reps, ret_reps, lapses,
             acq_reps_since_lapse, ret_reps_since_lapse, creation_time,
-            modification_time, extra_data, scheduler_data, active from cards
-            where """
+            modification_time, extra_data, coalesce(data, ?), active
+            from cards left join scheduler_data_for_session
+            on _card_id=_id and session=? where """
+        card = self._card_map.get(id, is_id_internal)
+        if card is not None:
+            return card
+        session, default = self._scheduler_data_session()
         if is_id_internal:
-            sql_res = self.con.execute(query + "_id=?", (id, )).fetchone()
+            sql_res = self.con.execute(query + "_id=?",
+                (default, session, id)).fetchone()
         else:
-            sql_res = self.con.execute(query + "id=?", (id, )).fetchone()
+            sql_res = self.con.execute(query + "id=?",
+                (default, session, id)).fetchone()
         if sql_res is None or sql_res[3] is None:
             from mnemosyne.libmnemosyne.utils import MnemosyneError
             raise MnemosyneError
-        fact = self.fact(sql_res[3], is_id_internal=True)
+        card = self._construct_card(sql_res,
+            self.fact(sql_res[3], is_id_internal=True))
+        for cursor in self.con.execute("""select _tag_id from tags_for_card
+            where _card_id=?""", (card._id, )):
+            card.tags.add(self.tag(cursor[0], is_id_internal=True))
+        self._card_map.add(card)
+        return card
+
+    def _construct_card(self, sql_res, fact):
         # Note that for the card type, we turn to the component manager as
         # opposed to this database, as we would otherwise miss the built-in
         # system card types
@@ -924,11 +1575,77 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         self._construct_extra_data(sql_res[16], card)
         card.scheduler_data = sql_res[17]
         card.active = sql_res[18]
-        for cursor in self.con.execute("""select _tag_id from tags_for_card
-            where _card_id=?""", (card._id, )):
-            card.tags.add(self.tag(cursor[0], is_id_internal=True))
         return card
 
+    def cards_with_internal_ids(self, _card_ids):
+
+        """Return an iterator over the cards with internal ids '_card_ids',
+        in the same order. Instead of doing several queries per card like
+        'card' does, the cards are constructed in chunks, using a fixed
+        number of queries per chunk. Ids of cards which no longer exist are
+        skipped.
+
+        """
+
+        _card_ids = list(_card_ids)
+        # Limit to 500 at a time to keep the queries and the memory usage
+        # reasonable.
+        for i in range(0, len(_card_ids), 500):
+            chunk = _card_ids[i:i+500]
+            card_for__id = self._cards_with_internal_ids(chunk)
+            for _card_id in chunk:
+                if _card_id in card_for__id:
+                    yield card_for__id[_card_id]
+
+    def _cards_with_internal_ids(self, _card_ids):
+        card_for__id = {}
+        _card_ids_to_fetch = []
+        for _card_id in set(_card_ids):
+            card = self._card_map.get(_card_id, is_id_internal=True)
+            if card is None:
+                _card_ids_to_fetch.append(_card_id)
+            else:
+                card_for__id[_card_id] = card
+        if len(_card_ids_to_fetch) == 0:
+            return card_for__id
+        # Since _card_ids can have many elements, we need to construct the
+        # query without ? placeholders in order to prevent hitting sqlite
+        # limitations.
+        _ids = ",".join([str(_card_id) for _card_id in _card_ids_to_fetch])
+        session, default = self._scheduler_data_session()
+        all_sql_res = self.con.execute("""select _id, id, card_type_id,
+            _fact_id, fact_view_id, grade, next_rep, last_rep, easiness,
+            acq_reps, ret_reps, lapses, acq_reps_since_lapse,
+            ret_reps_since_lapse, creation_time, modification_time,
+            extra_data, coalesce(data, ?), active from cards
+            left join scheduler_data_for_session on _card_id=_id and session=?
+            where _id in (%s)""" % _ids, (default, session)).fetchall()
+        fact_for__id = self._facts_with_internal_ids(\
+            [sql_res[3] for sql_res in all_sql_res])
+        for sql_res in all_sql_res:
+            if sql_res[3] not in fact_for__id:
+                continue
+            card_for__id[sql_res[0]] = \
+                self._construct_card(sql_res, fact_for__id[sql_res[3]])
+        tag_for__id = {}
+        for sql_res in self.con.execute("""select tags._id, tags.id,
+            tags.name, tags.extra_data, tags_for_card._card_id from
+            tags_for_card join tags on tags._id=tags_for_card._tag_id where
+            tags_for_card._card_id in (%s)""" % _ids):
+            _tag_id, _card_id = sql_res[0], sql_res[4]
+            if _card_id not in card_for__id:
+                continue
+            if _tag_id not in tag_for__id:
+                tag = self._tag_map.get(_tag_id, is_id_internal=True)
+                if tag is None:
+                    tag = self._construct_tag(sql_res)
+                tag_for__id[_tag_id] = tag
+            card_for__id[_card_id].tags.add(tag_for__id[_tag_id])
+        for _card_id in _card_ids_to_fetch:
+            if _card_id in card_for__id:
+                self._card_map.add(card_for__id[_card_id])
+        return card_for__id
+
     def update_card(self, card, repetition_only=False):
         # The card should at least have the __UNTAGGED__ tag. This allows for
         # an easy and fast implementation of applying criteria.
@@ -936,6 +1653,7 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
            card.tags.add(self.get_or_create_tag_with_name("__UNTAGGED__"))
         if not repetition_only:
             self.current_criterion().apply_to_card(card)
+        self._forget_card(card._id)
         self.con.execute("""update cards set grade=?, next_rep=?, last_rep=?,
             easiness=?, acq_reps=?, ret_reps=?, lapses=?,
             acq_reps_since_lapse=?, ret_reps_since_lapse=?,
@@ -946,16 +1664,23 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
             card.scheduler_data, card.active, card._id))
         if repetition_only:
             return
+        # With deferred rendering, there is no need to render the question and
+        # answer again if e.g. only the tags changed. Changes to the fact data
+        # are dealt with in 'update_fact'.
+        render = True
+        if self.store_pregenerated_data and \
+            self.config()["defer_pregenerated_data"]:
+            render = self.con.execute("""select card_type_id, _fact_id,
+                fact_view_id from cards where _id=?""",
+                (card._id, )).fetchone() != \
+                (card.card_type.id, card.fact._id, card.fact_view.id)
         self.con.execute("""update cards set card_type_id=?, _fact_id=?,
             fact_view_id=?, creation_time=?, modification_time=?, extra_data=?
             where _id=?""", (card.card_type.id, card.fact._id,
             card.fact_view.id, card.creation_time, card.modification_time,
             self._repr_extra_data(card.extra_data), card._id))
         if self.store_pregenerated_data:
-            self.con.execute(\
-                "update cards set question=?, answer=?, tags=? where _id=?",
-                (card.question("plain_text"), card.answer("plain_text"),
-                card.tag_string(), card._id))
+            self._pregenerate_data([card], render)
         # If repetition_only is True, there is no need to log an EDITED_CARD
         # entry here, as the REPETITION log entry will contain all the data to
         # update the card.
@@ -973,11 +1698,16 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         if card._id is None:
             # A card which was created and deleted before a sync, so that
             # it has incomplete information.
+            self._forget_card(id=card.id)
             self.con.execute("delete from cards where id=?", (card.id, ))
         else:
+            self._forget_card(card._id)
             self.con.execute("delete from cards where _id=?", (card._id, ))
             self.con.execute("delete from tags_for_card where _card_id=?",
                              (card._id, ))
+            self.con.execute(\
+                "delete from scheduler_data_for_session where _card_id=?",
+                (card._id, ))
         if not self.syncing and check_for_unused_tags:
             for tag in card.tags:
                 self.delete_tag_if_unused(tag)
@@ -990,13 +1720,18 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         # limitations.
         if len(_card_ids) == 0:
             return []
-        query = \
-            "select distinct _tag_id from tags_for_card where _card_id in ("
+        query = """select _id, id, name, extra_data from tags where _id in
+            (select distinct _tag_id from tags_for_card where _card_id in ("""
         for _card_id in _card_ids:
             query += str(_card_id) + ","
-        query = query[:-1] + ")"
-        return [self.tag(cursor[0], is_id_internal=True) \
-                for cursor in self.con.execute(query)]
+        query = query[:-1] + "))"
+        tags = []
+        for sql_res in self.con.execute(query):
+            tag = self._tag_map.get(sql_res[0], is_id_internal=True)
+            if tag is None:
+                tag = self._construct_tag(sql_res)
+            tags.append(tag)
+        return tags
 
     def add_tag_to_cards_with_internal_ids(self, tag, _card_ids):
         # To make sure we don't insert the tag twice, we delete it first.
@@ -1018,17 +1753,14 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
             self._update_tag_strings(_card_ids)
         # Apply criterion. (There does not seem to be any watertight shortcut
         # we can take for a special case, especially when a card can have many
-        # tags, so we apply the criterion in full.)
-        criterion = self.current_criterion()
-        applier = self.component_manager.current("criterion_applier",
-            used_for=criterion.__class__)
-        applier.apply_to_database(criterion)
+        # tags, so we apply the criterion in full to the affected cards.)
+        self._apply_current_criterion(_card_ids=_card_ids)
         # We don't call 'self.log.edited_card(card)', which would require us to
         # construct the entire card object, but take a short cut.
         for _card_id in _card_ids:
             card_id = self.con.execute("select id from cards where _id=?",
                 (_card_id, )).fetchone()[0]
-            self.con.execute("""insert into log(event_type, timestamp,
+            self._log("""insert into log(event_type, timestamp,
                 object_id) values(?,?,?)""",
                 (EventTypes.EDITED_CARD, int(time.time()), card_id))
 
@@ -1052,17 +1784,14 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
             self._update_tag_strings(_card_ids)
         # Apply criterion. (There does not seem to be any watertight shortcut
         # we can take for a special case, especially when a card can have many
-        # tags, so we apply the criterion in full.)
-        criterion = self.current_criterion()
-        applier = self.component_manager.current("criterion_applier",
-            used_for=criterion.__class__)
-        applier.apply_to_database(criterion)
+        # tags, so we apply the criterion in full to the affected cards.)
+        self._apply_current_criterion(_card_ids=_card_ids)
         # We don't call 'self.log.edited_card(card)', which would require us
         # to construct the entire card object, but take a short cut.
         for _card_id in _card_ids:
             card_id = self.con.execute("select id from cards where _id=?",
                 (_card_id, )).fetchone()[0]
-            self.con.execute("""insert into log(event_type, timestamp,
+            self._log("""insert into log(event_type, timestamp,
                 object_id) values(?,?,?)""",
                 (EventTypes.EDITED_CARD, int(time.time()), card_id))
 
@@ -1338,7 +2067,38 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         self.update_criterion(criterion)
         applier = self.component_manager.current("criterion_applier",
             used_for=criterion.__class__)
-        applier.apply_to_database(criterion)
+        # If we know which criterion was applied last, we only need to update
+        # the cards affected by the changes. Note that the criterion could
+        # have been modified in place, so we can't simply compare with the
+        # previous current criterion object.
+        if self._applied_criterion is not None and \
+            self._applied_criterion[0] == criterion.__class__:
+            previous_criterion = criterion.__class__(self.component_manager)
+            previous_criterion.set_data_from_string(self._applied_criterion[1])
+            applier.apply_criterion_change(previous_criterion, criterion)
+        else:
+            applier.apply_to_database(criterion)
+        self._applied_criterion = \
+            (criterion.__class__, criterion.data_to_string())
+        self._forget_cards()
+
+    def _apply_current_criterion(self, _card_ids=None):
+
+        """Apply the current criterion to the entire database, or if
+        '_card_ids' is given, only to those cards.
+
+        """
+
+        criterion = self.current_criterion()
+        applier = self.component_manager.current("criterion_applier",
+            used_for=criterion.__class__)
+        if _card_ids is None:
+            applier.apply_to_database(criterion)
+            self._applied_criterion = \
+                (criterion.__class__, criterion.data_to_string())
+        else:
+            applier.apply_to_cards(criterion, _card_ids=_card_ids)
+        self._forget_cards()
 
     def current_criterion(self):
         return self._current_criterion
@@ -1361,6 +2121,15 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
             in self.con.execute("select _id from cards where _fact_id=?",
                                 (fact._id, )))
 
+    def cards_from_facts(self, facts):
+        _card_ids = []
+        _fact_ids = [fact._id for fact in facts]
+        for i in range(0, len(_fact_ids), 500):
+            _card_ids += [cursor[0] for cursor in self.con.execute(\
+                "select _id from cards where _fact_id in (%s)" % \
+                ",".join([str(_fact_id) for _fact_id in _fact_ids[i:i+500]]))]
+        return self.cards_with_internal_ids(_card_ids)
+
     def duplicates_for_fact(self, fact, card_type):
 
         """Return facts with the same 'card_type.unique_fact_keys'
@@ -1368,71 +2137,59 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
 
         """
 
-        _fact_ids = set()
+        if len(card_type.unique_fact_keys) == 0:
+            return []
+        # Look up the facts with the same data in any of the unique fact keys
+        # through the (key, value) index on data_for_fact, and make sure they
+        # are from cards with the correct card type, all in one query.
+        query = """select distinct data_for_fact._fact_id from data_for_fact
+            join cards on cards._fact_id=data_for_fact._fact_id where
+            cards.card_type_id=? and ("""
+        args = [card_type.id]
         for fact_key in card_type.unique_fact_keys:
-            if fact._id:
-                for cursor in self.con.execute("""select _fact_id from
-                    data_for_fact where key=? and value=? and not
-                    _fact_id=?""", (fact_key, fact[fact_key], fact._id)):
-                    _fact_ids.add(cursor[0])
-            else:
-                # The fact has not yet been saved in the database.
-                for cursor in self.con.execute("""select _fact_id from
-                    data_for_fact where key=? and value=?""",
-                    (fact_key, fact[fact_key])):
-                    _fact_ids.add(cursor[0])
-        # Now we still need to make sure these facts are from cards with
-        # the correct card type.
-        facts = []
-        for _fact_id in _fact_ids:
-            this_card_type_id = self.con.execute("""select card_type_id
-                from cards where _fact_id=?""", (_fact_id, )).fetchone()[0]
-            if this_card_type_id == card_type.id:
-                facts.append(self.fact(_fact_id, is_id_internal=True))
-        return facts
+            query += "(data_for_fact.key=? and data_for_fact.value=?) or "
+            args += [fact_key, fact[fact_key]]
+        query = query[:-4] + ")"
+        # The fact could not yet have been saved in the database.
+        if fact._id:
+            query += " and data_for_fact._fact_id!=?"
+            args.append(fact._id)
+        return list(self.facts_with_internal_ids(\
+            [cursor[0] for cursor in self.con.execute(query, args)]))
 
     def tag_all_duplicates(self):
-        # Find the _fact_ids of the candidate duplicates, i.e. not yet taking
-        # into account that duplicates in different card types are allowed and
-        # that we only need to check the unique fact keys. This preprocessing
-        # step speeds up the rest of the calculations.
-        _fact_ids = set()
-        _fact_id_for_data = {}
-        for key, value, _fact_id in self.con.execute(\
-            """select key, value, _fact_id from data_for_fact"""):
-            if key not in _fact_id_for_data:
-                _fact_id_for_data[key] = {}
-            if value in _fact_id_for_data[key]:
-                _fact_ids.add(_fact_id_for_data[key][value])
-                _fact_ids.add(_fact_id)
-            else:
-                _fact_id_for_data[key][value] = _fact_id
-        # Sort the candidates per card type.
-        _fact_ids_in_card_type = {}
-        for _fact_id in _fact_ids:
-            card_type_id = self.con.execute("""select card_type_id from cards
-                where _fact_id=?""", (_fact_id, )).fetchone()[0]
-            if card_type_id not in _fact_ids_in_card_type:
-                _fact_ids_in_card_type[card_type_id] = []
-            _fact_ids_in_card_type[card_type_id].append(_fact_id)
-        # Check if the duplicates are really in the fields that should be
-        # unique.
-        duplicate_facts = set([])
-        for card_type_id in _fact_ids_in_card_type:
-            facts = [self.fact(_fact_id, is_id_internal=True) for _fact_id in \
-                _fact_ids_in_card_type[card_type_id]]
-            for fact_key in self.card_type_with_id(card_type_id).\
-                unique_fact_keys:
-                for i in range(len(facts)):
-                    for j in range(i + 1, len(facts)):
-                        if facts[i][fact_key] == facts[j][fact_key]:
-                            duplicate_facts.add(facts[i])
-                            duplicate_facts.add(facts[j])
+        # Group the facts on the data in their unique fact keys, in a single
+        # pass over data_for_fact joined with the card types of the facts.
+        # Duplicates in different card types are allowed, so the card type is
+        # part of the key. Just like in 'duplicates_for_fact', facts which
+        # have the same data in any of the unique fact keys are duplicates.
+        unique_fact_keys_for_card_type_id = {}
+        _fact_ids_for_key = {}
+        for card_type_id, _fact_id, key, value in self.con.execute(\
+            """select cards.card_type_id, data_for_fact._fact_id,
+            data_for_fact.key, data_for_fact.value from data_for_fact join
+            (select _fact_id, card_type_id from cards group by _fact_id) as
+            cards on cards._fact_id=data_for_fact._fact_id"""):
+            if card_type_id not in unique_fact_keys_for_card_type_id:
+                unique_fact_keys_for_card_type_id[card_type_id] = \
+                    self.card_type_with_id(card_type_id).unique_fact_keys
+            if key not in unique_fact_keys_for_card_type_id[card_type_id]:
+                continue
+            _fact_ids_for_key.setdefault((card_type_id, key, value), \
+                []).append(_fact_id)
+        # Only groups with more than one fact contain duplicates.
+        _duplicate_fact_ids = set()
+        for _fact_ids in _fact_ids_for_key.values():
+            if len(_fact_ids) >= 2:
+                _duplicate_fact_ids.update(_fact_ids)
         # Tag the duplicate cards.
         _card_ids = []
-        for fact in duplicate_facts:
+        _duplicate_fact_ids = list(_duplicate_fact_ids)
+        for i in range(0, len(_duplicate_fact_ids), 500):
             _card_ids += [cursor[0] for cursor in self.con.execute(\
-                "select _id from cards where _fact_id=?", (fact._id, ))]
+                "select _id from cards where _fact_id in (%s)" % \
+                ",".join([str(_fact_id) for _fact_id in \
+                _duplicate_fact_ids[i:i+500]]))]
         if len(_card_ids) == 0:
             self.main_widget().show_information(_("No duplicates found."))
         else:
@@ -1473,16 +2230,11 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
         # First do a quick and dirty detection of candidate inverses, then
         # test them in more detail to see if they fullfill all the criteria,
         # and do the conversion.
-        card_type_2 = self.card_type_with_id("2")
-        _fact_ids_dealt_with = []
+        candidates = []
         for key in set(_fact_id_for_front.keys()).\
             intersection(list(_fact_id_for_back.keys())):
             _fact_id_1 = _fact_id_for_front[key]
             _fact_id_2 = _fact_id_for_back[key]
-            # Deal only once with a pair.
-            if _fact_id_1 in _fact_ids_dealt_with or \
-                _fact_id_2 in _fact_ids_dealt_with:
-                continue
             # Try to keep ordering consistent.
             if _fact_id_1 > _fact_id_2:
                 _fact_id_1, _fact_id_2 = _fact_id_2, _fact_id_1
@@ -1493,10 +2245,20 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
             if _fact_id_1 not in _card_id_for__fact_id or \
                 _fact_id_2 not in _card_id_for__fact_id:
                 continue
-            _card_id_1 = _card_id_for__fact_id[_fact_id_1]
-            _card_id_2 = _card_id_for__fact_id[_fact_id_2]
-            card_1 = self.card(_card_id_1, is_id_internal=True)
-            card_2 = self.card(_card_id_2, is_id_internal=True)
+            candidates.append((_fact_id_1, _fact_id_2))
+        # Construct all the candidate cards in bulk.
+        card_for__id = dict((card._id, card) for card in \
+            self.cards_with_internal_ids([_card_id_for__fact_id[_fact_id] \
+            for candidate in candidates for _fact_id in candidate]))
+        card_type_2 = self.card_type_with_id("2")
+        _fact_ids_dealt_with = set()
+        for _fact_id_1, _fact_id_2 in candidates:
+            # Deal only once with a pair.
+            if _fact_id_1 in _fact_ids_dealt_with or \
+                _fact_id_2 in _fact_ids_dealt_with:
+                continue
+            card_1 = card_for__id[_card_id_for__fact_id[_fact_id_1]]
+            card_2 = card_for__id[_card_id_for__fact_id[_fact_id_2]]
             # Make sure they are truly duplicates, and not coming
             # from two values for the same key in 'fact_id_for_front' and
             # 'fact_id_for_back'.
@@ -1508,17 +2270,17 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
             if card_1.tag_string() != card_2.tag_string():
                 continue
             # Now we can do the actual conversion.
+            fact_2 = card_2.fact
             card_1.card_type = card_type_2
             card_1.fact_view = card_type_2.fact_views[0]
             card_2.fact = card_1.fact
             card_2.card_type = card_type_2
             card_2.fact_view = card_type_2.fact_views[1]
-            fact_2 = self.fact(_fact_id_2, is_id_internal=True)
             self.delete_fact(fact_2)
             self.update_card(card_1)
             self.update_card(card_2)
             # Only now is it safe to mark these cards as dealt with.
-            _fact_ids_dealt_with.extend([_fact_id_1, _fact_id_2])
+            _fact_ids_dealt_with.update([_fact_id_1, _fact_id_2])
 
 
     #
@@ -1597,26 +2359,58 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
     # Extra queries for custom schedulers.
     #
 
+    def _create_scheduler_data_for_session(self):
+        self.con.executescript(SCHEDULER_DATA_FOR_SESSION)
+        if self._global_variable("scheduler_data_session") is not None:
+            return
+        # Older databases stored the scheduler data in the cards table.
+        self.con.execute("""insert or replace into
+            scheduler_data_for_session(_card_id, session, data)
+            select _id, 0, scheduler_data from cards where scheduler_data!=0""")
+        self._set_global_variable("scheduler_data_session", 0)
+        self._set_global_variable("scheduler_data_default", 0)
+
+    def _scheduler_data_session(self):
+
+        """Returns the current session number and its default value."""
+
+        return int(self._global_variable("scheduler_data_session")), \
+            int(self._global_variable("scheduler_data_default"))
+
     def set_scheduler_data(self, scheduler_data):
-        self.con.execute("update cards set scheduler_data=?",
-            (scheduler_data, ))
+        session, default = self._scheduler_data_session()
+        self._set_global_variable("scheduler_data_session", session + 1)
+        self._set_global_variable("scheduler_data_default", scheduler_data)
+        # Cards in memory still have the data of the previous session.
+        self._forget_cards()
+
+    def set_scheduler_data_for_card(self, card, scheduler_data):
+        session, default = self._scheduler_data_session()
+        self.con.execute("""insert or replace into
+            scheduler_data_for_session(_card_id, session, data)
+            values(?,?,?)""", (card._id, session, scheduler_data))
 
     def cards_with_scheduler_data(self, scheduler_data, sort_key="",
                                   limit=-1, max_ret_reps=-1):
         sort_key = self._process_sort_key(sort_key)
         extra_cond = "" if max_ret_reps == -1 else str(
             "and acq_reps>0 and ret_reps between 1 and " + str(max_ret_reps))
+        session, default = self._scheduler_data_session()
         return ((cursor[0], cursor[1]) for cursor in self.con.execute("""
-            select _id, _fact_id from cards where active=1 and scheduler_data=?
-            %s order by %s limit ?"""
-            % (extra_cond, sort_key), (scheduler_data, limit)))
+            select _id, _fact_id from cards left join scheduler_data_for_session
+            on _card_id=_id and session=? where active=1 and
+            coalesce(data, ?)=? %s order by %s limit ?"""
+            % (extra_cond, sort_key),
+            (session, default, scheduler_data, limit)))
 
     def scheduler_data_count(self, scheduler_data, max_ret_reps=-1):
         extra_cond = "" if max_ret_reps == -1 else str(
             "and acq_reps>0 and ret_reps between 1 and " + str(max_ret_reps))
+        session, default = self._scheduler_data_session()
         return self.con.execute("""select count() from cards
-            where active=1 and scheduler_data=? %s """ % extra_cond,
-            (scheduler_data, )).fetchone()[0]
+            left join scheduler_data_for_session on _card_id=_id and session=?
+            where active=1 and coalesce(data, ?)=? %s """ % extra_cond,
+            (session, default, scheduler_data)).fetchone()[0]
 
     def has_already_warned_today(self, start_of_day, end_of_day):
         result = self.database().con.execute(
@@ -1649,5 +2443,6 @@ _("Putting a database on a network drive is forbidden under Windows to avoid dat
     def known_recognition_questions_from_card_types_ids(self, card_type_ids):
         clause, args = \
             self._where_clause_known_recognition_questions(card_type_ids)
+        self.regenerate_pregenerated_data()
         return (cursor[0] for cursor in \
                 self.con.execute("select question from cards " + clause, args))
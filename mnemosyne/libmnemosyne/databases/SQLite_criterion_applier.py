@@ -60,3 +60,63 @@ class DefaultCriterionApplier(CriterionApplier):
         for chunked__tag_ids in self.split_set(\
                 criterion._tag_ids_forbidden, 500):
             self.set_activity_for_tags_with__id(chunked__tag_ids, active=0)
+
+    def apply_to_cards(self, criterion, _card_ids=None, _tag_ids=None):
+        db = self.database()
+        _card_ids_affected = set(_card_ids) if _card_ids else set()
+        for chunked__tag_ids in self.split_set(_tag_ids or (), 500):
+            _card_ids_affected.update(cursor[0] for cursor in db.con.execute(\
+                """select _card_id from tags_for_card where _tag_id in (%s)"""\
+                % ",".join("?" * len(chunked__tag_ids)), chunked__tag_ids))
+        # Limit to 500 cards at a time to deal with SQLite limitations.
+        for chunked__card_ids in self.split_set(_card_ids_affected, 500):
+            self.set_activity_for_cards_with__id(criterion, chunked__card_ids)
+
+    def set_activity_for_cards_with__id(self, criterion, _card_ids):
+        # Same logic as 'DefaultCriterion.apply_to_card', but working on the
+        # tag ids of the cards instead of the card objects.
+        db = self.database()
+        _card_ids_string = ",".join([str(_card_id) for _card_id in _card_ids])
+        _tag_ids_for_card = {}
+        for _card_id, _tag_id in db.con.execute(\
+            """select _card_id, _tag_id from tags_for_card where _card_id
+            in (%s)""" % _card_ids_string):
+            _tag_ids_for_card.setdefault(_card_id, set()).add(_tag_id)
+        activated, deactivated = [], []
+        for _card_id, card_type_id, fact_view_id, active in db.con.execute(\
+            """select _id, card_type_id, fact_view_id, active from cards
+            where _id in (%s)""" % _card_ids_string):
+            _tag_ids = _tag_ids_for_card.get(_card_id, set())
+            new_active = not _tag_ids.isdisjoint(criterion._tag_ids_active) \
+                and (card_type_id, fact_view_id) not in \
+                    criterion.deactivated_card_type_fact_view_ids \
+                and _tag_ids.isdisjoint(criterion._tag_ids_forbidden)
+            # Only write the cards which actually change.
+            if new_active and not active:
+                activated.append(str(_card_id))
+            elif not new_active and active:
+                deactivated.append(str(_card_id))
+        if activated:
+            db.con.execute("update cards set active=1 where _id in (%s)" \
+                % ",".join(activated))
+        if deactivated:
+            db.con.execute("update cards set active=0 where _id in (%s)" \
+                % ",".join(deactivated))
+
+    def apply_criterion_change(self, previous_criterion, criterion):
+        if len(criterion._tag_ids_forbidden) != 0:
+            assert len(criterion._tag_ids_active) != 0
+        # Only the cards having a tag whose status changed, or belonging to a
+        # card type and view whose status changed, are affected.
+        _tag_ids = \
+            (previous_criterion._tag_ids_active ^ criterion._tag_ids_active) |\
+            (previous_criterion._tag_ids_forbidden ^ \
+             criterion._tag_ids_forbidden)
+        _card_ids = set()
+        for card_type_id, fact_view_id in \
+            previous_criterion.deactivated_card_type_fact_view_ids ^ \
+            criterion.deactivated_card_type_fact_view_ids:
+            _card_ids.update(cursor[0] for cursor in self.database().con.\
+                execute("""select _id from cards where card_type_id=? and
+                fact_view_id=?""", (card_type_id, fact_view_id)))
+        self.apply_to_cards(criterion, _card_ids, _tag_ids)
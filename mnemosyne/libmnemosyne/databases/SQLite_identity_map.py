@@ -0,0 +1,124 @@
+#
+# SQLite_identity_map.py <Peter.Bienstman@UGent.be>
+#
+
+from collections import OrderedDict
+
+
+class IdentityMap(object):
+
+    """Bounded cache of hydrated objects (cards, facts, tags), which can be
+    looked up both by their internal '_id' and by their external 'id'. When
+    the cache is full, the least recently used object is evicted.
+
+    A 'max_size' of 0 disables the cache altogether.
+
+    """
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        # We store the id together with the object, as the caller could
+        # modify the object's id after it was added to the cache.
+        self._id_and_object_for__id = OrderedDict()
+        self._internal_id_for_id = {}
+
+    def __len__(self):
+        return len(self._id_and_object_for__id)
+
+    def get(self, id, is_id_internal):
+        if not self._id_and_object_for__id:
+            return None
+        if is_id_internal:
+            _id = id
+        else:
+            _id = self._internal_id_for_id.get(id)
+            if _id is None:
+                return None
+        id_and_object = self._id_and_object_for__id.get(_id)
+        if id_and_object is None:
+            return None
+        self._id_and_object_for__id.move_to_end(_id)
+        return id_and_object[1]
+
+    def add(self, obj):
+        if self.max_size <= 0:
+            return
+        self.discard(_id=obj._id)
+        self._id_and_object_for__id[obj._id] = (obj.id, obj)
+        self._internal_id_for_id[obj.id] = obj._id
+        while len(self._id_and_object_for__id) > self.max_size:
+            _id, (id, evicted) = \
+                self._id_and_object_for__id.popitem(last=False)
+            self._internal_id_for_id.pop(id, None)
+
+    def discard(self, _id=None, id=None):
+        if _id is None:
+            _id = self._internal_id_for_id.get(id)
+            if _id is None:
+                return
+        id_and_object = self._id_and_object_for__id.pop(_id, None)
+        if id_and_object is not None:
+            self._internal_id_for_id.pop(id_and_object[0], None)
+
+    def clear(self):
+        self._id_and_object_for__id.clear()
+        self._internal_id_for_id.clear()
+
+
+class SQLiteIdentityMap(object):
+
+    """Code to be injected into the SQLite database class through inheritance,
+    so that SQLite.py does not becomes too large.
+
+    Hydrating a card takes several queries (card, fact, data for the fact and
+    one per tag). When 'identity_map_size' in the config is larger than 0,
+    hydrated cards, facts and tags are kept in an LRU cache, so that e.g.
+    repeatedly fetching the same cards during review, sync or export does not
+    need to hit the database again.
+
+    Note that this means that 'card', 'fact' and 'tag' can return the same
+    object for different calls, so callers who modify these objects are
+    expected to write them back to the database.
+
+    All the functions which write cards, facts and tags invalidate the
+    corresponding entries. Functions which modify the cards table in bulk
+    through SQL (e.g. applying criteria) simply drop all the cached cards.
+
+    """
+
+    def _create_identity_maps(self, max_size=0):
+        self._card_map = IdentityMap(max_size)
+        self._fact_map = IdentityMap(max_size)
+        self._tag_map = IdentityMap(max_size)
+
+    def _forget_card(self, _id=None, id=None):
+        self._card_map.discard(_id=_id, id=id)
+
+    def _forget_cards(self):
+        self._card_map.clear()
+
+    def _forget_fact(self, _id=None, id=None):
+        if not len(self._fact_map) and not len(self._card_map):
+            return
+        if _id is None:
+            sql_res = self.con.execute("select _id from facts where id=?",
+                (id, )).fetchone()
+            if sql_res is None:
+                return
+            _id = sql_res[0]
+        self._fact_map.discard(_id=_id)
+        # The cards of this fact could hold on to a stale fact object.
+        if len(self._card_map):
+            for cursor in self.con.execute(\
+                "select _id from cards where _fact_id=?", (_id, )):
+                self._card_map.discard(_id=cursor[0])
+
+    def _forget_tag(self, _id=None, id=None):
+        self._tag_map.discard(_id=_id, id=id)
+        # Tag operations can affect the tags of many cards at once.
+        self._card_map.clear()
+
+    def _forget_all(self):
+        self._card_map.clear()
+        self._fact_map.clear()
+        self._tag_map.clear()
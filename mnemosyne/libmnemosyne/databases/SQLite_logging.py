@@ -4,15 +4,62 @@
 
 import os
 import time
+import heapq
+import sqlite3
 import string
 import datetime
+import itertools
 
 from openSM2sync.log_entry import EventTypes
 from mnemosyne.libmnemosyne.gui_translator import _
+from mnemosyne.libmnemosyne.utils import MnemosyneError
 
 HOUR = 60 * 60 # Seconds in an hour.
 DAY = 24 * HOUR # Seconds in a day.
 
+LOG_COLUMNS = """event_type, timestamp, object_id, grade, easiness, acq_reps,
+    ret_reps, lapses, acq_reps_since_lapse, ret_reps_since_lapse,
+    scheduled_interval, actual_interval, thinking_time, next_rep,
+    scheduler_data"""
+
+
+def _log_entry_key(entry):
+    # Machine specific events (loading and saving) have the machine id as
+    # object_id, so this also distinguishes between machines.
+    return (entry[1], entry[0], "" if entry[2] is None else str(entry[2]))
+
+
+def _sorted_log_entries(filename):
+
+    """Iterate over the log entries of an archive in the order of
+    _log_entry_key. Sorting is left to SQLite, which uses temporary files
+    for large tables, so that memory use stays bounded.
+
+    """
+
+    con = sqlite3.connect(filename)
+    try:
+        for entry in con.execute("""select %s from log order by timestamp,
+            event_type, ifnull(cast(object_id as text), '')""" % LOG_COLUMNS):
+            yield entry
+    finally:
+        con.close()
+
+
+def _unique_log_entries(filenames):
+
+    """Merge the sorted log entries of several archives, keeping only the
+    first of each group of entries with the same key. Yields (entry,
+    duplicates), with 'duplicates' the number of entries dropped for it.
+
+    """
+
+    entries = heapq.merge(*[_sorted_log_entries(filename) for \
+        filename in filenames], key=_log_entry_key)
+    for key, group in itertools.groupby(entries, key=_log_entry_key):
+        entry = next(group)
+        yield entry, sum(1 for duplicate in group)
+
 
 class SQLiteLogging(object):
 
@@ -26,24 +73,28 @@ class SQLiteLogging(object):
 
     """
 
+    def _log(self, sql, args):
+        # Log entries are written in batches, see '_Sqlite3.execute_deferred'.
+        self.con.execute_deferred(sql, args, ("log", "log_all"))
+
     def log_started_program(self, timestamp, version_string):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.STARTED_PROGRAM, int(timestamp), version_string))
 
     def log_stopped_program(self, timestamp):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp) values(?,?)",
             (EventTypes.STOPPED_PROGRAM, int(timestamp)))
 
     def log_started_scheduler(self, timestamp, scheduler_name):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.STARTED_SCHEDULER, int(timestamp), scheduler_name))
 
     def log_loaded_database(self, timestamp, machine_id, scheduled_count,
         non_memorised_count, active_count):
-        self.con.execute(\
+        self._log(\
             """insert into log(event_type, timestamp, object_id, acq_reps,
             ret_reps, lapses) values(?,?,?,?,?,?)""",
             (EventTypes.LOADED_DATABASE, int(timestamp), machine_id,
@@ -51,7 +102,7 @@ class SQLiteLogging(object):
 
     def log_saved_database(self, timestamp, machine_id, scheduled_count,
         non_memorised_count, active_count):
-        self.con.execute(\
+        self._log(\
             """insert into log(event_type, timestamp, object_id, acq_reps,
             ret_reps, lapses) values(?,?,?,?,?,?)""",
             (EventTypes.SAVED_DATABASE, int(timestamp), machine_id,
@@ -66,28 +117,34 @@ class SQLiteLogging(object):
 
         timestamp = int(time.time())
         scheduled_count = 0
+        counts = self.scheduler().card_count_scheduled_per_day_from_now(1, 7)
         for n in range(1, 8):
             timestamp += DAY
-            scheduled_count += \
-                self.scheduler().card_count_scheduled_n_days_from_now(n)
-            self.con.execute("""insert into log(event_type, timestamp,
+            scheduled_count += counts[n]
+            self._log("""insert into log(event_type, timestamp,
                 object_id, acq_reps,ret_reps, lapses) values(?,?,?,?,?,?)""",
                 (EventTypes.LOADED_DATABASE, timestamp,
                 self.config().machine_id() + ".fut",
                 scheduled_count, -666, -666))
 
     def log_added_card(self, timestamp, card_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.ADDED_CARD, int(timestamp), card_id))
 
+    def log_added_cards(self, timestamp, card_ids):
+        self.con.executemany(\
+            "insert into log(event_type, timestamp, object_id) values(?,?,?)",
+            ((EventTypes.ADDED_CARD, int(timestamp), card_id)
+            for card_id in card_ids))
+
     def log_edited_card(self, timestamp, card_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.EDITED_CARD, int(timestamp), card_id))
 
     def log_deleted_card(self, timestamp, card_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.DELETED_CARD, int(timestamp), card_id))
 
@@ -95,7 +152,7 @@ class SQLiteLogging(object):
         ret_reps, lapses, acq_reps_since_lapse, ret_reps_since_lapse,
         scheduled_interval, actual_interval, thinking_time, next_rep,
         scheduler_data):
-        self.con.execute(\
+        self._log(\
             """insert into log(event_type, timestamp, object_id, grade,
             easiness, acq_reps, ret_reps, lapses, acq_reps_since_lapse,
             ret_reps_since_lapse, scheduled_interval, actual_interval,
@@ -107,163 +164,201 @@ class SQLiteLogging(object):
             int(thinking_time), next_rep, scheduler_data))
 
     def log_added_tag(self, timestamp, tag_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.ADDED_TAG, int(timestamp), tag_id))
 
     def log_edited_tag(self, timestamp, tag_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.EDITED_TAG, int(timestamp), tag_id))
 
     def log_deleted_tag(self, timestamp, tag_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.DELETED_TAG, int(timestamp), tag_id))
 
     def log_added_media_file(self, timestamp, filename):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.ADDED_MEDIA_FILE, int(timestamp), filename))
 
     def log_edited_media_file(self, timestamp, filename):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.EDITED_MEDIA_FILE, int(timestamp), filename))
 
     def log_deleted_media_file(self, timestamp, filename):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.DELETED_MEDIA_FILE, int(timestamp), filename))
 
     def log_added_fact(self, timestamp, fact_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.ADDED_FACT, int(timestamp), fact_id))
 
+    def log_added_facts(self, timestamp, fact_ids):
+        self.con.executemany(\
+            "insert into log(event_type, timestamp, object_id) values(?,?,?)",
+            ((EventTypes.ADDED_FACT, int(timestamp), fact_id)
+            for fact_id in fact_ids))
+
+    def log_added_facts_and_cards(self, timestamp, fact_ids_and_card_ids):
+
+        """'fact_ids_and_card_ids' is a list of (fact_id, card_ids) tuples.
+        Each fact is logged followed by its cards.
+
+        """
+
+        entries = []
+        for fact_id, card_ids in fact_ids_and_card_ids:
+            entries.append((EventTypes.ADDED_FACT, int(timestamp), fact_id))
+            entries += [(EventTypes.ADDED_CARD, int(timestamp), card_id)
+                for card_id in card_ids]
+        self.con.executemany(\
+            "insert into log(event_type, timestamp, object_id) values(?,?,?)",
+            entries)
+
     def log_edited_fact(self, timestamp, fact_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.EDITED_FACT, int(timestamp), fact_id))
 
     def log_deleted_fact(self, timestamp, fact_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.DELETED_FACT, int(timestamp), fact_id))
 
     def log_added_fact_view(self, timestamp, fact_view_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.ADDED_FACT_VIEW, int(timestamp), fact_view_id))
 
     def log_edited_fact_view(self, timestamp, fact_view_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.EDITED_FACT_VIEW, int(timestamp), fact_view_id))
 
     def log_deleted_fact_view(self, timestamp, fact_view_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.DELETED_FACT_VIEW, int(timestamp), fact_view_id))
 
     def log_added_card_type(self, timestamp, card_type_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.ADDED_CARD_TYPE, int(timestamp), card_type_id))
 
     def log_edited_card_type(self, timestamp, card_type_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.EDITED_CARD_TYPE, int(timestamp), card_type_id))
 
     def log_deleted_card_type(self, timestamp, card_type_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.DELETED_CARD_TYPE, int(timestamp), card_type_id))
 
     def log_added_criterion(self, timestamp, criterion_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.ADDED_CRITERION, int(timestamp), criterion_id))
 
     def log_edited_criterion(self, timestamp, criterion_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.EDITED_CRITERION, int(timestamp), criterion_id))
 
     def log_deleted_criterion(self, timestamp, criterion_id):
-        self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.DELETED_CRITERION, int(timestamp), criterion_id))
 
     def log_edited_setting(self, timestamp, key):
-        index = self.con.execute(\
+        self._log(\
             "insert into log(event_type, timestamp, object_id) values(?,?,?)",
             (EventTypes.EDITED_SETTING, int(timestamp), key))
 
     def current_log_index(self):
-        result = self.con.execute(\
-            "select _id from log order by _id desc limit 1").fetchone()
-        if result:
-            return result[0]
-        else:
-            return 0
+        # Compacted repetitions keep their _id, and could be the most recent
+        # entries.
+        return self.con.execute("""select max(
+            coalesce((select max(_id) from log), 0),
+            coalesce((select max(_id) from log_compact), 0))""").fetchone()[0]
+
+    def _science_log_line(self, cursor):
+        event_type = cursor[1]
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S",
+            time.localtime(cursor[2]))
+        if event_type == EventTypes.STARTED_PROGRAM:
+            return "%s : Program started : %s" % (timestamp, cursor[3])
+        elif event_type == EventTypes.STARTED_SCHEDULER:
+            return "%s : Scheduler : %s" % (timestamp, cursor[3])
+        elif event_type == EventTypes.LOADED_DATABASE:
+            return "%s : Loaded database %d %d %d" \
+                  % (timestamp, cursor[6], cursor[7], cursor[8])
+        elif event_type == EventTypes.SAVED_DATABASE:
+            return "%s : Saved database %d %d %d" \
+                  % (timestamp, cursor[6], cursor[7], cursor[8])
+        elif event_type == EventTypes.ADDED_CARD:
+            # Use dummy grade and interval, We log the first repetition
+            # separately anyhow.
+            return "%s : New item %s -1 -1" % (timestamp, cursor[3])
+        elif event_type == EventTypes.DELETED_CARD:
+            return "%s : Deleted item %s" % (timestamp, cursor[3])
+        elif event_type == EventTypes.REPETITION:
+            new_interval = int(cursor[14] - cursor[2])
+            return "%s : R %s %d %1.2f | %d %d %d %d %d | %d %d | %d %d | %1.1f" %\
+                     (timestamp, cursor[3], cursor[4], cursor[5],
+                      cursor[6], cursor[7], cursor[8],cursor[9],
+                      cursor[10], cursor[11], cursor[12], new_interval,
+                      0, cursor[13])
+        elif event_type == EventTypes.STOPPED_PROGRAM:
+            return "%s : Program stopped" % (timestamp, )
+        return None
 
     def dump_to_science_log(self):
+
+        """Append the log entries which have not been dumped yet to log.txt.
+
+        The entries are read in chunks starting from the high-water mark
+        stored in the log.txt partnership, which is moved forward after each
+        chunk and committed together with it, so that an interrupted dump
+        resumes where it left off and never dumps entries twice. Whenever
+        log.txt grows beyond 'max_log_size_before_upload', it gets compressed
+        into the history folder straight away, so that it stays small even
+        if the uploads keep failing.
+
+        """
+
         if self.config()["upload_science_logs"] == False:
             return
-        # Open log file and get starting index.
         logname = os.path.join(self.config().data_dir, "log.txt")
-        logfile = open(logname, "a")
-        sql_res = self.con.execute(\
+        chunk_size = self.config()["science_log_chunk_size"]
+        last_index = int(self.con.execute(\
             "select _last_log_id from partnerships where partner=?",
-            ("log.txt", )).fetchone()
-        last_index = int(sql_res[0])
-        index = 0
-        # Loop over log entries and dump them to text file.
-        for cursor in self.con.execute("""select _id, event_type, timestamp,
-            object_id, grade, easiness, acq_reps, ret_reps, lapses,
-            acq_reps_since_lapse, ret_reps_since_lapse, scheduled_interval,
-            actual_interval, thinking_time, next_rep from log where _id>?""",
-                        (last_index, )):
-            index = int(cursor[0])
-            event_type = cursor[1]
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S",
-                time.localtime(cursor[2]))
-            if event_type == EventTypes.STARTED_PROGRAM:
-                print("%s : Program started : %s" \
-                      % (timestamp, cursor[3]), file=logfile)
-            elif event_type == EventTypes.STARTED_SCHEDULER:
-                print("%s : Scheduler : %s" \
-                      % (timestamp, cursor[3]), file=logfile)
-            elif event_type == EventTypes.LOADED_DATABASE:
-                print("%s : Loaded database %d %d %d" \
-                      % (timestamp, cursor[6], cursor[7], cursor[8]), file=logfile)
-            elif event_type == EventTypes.SAVED_DATABASE:
-                print("%s : Saved database %d %d %d" \
-                      % (timestamp, cursor[6], cursor[7], cursor[8]), file=logfile)
-            elif event_type == EventTypes.ADDED_CARD:
-                # Use dummy grade and interval, We log the first repetition
-                # separately anyhow.
-                print("%s : New item %s -1 -1" \
-                      % (timestamp, cursor[3]), file=logfile)
-            elif event_type == EventTypes.DELETED_CARD:
-                print("%s : Deleted item %s" \
-                      % (timestamp, cursor[3]), file=logfile)
-            elif event_type == EventTypes.REPETITION:
-                new_interval = int(cursor[14] - cursor[2])
-                print("%s : R %s %d %1.2f | %d %d %d %d %d | %d %d | %d %d | %1.1f" %\
-                         (timestamp, cursor[3], cursor[4], cursor[5],
-                          cursor[6], cursor[7], cursor[8],cursor[9],
-                          cursor[10], cursor[11], cursor[12], new_interval,
-                          0, cursor[13]), file=logfile)
-            elif event_type == EventTypes.STOPPED_PROGRAM:
-                print("%s : Program stopped" % (timestamp, ), file=logfile)
-        # Update partnership index.
-        if index:
+            ("log.txt", )).fetchone()[0])
+        while True:
+            rows = self.con.execute("""select _id, event_type, timestamp,
+                object_id, grade, easiness, acq_reps, ret_reps, lapses,
+                acq_reps_since_lapse, ret_reps_since_lapse, scheduled_interval,
+                actual_interval, thinking_time, next_rep from log_all
+                where _id>? order by _id limit ?""", (last_index, chunk_size)).fetchall()
+            if not rows:
+                break
+            lines = [self._science_log_line(cursor) for cursor in rows]
+            with open(logname, "a") as logfile:
+                logfile.writelines(line + "\n" for line in lines \
+                    if line is not None)
+            last_index = int(rows[-1][0])
             self.con.execute(\
-            "update partnerships set _last_log_id=? where partner=?",
-                (index, "log.txt"))
+                "update partnerships set _last_log_id=? where partner=?",
+                (last_index, "log.txt"))
+            self.con.commit()
+            self.log().archive_old_log()
+            if len(rows) < chunk_size:
+                break
 
     def skip_science_log(self):
 
@@ -309,6 +404,7 @@ class SQLiteLogging(object):
     def change_card_id(self, card, new_id):
         self.con.execute("update cards set id=? where _id=?",
             (new_id, card._id))
+        self._forget_card(card._id)
 
     def update_card_after_log_import(self, id, creation_time, offset):
         sql_res = self.con.execute("""select _id, acq_reps, lapses,
@@ -322,6 +418,7 @@ class SQLiteLogging(object):
             modification_time=?, acq_reps=?, acq_reps_since_lapse=?
             where _id=?""", (creation_time, creation_time, acq_reps,
             acq_reps_since_lapse, sql_res[0]))
+        self._forget_card(sql_res[0])
 
     def remove_card_log_entries_since(self, index):
         # Note that it is only safe to use this in case theses entries have
@@ -330,6 +427,7 @@ class SQLiteLogging(object):
         self.con.execute("""delete from log where _id>? and
             (event_type=? or event_type=?)""",
             (index, EventTypes.ADDED_CARD, EventTypes.EDITED_CARD))
+        self.invalidate_statistics_summary()
 
     def add_missing_added_card_log_entries(self, id_set):
 
@@ -367,32 +465,78 @@ class SQLiteLogging(object):
             commit;
         """).substitute(_id=insertion_log_index, filename=filename)
         self.con.executescript(script)
+        self.invalidate_statistics_summary()
         w.close_progress()
 
-    def archive_old_logs(self):
+    def archive_old_logs(self, max_count=None):
 
         """This puts all the data of old reviews in a separate file, which
         is no longer backed up. All clients do this independently, and when
         doing an initial sync, all these archive files are sent across so as
-        not to lose and information. This could cause duplication, however,
-        so later on a algorithm needs to be written to a create a single
-        archive from these multiple files, by making sure that there are
-        no log lines with duplicate (timestamps, id).
+        not to lose and information. This causes duplication, which
+        'merge_archive_dir' can remove afterwards.
+
+        The logs are moved in chunks of 'log_archive_chunk_size' entries,
+        each in their own transaction, and the progress is stored in the
+        database, such that archiving can be spread out over several
+        heartbeats and resumes where it left off after a restart. When
+        'max_count' is given, at most that many log entries are looked at
+        during this call, and nothing happens if a transaction is open, as
+        that would commit e.g. a half finished edit. Returns True when
+        archiving is finished.
 
         """
 
-        self.main_widget().set_progress_text(_("Archiving old logs..."))
-        self.backup()
+        if max_count is not None and self.con.in_transaction:
+            return False
+        if not self.is_archiving_old_logs():
+            self._start_archiving_old_logs()
+        chunk_size = self.config()["log_archive_chunk_size"]
+        if max_count is None:
+            self.main_widget().set_progress_text(_("Archiving old logs..."))
+        count = 0
+        finished = False
+        while not finished and (max_count is None or count < max_count):
+            finished = self._archive_old_logs_chunk(chunk_size)
+            count += chunk_size
+        if max_count is None:
+            self.main_widget().close_progress()
+        return finished
+
+    def is_archiving_old_logs(self):
+        return self._global_variable("log_archive_name") is not None
+
+    def _start_archiving_old_logs(self):
         one_year_ago = int(time.time()) - 356 * DAY
         # Create archive dir if needed.
         archive_dir = os.path.join(self.config().data_dir, "archive")
         if not os.path.exists(archive_dir):
             os.makedirs(archive_dir)
         # Create empty archive database.
+        archive_name = self._new_log_archive_name()
+        self._create_log_archive(os.path.join(archive_dir, archive_name))
+        # Only the entries up to here can be old enough, so we don't need to
+        # look any further.
+        last_id = self.con.execute("""select max(
+            coalesce((select max(_id) from log where timestamp<:t), 0),
+            coalesce((select max(_id) from log_compact where timestamp<:t), 0))""",
+            {"t": one_year_ago}).fetchone()[0]
+        self._set_global_variable("log_archive_name", archive_name)
+        self._set_global_variable("log_archive_before", one_year_ago)
+        self._set_global_variable("log_archive_at_id", 0)
+        self._set_global_variable("log_archive_last_id", last_id or 0)
+        self.save()
+
+    def _log_archive_prefix(self):
+        # The archive dir is shared by all databases in the data dir.
         db_name = os.path.basename(self.database().path()).rsplit(".", 1)[0]
-        archive_name = db_name + "-" + self.config().machine_id() + "-" +\
-            datetime.datetime.today().strftime("%Y%m%d-%H%M%S.db")
-        archive_path = os.path.join(archive_dir, archive_name)
+        return db_name + "-"
+
+    def _new_log_archive_name(self):
+        return self._log_archive_prefix() + self.config().machine_id() + \
+            "-" + datetime.datetime.today().strftime("%Y%m%d-%H%M%S.db")
+
+    def _create_log_archive(self, archive_path):
         from mnemosyne.libmnemosyne.databases._sqlite3 import _Sqlite3
         arch_con = _Sqlite3(self.component_manager, archive_path)
         from mnemosyne.libmnemosyne.databases.SQLite import SCHEMA
@@ -401,32 +545,193 @@ class SQLiteLogging(object):
                                   drop index i_log_object_id;""")
         arch_con.commit()
         arch_con.close()
+
+    def _archive_old_logs_chunk(self, chunk_size):
+
+        """Move the old entries amongst the next 'chunk_size' log entries to
+        the archive. We keep the original _ids in the archive, so that if the
+        program quits between committing the archive and the main database
+        (they are separate files in WAL mode), redoing the chunk does not
+        create duplicates.
+
+        """
+
+        archive_name = self._global_variable("log_archive_name")
+        one_year_ago = int(self._global_variable("log_archive_before"))
+        at_id = int(self._global_variable("log_archive_at_id"))
+        last_id = int(self._global_variable("log_archive_last_id"))
+        archive_dir = os.path.join(self.config().data_dir, "archive")
+        archive_path = os.path.join(archive_dir, archive_name)
+        if at_id >= last_id or not os.path.exists(archive_path):
+            self._finish_archiving_old_logs()
+            return True
+        to_id = min(at_id + chunk_size, last_id)
         # Needed for Android.
         self.con.execute("PRAGMA temp_store_directory='%s';" % \
                          (archive_dir, ))
-        # Transfer old logs.
+        self.save()
         script = string.Template("""
             attach "$archive_path" as archive;
             begin;
-            insert into archive.log(event_type, timestamp, object_id, grade,
-                easiness, acq_reps, ret_reps, lapses, acq_reps_since_lapse,
-                ret_reps_since_lapse, scheduled_interval, actual_interval,
-                thinking_time, next_rep, scheduler_data)
-                select event_type, timestamp, object_id, grade, easiness,
+            insert or ignore into archive.log(_id, event_type, timestamp,
+                object_id, grade, easiness, acq_reps, ret_reps, lapses,
+                acq_reps_since_lapse, ret_reps_since_lapse, scheduled_interval,
+                actual_interval, thinking_time, next_rep, scheduler_data)
+                select _id, event_type, timestamp, object_id, grade, easiness,
                 acq_reps, ret_reps, lapses, acq_reps_since_lapse,
                 ret_reps_since_lapse, scheduled_interval, actual_interval,
-                thinking_time, next_rep, scheduler_data from log
-                    where timestamp<$one_year_ago;
+                thinking_time, next_rep, scheduler_data from log_all
+                    where _id>$at_id and _id<=$to_id
+                    and timestamp<$one_year_ago;
+            delete from log where _id>$at_id and _id<=$to_id
+                and timestamp<$one_year_ago;
+            delete from log_compact where _id>$at_id and _id<=$to_id
+                and timestamp<$one_year_ago;
+            update global_variables set value=$to_id
+                where key='log_archive_at_id';
             commit;
-            begin;
-            delete from log where timestamp<$one_year_ago;
-            end;
-            vacuum;
-        """).substitute(archive_path=archive_path, one_year_ago=one_year_ago)
+            detach archive;
+        """).substitute(archive_path=archive_path, at_id=at_id, to_id=to_id,
+            one_year_ago=one_year_ago)
         self.con.executescript(script)
+        # Hand the freed pages back to the file system. This only does
+        # something if the database has auto_vacuum set to incremental, which
+        # is the case for new databases and after loading older ones.
+        self.con.execute("pragma incremental_vacuum").fetchall()
+        if to_id >= last_id:
+            self._finish_archiving_old_logs()
+            return True
+        return False
+
+    def _finish_archiving_old_logs(self):
+        self.con.execute("""delete from global_variables where key in
+            ('log_archive_name', 'log_archive_before', 'log_archive_at_id',
+            'log_archive_last_id')""")
+        self.save()
+
+    def compact_log(self):
+
+        """Move the repetitions older than 'compact_log_after_days' to the
+        compact storage in 'log_compact', and move those which are no longer
+        that old (because the setting changed) back to the log. Setting it to
+        None moves all repetitions back.
+
+        """
+
+        days = self.config()["compact_log_after_days"]
+        if days is None:
+            before = 0
+        else:
+            before = int(time.time()) - days * DAY
+        args = (EventTypes.REPETITION, before)
+        self.con.execute("""insert or ignore into log_object_ids(object_id)
+            select distinct object_id from log where event_type=? and
+            timestamp<? and object_id is not null""", args)
+        self.con.execute("""insert into log_compact(_id, timestamp,
+            _object_id, grade, easiness, acq_reps, ret_reps, lapses,
+            acq_reps_since_lapse, ret_reps_since_lapse, scheduled_interval,
+            actual_interval, thinking_time, next_rep_interval, scheduler_data)
+            select log._id, timestamp, log_object_ids._id, grade, easiness,
+            acq_reps, ret_reps, lapses, acq_reps_since_lapse,
+            ret_reps_since_lapse, scheduled_interval, actual_interval,
+            thinking_time, next_rep - timestamp, scheduler_data from log
+            join log_object_ids using (object_id)
+            where event_type=? and timestamp<?""", args)
+        self.con.execute("""delete from log where event_type=? and
+            timestamp<? and object_id is not null""", args)
+        if self.con.execute("""select count() from log_compact
+            where timestamp>=?""", (before, )).fetchone()[0] == 0:
+            return
+        self.con.execute("""insert into log select * from log_all
+            where event_type=? and _id in (select _id from log_compact
+            where timestamp>=?)""", args)
+        self.con.execute("delete from log_compact where timestamp>=?",
+            (before, ))
+        self.con.execute("""delete from log_object_ids where _id not in
+            (select _object_id from log_compact)""")
+
+    def merge_log_archives(self, filenames, merged_filename):
+
+        """Write the logs of the archives in 'filenames' to a single new
+        archive 'merged_filename', in chronological order and dropping
+        duplicate entries, i.e. entries with the same timestamp, event type
+        and object id. The archives are streamed, so this works in bounded
+        memory for archives of any size. Returns the number of duplicates
+        dropped.
+
+        """
+
+        self._create_log_archive(merged_filename)
+        con = sqlite3.connect(merged_filename)
+        duplicates = 0
+        sql = "insert into log(%s) values(%s)" % \
+            (LOG_COLUMNS, ",".join(["?"] * 15))
+        entries = _unique_log_entries(filenames)
+        while True:
+            chunk = list(itertools.islice(entries, 1000))
+            if not chunk:
+                break
+            con.executemany(sql, [entry for entry, count in chunk])
+            duplicates += sum(count for entry, count in chunk)
+        con.commit()
+        con.close()
+        return duplicates
+
+    def verify_merged_log_archive(self, filenames, merged_filename):
+
+        """Check that 'merged_filename' contains each log entry of the
+        archives in 'filenames' exactly once, and return the number of
+        duplicates which were dropped.
+
+        """
+
+        merged = _sorted_log_entries(merged_filename)
+        duplicates = 0
+        for unique, merged_entry in itertools.zip_longest(\
+            _unique_log_entries(filenames), merged):
+            if unique is None or merged_entry is None or \
+                unique[0] != merged_entry:
+                raise MnemosyneError(_("Merged log archive is incomplete."))
+            duplicates += unique[1]
+        return duplicates
+
+    def merge_archive_dir(self):
+
+        """Replace the archives of this database in the archive dir (except
+        the one which is still being filled) by a single merged archive. The
+        original files are only deleted after the merged archive has been
+        verified. Archives of other databases are left alone.
+
+        """
+
+        archive_dir = os.path.join(self.config().data_dir, "archive")
+        if not os.path.exists(archive_dir):
+            return 0
+        prefix = self._log_archive_prefix()
+        filenames = [os.path.join(archive_dir, filename) for filename in \
+            sorted(os.listdir(archive_dir)) if filename.endswith(".db") and \
+            filename.startswith(prefix) and \
+            filename != self._global_variable("log_archive_name")]
+        if len(filenames) < 2:
+            return 0
+        self.main_widget().set_progress_text(_("Merging archived logs..."))
+        merged_filename = os.path.join(archive_dir,
+            self._new_log_archive_name())
+        while merged_filename in filenames:
+            merged_filename = merged_filename[:-3] + "-merged.db"
+        duplicates = self.merge_log_archives(filenames, merged_filename)
+        try:
+            self.verify_merged_log_archive(filenames, merged_filename)
+        except MnemosyneError:
+            os.remove(merged_filename)
+            self.main_widget().close_progress()
+            raise
+        for filename in filenames:
+            os.remove(filename)
         self.main_widget().close_progress()
+        return duplicates
 
     def log_warn_about_too_many_cards(self, timestamp):
-        self.con.execute(
+        self._log(
             "insert into log(event_type, timestamp) values(?,?)",
             (EventTypes.WARNED_TOO_MANY_CARDS, int(timestamp)))
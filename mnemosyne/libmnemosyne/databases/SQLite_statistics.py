@@ -16,37 +16,41 @@ class SQLiteStatistics(object):
     """Code to be injected into the SQLite database class through inheritance,
     so that SQLite.py does not becomes too large.
 
+    All queries here only read from the database, so they go through
+    'read_con', which lets other threads read while e.g. a sync is writing.
+
     """
 
     def tag_count(self):
-        return self.con.execute("select count() from tags").fetchone()[0]
+        return self.read_con.execute("select count() from tags").fetchone()[0]
 
     def fact_count(self):
-        return self.con.execute("select count() from facts").fetchone()[0]
+        return self.read_con.execute("select count() from facts").fetchone()[0]
 
     def card_count(self):
-        return self.con.execute("""select count() from cards""").fetchone()[0]
+        return self.read_con.execute(\
+            """select count() from cards""").fetchone()[0]
 
     def non_memorised_count(self):
-        return self.con.execute("""select count() from cards
+        return self.read_con.execute("""select count() from cards
             where active=1 and grade<2""").fetchone()[0]
 
     def scheduled_count(self, timestamp):
-        count = self.con.execute("""select count() from cards
+        count = self.read_con.execute("""select count() from cards
             where active=1 and grade>=2 and ?>=next_rep
             and ret_reps_since_lapse<=?""", (timestamp,
             self.config()["max_ret_reps_since_lapse"])).fetchone()[0]
         return count
 
     def active_count(self):
-        return self.con.execute("""select count() from cards
+        return self.read_con.execute("""select count() from cards
             where active=1""").fetchone()[0]
 
     def easinesses(self, active_only):
         query = "select easiness from cards where grade>=0"
         if active_only:
             query += " and active=1"
-        return [cursor[0] for cursor in self.con.execute(query)]
+        return [cursor[0] for cursor in self.read_con.execute(query)]
 
     def easinesses_for_tag(self, tag, active_only):
         query = """select cards.easiness from cards, tags_for_card where
@@ -54,20 +58,55 @@ class SQLiteStatistics(object):
             tags_for_card._tag_id=?"""
         if active_only:
             query += " and cards.active=1"
-        return [cursor[0] for cursor in self.con.execute(query,
+        return [cursor[0] for cursor in self.read_con.execute(query,
             (tag._id, ))]
 
+    def _grade_and_easiness_for_cards_with_tags(self, tags, active_only):
+
+        """Return a dictionary {_card_id: (grade, easiness)} for the cards
+        having at least one of 'tags', such that cards with several of these
+        tags are only included once.
+
+        """
+
+        grade_and_easiness = {}
+        _tag_ids = [tag._id for tag in tags]
+        # Limit to 500 at a time to stay below the maximum number of
+        # arguments in a query.
+        for i in range(0, len(_tag_ids), 500):
+            chunk = _tag_ids[i:i+500]
+            query = """select _id, grade, easiness from cards where _id in
+                (select _card_id from tags_for_card where _tag_id in (%s))""" \
+                % ",".join("?" for _tag_id in chunk)
+            if active_only:
+                query += " and active=1"
+            for cursor in self.read_con.execute(query, chunk):
+                grade_and_easiness[cursor[0]] = (cursor[1], cursor[2])
+        return grade_and_easiness
+
+    def easinesses_for_tags(self, tags, active_only):
+
+        """Easinesses of the cards having at least one of 'tags'. Unlike for
+        repeated calls to 'easinesses_for_tag', cards with several of these
+        tags are only included once.
+
+        """
+
+        return [easiness for grade, easiness in \
+            self._grade_and_easiness_for_cards_with_tags(\
+            tags, active_only).values() if grade >= 0]
+
     def card_count_for_fact_view(self, fact_view, active_only):
         query = "select count() from cards where fact_view_id=?"
         if active_only:
             query += " and active=1"
-        return self.con.execute(query, (fact_view.id, )).fetchone()[0]
+        return self.read_con.execute(query, (fact_view.id, )).fetchone()[0]
 
     def card_count_for_grade(self, grade, active_only):
         query = "select count() from cards where grade=?"
         if active_only:
             query += " and active=1"
-        return self.con.execute(query, (grade, )).fetchone()[0]
+        return self.read_con.execute(query, (grade, )).fetchone()[0]
 
     def card_count_for_tags(self, tags, active_only):
 
@@ -88,7 +127,7 @@ class SQLiteStatistics(object):
             query += "_tag_id=? or "
             args.append(tag._id)
         query = query.rsplit("or ", 1)[0]
-        return self.con.execute(query, args).fetchone()[0]
+        return self.read_con.execute(query, args).fetchone()[0]
 
     def card_count_for_grade_and_tag(self, grade, tag, active_only):
         query = """select count() from cards, tags_for_card where
@@ -96,7 +135,66 @@ class SQLiteStatistics(object):
             and grade=?"""
         if active_only:
             query += " and cards.active=1"
-        return self.con.execute(query, (tag._id, grade)).fetchone()[0]
+        return self.read_con.execute(query, (tag._id, grade)).fetchone()[0]
+
+    def card_count_for_grades_and_tags(self, tags, active_only):
+
+        """Return a dictionary {grade: count} for the cards having at least
+        one of 'tags'. Cards with several of these tags are only counted
+        once.
+
+        """
+
+        counts = {}
+        for grade, easiness in self._grade_and_easiness_for_cards_with_tags(\
+            tags, active_only).values():
+            counts[grade] = counts.get(grade, 0) + 1
+        return counts
+
+    def statistics_for_tags(self, timestamp):
+
+        """Return a dictionary {_tag_id: (card count, active card count,
+        average easiness, scheduled count)} for all tags, aggregated in a
+        single pass over the cards and their tags.
+
+        The average easiness is taken over the cards which have been seen
+        (grade>=0), and is None if there are no such cards. The scheduled
+        count uses the same criteria as 'scheduled_count(timestamp)'.
+
+        """
+
+        statistics = dict((cursor[0], (0, 0, None, 0)) for cursor in \
+            self.read_con.execute("select _id from tags"))
+        for cursor in self.read_con.execute(\
+            """select tags_for_card._tag_id, count(), sum(cards.active=1),
+            avg(case when cards.grade>=0 then cards.easiness end),
+            sum(cards.active=1 and cards.grade>=2 and cards.next_rep<=?
+            and cards.ret_reps_since_lapse<=?) from tags_for_card, cards
+            where tags_for_card._card_id=cards._id
+            group by tags_for_card._tag_id""", (timestamp,
+            self.config()["max_ret_reps_since_lapse"])):
+            statistics[cursor[0]] = tuple(cursor[1:])
+        return statistics
+
+    def card_count_for_tag_combinations(self):
+
+        """Return a list of (frozenset of _tag_ids, card count) for each
+        distinct combination of tags occurring on the cards.
+
+        This allows e.g. the tag tree to count the cards in any set of tags
+        without counting cards with several of these tags twice, without
+        having to query the database again for each set.
+
+        """
+
+        counts = {}
+        for _tag_ids, count in self.read_con.execute(\
+            """select _tag_ids, count() from (select
+            group_concat(_tag_id) as _tag_ids from tags_for_card
+            group by _card_id) group by _tag_ids"""):
+            _tag_ids = frozenset(int(_id) for _id in _tag_ids.split(","))
+            counts[_tag_ids] = counts.get(_tag_ids, 0) + count
+        return list(counts.items())
 
     def sister_card_count_scheduled_between(self, card, start, stop):
 
@@ -126,7 +224,7 @@ class SQLiteStatistics(object):
         #    ?<=next_rep and next_rep<? and _id<>?"""
         #return self.con.execute(query, (start, stop, card._id)).fetchone()[0]
 
-        _card_ids = [cursor[0] for cursor in self.con.execute(\
+        _card_ids = [cursor[0] for cursor in self.read_con.execute(\
             "select _id from cards where _fact_id=?", (card.fact._id, ))]
         if len(_card_ids) == 1: # No sister cards
             return 0
@@ -136,19 +234,49 @@ class SQLiteStatistics(object):
                 query += str(_card_id) + ","
         query = query[:-1] + """)"""
         count = 0
-        for cursor in self.con.execute(query):
+        for cursor in self.read_con.execute(query):
             if cursor[0] == True and cursor[1] >= 2 \
                 and start <= cursor[2] < stop:
                 count += 1
         return count
 
+    def sister_card_next_reps_from(self, card, start):
+
+        """Return the 'next_rep' of the active sister cards with grade >= 2
+        which are scheduled at or after 'start'.
+
+        """
+
+        return [cursor[0] for cursor in self.read_con.execute(\
+            """select next_rep from cards where _fact_id=? and _id<>? and
+            active=1 and grade>=2 and next_rep>=?""",
+            (card.fact._id, card._id, start))]
+
     def card_count_scheduled_between(self, start, stop):
-        return self.con.execute(\
+        return self.read_con.execute(\
             """select count() from cards where grade>=2 and ?<=next_rep and
             next_rep<? and ret_reps_since_lapse<=? and active='1'""",
             (start, stop,
              self.config()["max_ret_reps_since_lapse"])).fetchone()[0]
 
+    def card_count_scheduled_per_day(self, start, n):
+
+        """Return a dictionary {k: count} for k = 1, ..., n, with the number
+        of cards scheduled between 'start' + (k - 1) days (included) and
+        'start' + k days (excluded), all in a single query.
+
+        """
+
+        counts = dict.fromkeys(range(1, n + 1), 0)
+        for k, count in self.read_con.execute(\
+            """select cast((next_rep - ?) / 86400 as integer) + 1, count()
+            from cards where grade>=2 and ?<=next_rep and next_rep<? and
+            ret_reps_since_lapse<=? and active='1' group by 1""",
+            (start, start, start + n * DAY,
+             self.config()["max_ret_reps_since_lapse"])):
+            counts[k] = count
+        return counts
+
     def start_of_day_n_days_ago(self, n):
         timestamp = time.time() - n * DAY \
                     - self.config()["day_starts_at"] * HOUR
@@ -159,32 +287,167 @@ class SQLiteStatistics(object):
         start_of_day += self.config()["day_starts_at"] * HOUR
         return start_of_day
 
+    #
+    # Daily summaries of the log.
+    #
+    # Statistics about the past are read from summary tables with one row
+    # per day (and grade, event type or machine), rather than from the log
+    # itself, which can contain millions of repetitions. The summaries are
+    # updated incrementally using the last log _id which was processed, in the
+    # same way as the partnerships keep track of what has been synced.
+    #
+
+    def _statistics_summary_settings(self):
+        # The days in the summary depend on these, so if they change (e.g.
+        # after travelling to a different time zone), we need to rebuild.
+        return "%d %d %d" % (self.config()["day_starts_at"], time.timezone,
+            time.altzone)
+
+    def update_statistics_summary(self):
+
+        """Process the log entries which were added since the last update.
+
+        Does nothing when called from a thread which does not hold the
+        connection, as we can't write to the database then. The summary is
+        then a bit behind, until the next update.
+
+        """
+
+        if not self.is_loaded() or self.read_con is not self.con:
+            return
+        if self._global_variable("statistics_summary_settings") != \
+            self._statistics_summary_settings():
+            self.rebuild_statistics_summary()
+            return
+        _last_log_id = int(self._global_variable(\
+            "statistics_summary_last_log_id") or 0)
+        _max_log_id = self.con.execute("""select max(
+            coalesce((select max(_id) from log), 0),
+            coalesce((select max(_id) from log_compact), 0))""").fetchone()[0]
+        if _max_log_id <= _last_log_id:
+            return
+        day = "date(timestamp - %d, 'unixepoch', 'localtime')" \
+            % (self.config()["day_starts_at"] * HOUR)
+        args = (_last_log_id, _max_log_id)
+        self.con.execute("""insert into repetitions_for_day(day, grade, reps,
+            scheduled_reps, learned_reps, thinking_time) select %s, grade,
+            count(), coalesce(sum(scheduled_interval!=0), 0),
+            coalesce(sum(grade>=2 and ret_reps==0), 0),
+            coalesce(sum(thinking_time), 0) from log_all where ?<_id and _id<=?
+            and event_type=? group by 1, 2
+            on conflict(day, grade) do update set reps=reps+excluded.reps,
+            scheduled_reps=scheduled_reps+excluded.scheduled_reps,
+            learned_reps=learned_reps+excluded.learned_reps,
+            thinking_time=thinking_time+excluded.thinking_time""" % day,
+            args + (EventTypes.REPETITION, ))
+        self.con.execute("""insert into events_for_day(day, event_type, count)
+            select %s, event_type, count() from log where ?<_id and _id<=?
+            and event_type!=? group by 1, 2
+            on conflict(day, event_type) do update
+            set count=count+excluded.count""" % day,
+            args + (EventTypes.REPETITION, ))
+        self.con.execute("""insert into scheduled_count_for_day(day, machine,
+            scheduled_count) select %s, coalesce(object_id, ''),
+            max(acq_reps) from log where ?<_id and _id<=? and
+            (event_type=? or event_type=?) group by 1, 2
+            on conflict(day, machine) do update set
+            scheduled_count=max(scheduled_count, excluded.scheduled_count)"""
+            % day, args + (EventTypes.LOADED_DATABASE,
+            EventTypes.SAVED_DATABASE))
+        self._set_global_variable("statistics_summary_last_log_id",
+            _max_log_id)
+
+    def rebuild_statistics_summary(self):
+
+        """Recreate the summary tables from the entire log. Note that the
+        data for log entries which have since been archived will be lost.
+
+        """
+
+        if not self.is_loaded() or self.read_con is not self.con:
+            return
+        for table in ["repetitions_for_day", "events_for_day",
+            "scheduled_count_for_day"]:
+            self.con.execute("delete from %s" % table)
+        self._set_global_variable("statistics_summary_last_log_id", 0)
+        self._set_global_variable("statistics_summary_settings",
+            self._statistics_summary_settings())
+        self.update_statistics_summary()
+
+    def invalidate_statistics_summary(self):
+
+        """To be called after deleting log entries which could already have
+        been processed. The summary will be rebuilt when it's next needed.
+
+        """
+
+        self.con.execute("""delete from global_variables
+            where key='statistics_summary_settings'""")
+
+    def _summary_per_day_ago(self, first, last, columns, table,
+                             condition="1", args=(), group_by=""):
+
+        """Select 'columns' from the rows of the summary 'table' satisfying
+        'condition', between 'first' and 'last' days ago (0 being today),
+        grouped per day. Returns rows starting with the number of days ago.
+
+        """
+
+        self.update_statistics_summary()
+        today = datetime.date.fromtimestamp(\
+            time.time() - self.config()["day_starts_at"] * HOUR)
+        query = """select cast(round(julianday(?) - julianday(day))
+            as integer), %s from %s where ?<=day and day<=? and %s
+            group by 1%s""" % (columns, table, condition, group_by)
+        return self.read_con.execute(query, (today.isoformat(),
+            (today - datetime.timedelta(days=last)).isoformat(),
+            (today - datetime.timedelta(days=first)).isoformat()) + \
+            tuple(args))
+
+    def _scheduled_count_per_day_ago(self, first, last):
+        machine_counts_for_day = dict((n, []) for n in range(first, last + 1))
+        for n, machine, count in self._summary_per_day_ago(first, last,
+            "machine, max(scheduled_count)", "scheduled_count_for_day",
+            group_by=", machine"):
+            machine_counts_for_day[n].append((machine, count))
+        return dict((n, self._scheduled_count_from_machine_counts(\
+            machine_counts)) for n, machine_counts in \
+            machine_counts_for_day.items())
+
     def card_count_scheduled_n_days_ago(self, n):
-        start_of_day = self.start_of_day_n_days_ago(n)
+        return self._scheduled_count_per_day_ago(n, n)[n]
+
+    def card_count_scheduled_per_day_ago(self, n):
+
+        """Return a dictionary {k: card_count_scheduled_n_days_ago(k)} for
+        k = 0, ..., n, using a single query.
+
+        """
+
+        return self._scheduled_count_per_day_ago(0, n)
+
+    def _scheduled_count_from_machine_counts(self, machine_counts):
+
+        """'machine_counts' are (machine id, max scheduled count) pairs for a
+        given day.
+
+        """
+
         actual_counts_for_machine = {}
         projected_counts_for_machine = {}
-        # For each machine id, get the number of cards that were scheduled
+        # For each machine id, we have the number of cards that were scheduled
         # that day. Make a distinction between the actual schedule and the
         # scheduled that was projected in the future during database load
         # events. For each machine, we take the largest number in the logs,
         # i.e. those at the start of the day.
-        for cursor in self.con.execute("""select acq_reps, object_id from log
-            where ?<=timestamp and timestamp<? and (event_type=? or
-            event_type=?)""", (start_of_day, start_of_day + DAY,
-            EventTypes.LOADED_DATABASE, EventTypes.SAVED_DATABASE)):
-            count = cursor[0]
-            machine = cursor[1]
+        for machine, count in machine_counts:
             # Future projected schedule. Check if machine exists to deal with
             # Mnemosyne versions before 201203.
             if machine and machine.endswith(".fut"):
-                if not machine in projected_counts_for_machine or \
-                    (projected_counts_for_machine[machine] < count):
-                    projected_counts_for_machine[machine] = count
+                projected_counts_for_machine[machine] = count
             # Actual schedule.
             else:
-                if not machine in actual_counts_for_machine or \
-                    (actual_counts_for_machine[machine] < count):
-                    actual_counts_for_machine[machine] = count
+                actual_counts_for_machine[machine] = count
         # In case several machines report a different scheduded count, take
         # the minimum, as we assume that the larger number corresponds to
         # another machine which was kept running and therefore accumulated a
@@ -204,41 +467,95 @@ class SQLiteStatistics(object):
         # It can also go wrong after resolution of a sync conflict when all the
         # reviews are done for the day.
 
+    def _card_count_added_per_day_ago(self, first, last):
+        counts = dict.fromkeys(range(first, last + 1), 0)
+        for n, count in self._summary_per_day_ago(first, last, "sum(count)",
+            "events_for_day", "event_type=?", (EventTypes.ADDED_CARD, )):
+            counts[n] = count
+        return counts
+
     def card_count_added_n_days_ago(self, n):
-        start_of_day = self.start_of_day_n_days_ago(n)
-        return self.con.execute(\
-            """select count() from log where ?<=timestamp and timestamp<?
-            and event_type=?""",
-            (start_of_day, start_of_day + DAY, EventTypes.ADDED_CARD)).\
-            fetchone()[0]
+        return self._card_count_added_per_day_ago(n, n)[n]
+
+    def card_count_added_per_day_ago(self, n):
+
+        """Return a dictionary {k: card_count_added_n_days_ago(k)} for
+        k = 0, ..., n, using a single query.
+
+        """
+
+        return self._card_count_added_per_day_ago(0, n)
+
+    def _card_count_learned_per_day_ago(self, first, last):
+        counts = dict.fromkeys(range(first, last + 1), 0)
+        for n, count in self._summary_per_day_ago(first, last,
+            "sum(learned_reps)", "repetitions_for_day"):
+            counts[n] = count
+        return counts
 
     def card_count_learned_n_days_ago(self, n):
-        start_of_day = self.start_of_day_n_days_ago(n)
-        return self.con.execute(\
-            """select count() from log where ?<=timestamp and timestamp<?
-            and event_type=? and grade>=2 and ret_reps==0""",
-            (start_of_day, start_of_day + DAY, EventTypes.REPETITION)).\
-            fetchone()[0]
+        return self._card_count_learned_per_day_ago(n, n)[n]
+
+    def card_count_learned_per_day_ago(self, n):
+
+        """Return a dictionary {k: card_count_learned_n_days_ago(k)} for
+        k = 0, ..., n, using a single query.
+
+        """
+
+        return self._card_count_learned_per_day_ago(0, n)
+
+    def _retention_score_per_day_ago(self, first, last):
+        scores = dict.fromkeys(range(first, last + 1), 0)
+        for n, seen, correct in self._summary_per_day_ago(first, last,
+            """sum(scheduled_reps),
+            sum(case when grade>=2 then scheduled_reps else 0 end)""",
+            "repetitions_for_day"):
+            if seen:
+                scores[n] = 100.0 * correct / seen
+        return scores
 
     def retention_score_n_days_ago(self, n):
-        start_of_day = self.start_of_day_n_days_ago(n)
-        scheduled_cards_seen = self.con.execute(\
-            """select count() from log where ?<=timestamp and timestamp<?
-            and event_type=? and scheduled_interval!=0""",
-            (start_of_day, start_of_day + DAY, EventTypes.REPETITION)).\
-            fetchone()[0]
-        if scheduled_cards_seen == 0:
-            return 0
-        scheduled_cards_correct = self.con.execute(\
-            """select count() from log where ?<=timestamp and timestamp<?
-            and event_type=? and scheduled_interval!=0 and grade>=2""",
-            (start_of_day, start_of_day + DAY, EventTypes.REPETITION)).\
-            fetchone()[0]
-        return 100.0 * scheduled_cards_correct / scheduled_cards_seen
+        return self._retention_score_per_day_ago(n, n)[n]
+
+    def retention_score_per_day_ago(self, n):
+
+        """Return a dictionary {k: retention_score_n_days_ago(k)} for
+        k = 0, ..., n, using a single query.
+
+        """
+
+        return self._retention_score_per_day_ago(0, n)
+
+    def average_grade_per_day_ago(self, n):
+
+        """Return a dictionary {k: average grade} of the scheduled
+        repetitions of k days ago, for the days with such repetitions between
+        0 and n days ago.
+
+        """
+
+        averages = {}
+        for k, seen, total in self._summary_per_day_ago(0, n,
+            "sum(scheduled_reps), sum(grade * scheduled_reps)",
+            "repetitions_for_day"):
+            if seen:
+                averages[k] = total / seen
+        return averages
+
+    def thinking_time_per_day_ago(self, n):
+
+        """Return a dictionary {k: total thinking time} for k = 0, ..., n."""
+
+        times = dict.fromkeys(range(n + 1), 0)
+        for k, thinking_time in self._summary_per_day_ago(0, n,
+            "sum(thinking_time)", "repetitions_for_day"):
+            times[k] = thinking_time
+        return times
 
     def average_thinking_time(self, card):
-        result = self.con.execute(\
-            """select avg(thinking_time) from log where object_id=?
+        result = self.read_con.execute(\
+            """select avg(thinking_time) from log_all where object_id=?
             and event_type=?""",
             (card.id, EventTypes.REPETITION)).fetchone()[0]
         if result:
@@ -247,8 +564,8 @@ class SQLiteStatistics(object):
             return 0
 
     def total_thinking_time(self, card):
-        result = self.con.execute(\
-            """select sum(thinking_time) from log where object_id=?
+        result = self.read_con.execute(\
+            """select sum(thinking_time) from log_all where object_id=?
             and event_type=?""",
             (card.id, EventTypes.REPETITION)).fetchone()[0]
         if result:
@@ -8,6 +8,7 @@ import os
 import re
 import time
 import sqlite3
+import itertools
 
 from openSM2sync.log_entry import LogEntry
 from openSM2sync.log_entry import EventTypes
@@ -123,10 +124,7 @@ class SQLiteSync(object):
             raise RuntimeError(_("Missing plugins for card types."))
         # See if we need to reapply the default criterion.
         if self.reapply_default_criterion_needed:
-            criterion = self.current_criterion()
-            applier = self.component_manager.current("criterion_applier",
-                used_for=criterion.__class__)
-            applier.apply_to_database(criterion)
+            self._apply_current_criterion()
         # Now we can update the last log index.
         self.con.execute(\
             "update partnerships set _last_log_id=? where partner=?",
@@ -136,7 +134,8 @@ class SQLiteSync(object):
             interested_in_old_reps=True):
         _id = self.last_log_index_synced_for(partner)
         if interested_in_old_reps:
-            return self.con.execute("select count() from log where _id>?",
+            return self.con.execute(\
+                "select count() from log_all where _id>?",
                 (_id, )).fetchone()[0]
         else:
             return self.con.execute("""select count() from log where _id>? and
@@ -144,7 +143,8 @@ class SQLiteSync(object):
 
     def number_of_log_entries(self, interested_in_old_reps=True):
         if interested_in_old_reps:
-            return self.con.execute("select count() from log").fetchone()[0]
+            return self.con.execute(\
+                "select count() from log_all").fetchone()[0]
         else:
             return self.con.execute("""select count() from log where
                 event_type!=?""", (EventTypes.REPETITION,)).fetchone()[0]
@@ -158,22 +158,61 @@ class SQLiteSync(object):
 
         _id = self.last_log_index_synced_for(partner)
         if interested_in_old_reps:
-            return (self._log_entry(cursor) for cursor in self.con.execute(\
-                "select * from log where _id>?", (_id, )))
+            return self._log_entries(self.con.execute(\
+                "select * from log_all where _id>? order by _id", (_id, )))
         else:
-            return (self._log_entry(cursor) for cursor in self.con.execute(\
+            return self._log_entries(self.con.execute(\
                 "select * from log where _id>? and event_type!=?",
                 (_id, EventTypes.REPETITION)))
 
     def all_log_entries(self, interested_in_old_reps=True):
         if interested_in_old_reps:
-            return (self._log_entry(cursor) for cursor in self.con.execute(\
-                "select * from log"))
+            return self._log_entries(self.con.execute(\
+                "select * from log_all order by _id"))
         else:
-            return (self._log_entry(cursor) for cursor in self.con.execute(\
+            return self._log_entries(self.con.execute(\
                 "select * from log where event_type!=?",
                 (EventTypes.REPETITION, )))
 
+    def _log_entries(self, cursor):
+
+        """Iterator over the log entries for the log rows in 'cursor'.
+
+        Rather than letting '_log_entry' construct the cards and facts it
+        needs one by one, we process the rows in chunks and construct all
+        the cards and facts of a chunk in bulk.
+
+        """
+
+        while True:
+            chunk = list(itertools.islice(cursor, 500))
+            if len(chunk) == 0:
+                break
+            card_ids, fact_ids = set(), set()
+            for sql_res in chunk:
+                if sql_res[1] in (EventTypes.ADDED_CARD,
+                    EventTypes.EDITED_CARD):
+                    card_ids.add(sql_res[3])
+                elif sql_res[1] in (EventTypes.ADDED_FACT,
+                    EventTypes.EDITED_FACT):
+                    fact_ids.add(sql_res[3])
+            card_for_id = dict((card.id, card) for card in \
+                self.cards_with_internal_ids(self._internal_ids_for(\
+                "cards", card_ids)))
+            fact_for_id = dict((fact.id, fact) for fact in \
+                self.facts_with_internal_ids(self._internal_ids_for(\
+                "facts", fact_ids)))
+            for sql_res in chunk:
+                yield self._log_entry(sql_res, card_for_id, fact_for_id)
+
+    def _internal_ids_for(self, table, ids):
+        ids = list(ids)
+        if len(ids) == 0:
+            return []
+        return [cursor[0] for cursor in self.con.execute(\
+            "select _id from %s where id in (%s)" % \
+            (table, ",".join("?" * len(ids))), ids)]
+
     def media_filenames_to_sync_for(self, partner):
 
         """Determine which media files need to be sent across during the sync.
@@ -275,9 +314,14 @@ class SQLiteSync(object):
     def set_extra_tags_on_import(self, tags):
         self.extra_tags_on_import = tags
 
-    def _log_entry(self, sql_res):
+    def _log_entry(self, sql_res, card_for_id=None, fact_for_id=None):
 
-        """Create log entry object in the format openSM2sync expects."""
+        """Create log entry object in the format openSM2sync expects.
+
+        'card_for_id' and 'fact_for_id' are optional dictionaries with cards
+        and facts which have already been constructed, see '_log_entries'.
+
+        """
 
         log_entry = LogEntry()
         log_entry["type"] = sql_res[1]
@@ -292,7 +336,13 @@ class SQLiteSync(object):
             log_entry["n_mem"] = sql_res[7]
             log_entry["act"] = sql_res[8]
         elif event_type in (EventTypes.ADDED_CARD, EventTypes.EDITED_CARD):
-            if self.has_card_with_id(log_entry["o_id"]):
+            if card_for_id is not None:
+                card = card_for_id.get(log_entry["o_id"])
+            elif self.has_card_with_id(log_entry["o_id"]):
+                card = self.card(log_entry["o_id"], is_id_internal=False)
+            else:
+                card = None
+            if card is not None:
                 # Note that some of these values (e.g. the repetition count) we
                 # could in theory calculate from the previous state and the
                 # grade. However, we send the entire state of the card across
@@ -300,7 +350,6 @@ class SQLiteSync(object):
                 # because of conflict resolution.
                 # Note that we deliberately do not send across 'active', as
                 # this is controlled by the remote client.
-                card = self.card(log_entry["o_id"], is_id_internal=False)
                 if self.sync_partner_info.get("capabilities") == "cards":
                     log_entry["f"] = card.question("sync_to_card_only_client")
                     log_entry["b"] = card.answer("sync_to_card_only_client")
@@ -356,8 +405,13 @@ class SQLiteSync(object):
             if self.sync_partner_info.get("capabilities") == "cards":
                 # The accompanying ADDED_CARD and EDITED_CARD events suffice.
                 return None
-            if self.has_fact_with_id(log_entry["o_id"]):
+            if fact_for_id is not None:
+                fact = fact_for_id.get(log_entry["o_id"])
+            elif self.has_fact_with_id(log_entry["o_id"]):
                 fact = self.fact(log_entry["o_id"], is_id_internal=False)
+            else:
+                fact = None
+            if fact is not None:
                 for fact_key, value in fact.data.items():
                     log_entry[fact_key] = value
             else: # The object has been deleted at a later stage.
@@ -654,6 +708,13 @@ class SQLiteSync(object):
             card.ret_reps, card.lapses, card.acq_reps_since_lapse,
             card.ret_reps_since_lapse, card.last_rep, card.next_rep,
             card.scheduler_data, card.id))
+        if sch_data is not None:
+            session, default = self._scheduler_data_session()
+            self.con.execute("""insert or replace into
+                scheduler_data_for_session(_card_id, session, data)
+                select _id, ?, ? from cards where id=?""",
+                (session, sch_data, card.id))
+        self._forget_card(id=card.id)
 
     def add_media_file(self, log_entry):
 
@@ -904,6 +965,17 @@ class SQLiteSync(object):
                 else:
                     self.log_edited_setting(log_entry["time"], key)
         finally:
+            # Make sure we don't hold on to stale versions of the objects
+            # modified by this log entry.
+            if event_type in (EventTypes.ADDED_CARD, EventTypes.EDITED_CARD,
+                EventTypes.DELETED_CARD):
+                self._forget_card(id=log_entry["o_id"])
+            elif event_type in (EventTypes.ADDED_FACT,
+                EventTypes.EDITED_FACT, EventTypes.DELETED_FACT):
+                self._forget_fact(id=log_entry["o_id"])
+            elif event_type in (EventTypes.ADDED_TAG, EventTypes.EDITED_TAG,
+                EventTypes.DELETED_TAG):
+                self._forget_tag(id=log_entry["o_id"])
             self.log().timestamp = None
             self.syncing = False
             self.importing = False
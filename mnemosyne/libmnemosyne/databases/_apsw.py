@@ -74,6 +74,10 @@ class _APSW(Component):
     def executemany(self, sql, *args):
         return _APSWCursor(self.connection.cursor().executemany(sql, *args))
 
+    def execute_deferred(self, sql, args, tables):
+        # No write-behind buffering here.
+        self.execute(sql, args)
+
     def last_insert_rowid(self):
         return self.connection.last_insert_rowid()
 
@@ -87,5 +91,27 @@ class _APSW(Component):
                 raise e
         self.connection.cursor().execute("begin;")
 
+    @property
+    def in_transaction(self):
+        return not self.connection.getautocommit()
+
+    def copy_to(self, path):
+        dest = apsw.Connection(path)
+        try:
+            with dest.backup("main", self.connection, "main") as backup:
+                backup.step()
+        finally:
+            dest.close()
+
+    def rollback(self):
+        try:
+            self.connection.cursor().execute("rollback;")
+        except apsw.SQLError as e:
+            if "cannot rollback - no transaction is active" in str(e):
+                pass
+            else:
+                raise e
+        self.connection.cursor().execute("begin;")
+
     def close(self):
         self.connection.close()
\ No newline at end of file
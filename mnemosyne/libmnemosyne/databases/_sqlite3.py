@@ -8,40 +8,188 @@
 #
 
 import os
+import re
 import sys
 import time
 import sqlite3
+import logging
+import functools
+import itertools
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from urllib.request import pathname2url
 
 from mnemosyne.libmnemosyne.gui_translator import _
 from mnemosyne.libmnemosyne.component import Component
 from mnemosyne.libmnemosyne.utils import traceback_string, MnemosyneError
 
 
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_list_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalise_sql(sql):
+
+    """Strip literals and whitespace from a query, so that e.g. all the
+    'select ... where _id in (1,2,3)' queries are counted together.
+
+    """
+
+    sql = _literal_re.sub("?", sql)
+    sql = _in_list_re.sub("(?)", sql)
+    return " ".join(sql.split())
+
+
+class QueryStatistics(object):
+
+    """Keeps track of how often each (normalised) query gets executed, how
+    long this takes and how many rows are fetched from its results.
+
+    The latency is the time spent in 'execute', i.e. it does not include
+    the time needed to iterate over the results. For percentiles, only the
+    last 'max_samples' timings of each query are kept.
+
+    If 'slow_query_threshold' (in seconds) is larger than 0, queries taking
+    longer are also written to a rotating log file.
+
+    """
+
+    max_samples = 1000
+
+    def __init__(self, slow_query_threshold=0, slow_query_log=None,
+                 max_bytes=1024*1024, backup_count=3):
+        self.slow_query_threshold = slow_query_threshold
+        self._slow_query_handler = None
+        if slow_query_threshold > 0 and slow_query_log:
+            self._slow_query_handler = RotatingFileHandler(slow_query_log,
+                maxBytes=max_bytes, backupCount=backup_count,
+                encoding="utf-8", delay=True)
+            self._slow_query_handler.setFormatter(\
+                logging.Formatter("%(asctime)s %(message)s"))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+
+    def add(self, sql, args, duration):
+
+        """Returns the entry for the query, such that the cursor can update
+        the number of rows.
+
+        """
+
+        normalised_sql = normalise_sql(sql)
+        with self._lock:
+            entry = self._entries.get(normalised_sql)
+            if entry is None:
+                entry = self._entries[normalised_sql] = {"calls": 0,
+                    "time": 0.0, "rows": 0,
+                    "samples": deque(maxlen=self.max_samples)}
+            entry["calls"] += 1
+            entry["time"] += duration
+            entry["samples"].append(duration)
+            if self._slow_query_handler and \
+                duration >= self.slow_query_threshold:
+                self._slow_query_handler.handle(logging.makeLogRecord(\
+                    {"msg": "%.3f secs: %s %s" % (duration,
+                    " ".join(sql.split()), str(args)[:200])}))
+        return entry
+
+    def add_rows(self, entry, count):
+        with self._lock:
+            entry["rows"] += count
+
+    def report(self):
+
+        """List of dictionaries with keys 'sql', 'calls', 'time', 'p50',
+        'p99' and 'rows', sorted by decreasing cumulative time.
+
+        """
+
+        results = []
+        with self._lock:
+            for sql, entry in self._entries.items():
+                samples = sorted(entry["samples"])
+                results.append({"sql": sql, "calls": entry["calls"],
+                    "time": entry["time"], "rows": entry["rows"],
+                    "p50": samples[int(0.50 * (len(samples) - 1))],
+                    "p99": samples[int(0.99 * (len(samples) - 1))]})
+        results.sort(key=lambda x: x["time"], reverse=True)
+        return results
+
+    def dump(self, f):
+        f.write("%8s %10s %9s %9s %9s  %s\n" % \
+            ("calls", "total (s)", "p50 (ms)", "p99 (ms)", "rows", "query"))
+        for result in self.report():
+            f.write("%8d %10.3f %9.3f %9.3f %9d  %s\n" % (result["calls"],
+                result["time"], 1000 * result["p50"], 1000 * result["p99"],
+                result["rows"], result["sql"]))
+
+    def close(self):
+        with self._lock:
+            if self._slow_query_handler:
+                self._slow_query_handler.close()
+                self._slow_query_handler = None
+
+
 class _Sqlite3Cursor(object):
 
-    def __init__(self, cursor):
+    def __init__(self, cursor, query_statistics=None, entry=None):
         self.cursor = cursor
+        # Statistics for this query, if needed.
+        self.query_statistics = query_statistics
+        self.entry = entry
 
     def fetchone(self):
-        return self.cursor.fetchone()
+        row = self.cursor.fetchone()
+        if self.entry is not None and row is not None:
+            self.query_statistics.add_rows(self.entry, 1)
+        return row
 
     def fetchall(self):
-        return self.cursor.fetchall()
+        rows = self.cursor.fetchall()
+        if self.entry is not None:
+            self.query_statistics.add_rows(self.entry, len(rows))
+        return rows
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        return next(self.cursor)
+        row = next(self.cursor)
+        if self.entry is not None:
+            self.query_statistics.add_rows(self.entry, 1)
+        return row
 
 
 class _Sqlite3(Component):
 
+    """Statements passed to 'execute_deferred' are not executed immediately,
+    but buffered and executed in batches (write-behind). The buffer is
+    flushed before a commit, when it contains 'max_deferred' statements, and
+    before any other statement which mentions one of the tables (or views)
+    given for the deferred statements, so that e.g. reads of the log table
+    always see all the log entries. The statements are executed in the order in
+    which they were issued, consecutive identical statements using
+    'executemany'.
+
+    """
+
     DEBUG = False
 
-    def __init__(self, component_manager, path):
+    def __init__(self, component_manager, path, wal=False, read_only=False,
+                 query_statistics=None, max_deferred=100):
         Component.__init__(self, component_manager)
         self._cursor = None
+        self.query_statistics = query_statistics
+        self.max_deferred = max_deferred
+        self._deferred = []
+        self._deferred_tables = set()
+        self._deferred_tables_re = None
         # Make sure we don't put a database on a network drive under Windows:
         # http://www.sqlite.org/lockingv3.html
         if sys.platform == "win32":  # pragma: no cover
@@ -51,24 +199,87 @@ class _Sqlite3(Component):
                 self.main_widget().show_error(_\
 ("Putting a database on a network drive is forbidden under Windows to avoid data corruption. Mnemosyne will now close."))
                 sys.exit(-1)
+        if read_only:
+            # Read-only connections are handed out by a pool, so they can be
+            # reused by a different thread than the one that created them.
+            self.connection = sqlite3.connect("file:%s?mode=ro" % \
+                pathname2url(os.path.abspath(path)), uri=True,
+                check_same_thread=False)
+            return
         self.connection = sqlite3.connect(path)
-        # http://www.mail-archive.com/sqlite-users@sqlite.org/msg34453.html
-        self.connection.execute("pragma journal_mode = persist;")
+        self._thread_id = threading.get_ident()
+        if wal:
+            # Readers don't block the writer and vice versa.
+            # http://www.sqlite.org/wal.html
+            self.connection.execute("pragma journal_mode = wal;")
+        else:
+            # http://www.mail-archive.com/sqlite-users@sqlite.org/msg34453.html
+            self.connection.execute("pragma journal_mode = persist;")
         # Should only be used to speed up the test suite.
         if self.config()["asynchronous_database"] == True:
             self.connection.execute("pragma synchronous = off;")
 
+    def execute_deferred(self, sql, args, tables):
+        # The buffer belongs to the connection, which can only be used from
+        # the thread which created it.
+        assert threading.get_ident() == self._thread_id, \
+            "Deferred statement issued from the wrong thread."
+        if self.max_deferred <= 0:
+            self.execute(sql, args)
+            return
+        if not self._deferred_tables.issuperset(tables):
+            self._deferred_tables.update(tables)
+            self._deferred_tables_re = re.compile(r"\b(%s)\b" % \
+                "|".join(re.escape(table) for table in self._deferred_tables),
+                re.IGNORECASE)
+        self._deferred.append((sql, args))
+        if len(self._deferred) >= self.max_deferred:
+            self.flush_deferred()
+
+    def flush_deferred(self):
+        # Keep 'last_insert_rowid' working.
+        cursor = self._cursor
+        while self._deferred:
+            sql = self._deferred[0][0]
+            n = sum(1 for x in itertools.takewhile(\
+                lambda x: x[0] == sql, self._deferred))
+            group, rest = self._deferred[:n], self._deferred[n:]
+            # Empty the buffer while executing, as 'executemany' flushes it.
+            self._deferred = []
+            try:
+                self.executemany(sql, [args for sql, args in group])
+            except:
+                # Don't lose the statements which were not executed.
+                self._deferred = group + rest
+                raise
+            self._deferred = rest
+        self._cursor = cursor
+
+    def _flush_deferred_if_needed(self, sql):
+        if self._deferred and self._deferred_tables_re.search(sql):
+            self.flush_deferred()
+
     def executescript(self, script):
+        if self._deferred:
+            self.flush_deferred()
         if self.DEBUG:
             print(script)
+        # Local copy, as it could get replaced from another thread.
+        query_statistics = self.query_statistics
+        if self.DEBUG or query_statistics:
             t = time.time()
         self.connection.executescript(script)
         if self.DEBUG:
             print(("took %.3f secs" % (time.time() - t)))
+        if query_statistics:
+            query_statistics.add(script, (), time.time() - t)
 
     def execute(self, sql, *args):
+        self._flush_deferred_if_needed(sql)
         if self.DEBUG:
             print((sql, args))
+        query_statistics = self.query_statistics
+        if self.DEBUG or query_statistics:
             t = time.time()
         try:
             self._cursor = self.connection.execute(sql, *args)
@@ -77,23 +288,111 @@ class _Sqlite3(Component):
                 + "\n" + traceback_string())
         if self.DEBUG:
             print(("took %.3f secs" % (time.time() - t)))
+        if query_statistics:
+            return _Sqlite3Cursor(self._cursor, query_statistics,
+                query_statistics.add(sql, args, time.time() - t))
         return _Sqlite3Cursor(self._cursor)
 
     def executemany(self, sql, *args):
+        self._flush_deferred_if_needed(sql)
         if self.DEBUG:
             print((sql, args))
+        query_statistics = self.query_statistics
+        if self.DEBUG or query_statistics:
             t = time.time()
         self._cursor = self.connection.executemany(sql, *args)
         if self.DEBUG:
             print(("took %.3f secs" % (time.time() - t)))
+        if query_statistics:
+            # Don't keep the (possibly large) list of arguments around.
+            query_statistics.add(sql, (), time.time() - t)
         return _Sqlite3Cursor(self._cursor)
 
     def last_insert_rowid(self):
         return self._cursor.lastrowid
 
     def commit(self):
+        if self._deferred:
+            self.flush_deferred()
         return self.connection.commit()
 
+    @property
+    def in_transaction(self):
+        return self.connection.in_transaction
+
+    def copy_to(self, path):
+        # Unlike copying the file, SQLite's online backup also includes the
+        # changes which are still in the write-ahead log, and raises an error
+        # instead of producing an incomplete copy.
+        dest = sqlite3.connect(path)
+        try:
+            self.connection.backup(dest)
+        finally:
+            dest.close()
+
+    def rollback(self):
+        # Like uncommitted changes, deferred statements are discarded.
+        self._deferred = []
+        return self.connection.rollback()
+
     def close(self):
+        # Like uncommitted changes, deferred statements are discarded.
+        self._deferred = []
         del self._cursor
         return self.connection.close()
+
+
+class _Sqlite3ReaderPool(object):
+
+    """Read-only connections to a database in WAL mode, one per thread, so
+    that e.g. the statistics can be calculated while another thread is
+    writing to the database during a sync.
+
+    A connection is only ever used by the thread it was handed out to, so
+    it is never closed while another thread is using it. Once more than
+    'max_size' connections are open, those of threads which have finished
+    are closed. The others are closed when the pool is closed.
+
+    """
+
+    def __init__(self, component_manager, path, max_size,
+                 query_statistics=None):
+        self.component_manager = component_manager
+        self.path = path
+        self.max_size = max_size
+        self.query_statistics = query_statistics
+        self._connection_for_thread = {}
+        self._lock = threading.Lock()
+
+    def connection(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            connection = self._connection_for_thread.get(thread_id)
+            if connection is None:
+                if len(self._connection_for_thread) >= max(self.max_size, 1):
+                    self._close_connections_of_finished_threads()
+                connection = _Sqlite3(self.component_manager, self.path,
+                    read_only=True, query_statistics=self.query_statistics)
+                self._connection_for_thread[thread_id] = connection
+            return connection
+
+    def _close_connections_of_finished_threads(self):
+        running = set(thread.ident for thread in threading.enumerate())
+        for thread_id in list(self._connection_for_thread.keys()):
+            if thread_id not in running:
+                self._connection_for_thread.pop(thread_id).close()
+
+    def set_query_statistics(self, query_statistics):
+        with self._lock:
+            self.query_statistics = query_statistics
+            for connection in self._connection_for_thread.values():
+                connection.query_statistics = query_statistics
+
+    def __len__(self):
+        return len(self._connection_for_thread)
+
+    def close(self):
+        with self._lock:
+            for connection in self._connection_for_thread.values():
+                connection.close()
+            self._connection_for_thread.clear()
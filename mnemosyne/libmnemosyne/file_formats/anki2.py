@@ -216,6 +216,7 @@ class Anki2(FileFormat, MediaPreprocessor):
         w.set_progress_update_interval(number_of_notes/20)
         fact_for_nid = {}
         modification_time_for_nid = {}
+        new_facts, new_fact_ids = [], set()
         for id, guid, mid, mod, usn, tags, flds, sfld, csum, flags, data in \
             con.execute("""select id, guid, mid, mod, usn, tags, flds, sfld,
             csum, flags, data from notes"""):
@@ -249,16 +250,23 @@ class Anki2(FileFormat, MediaPreprocessor):
                 data = data.replace("[$$]", "<$$>")
                 data = data.replace("[/$$]", "</$$>")
                 fact_data[fact_key] = data
+            # A guid which occurs twice updates the fact added the first
+            # time, so add the pending facts first.
+            if guid in new_fact_ids:
+                db.add_facts(new_facts)
+                new_facts, new_fact_ids = [], set()
             if db.has_fact_with_id(guid):
                 fact = db.fact(guid, is_id_internal=False)
                 fact.data = fact_data
                 db.update_fact(fact)
             else:
                 fact = Fact(fact_data, id=guid)
-                db.add_fact(fact)
+                new_facts.append(fact)
+                new_fact_ids.add(guid)
             fact_for_nid[id] = fact
             tag_names_for_nid[id] = tags
             w.increase_progress(1)
+        db.add_facts(new_facts)
         # Import logs. This needs to happen before creating the cards,
         # otherwise, the sync protocol will use the scheduling data from the
         # latest repetition log, instead of the correct current one.
@@ -292,6 +300,7 @@ class Anki2(FileFormat, MediaPreprocessor):
         number_of_cards = con.execute("select count() from cards").fetchone()[0]
         w.set_progress_range(number_of_cards)
         w.set_progress_update_interval(number_of_cards/20)
+        new_cards = []
         for id, nid, did, ord, mod, usn, type_, queue, due, ivl, factor, reps, \
             lapses, left, odue, odid, flags, data in con.execute("""select id,
             nid, did, ord, mod, usn, type, queue, due, ivl, factor, reps,
@@ -361,8 +370,9 @@ class Anki2(FileFormat, MediaPreprocessor):
             if already_imported:
                 db.update_card(card)
             else:
-                db.add_card(card)
+                new_cards.append(card)
             w.increase_progress(1)
+        db.add_cards(new_cards)
         # Create criteria for 'database' tags.
         for deck_name in deck_name_for_did.values():
             deck_name = deck_name.strip().replace(",", ";")
@@ -59,6 +59,7 @@ class Smconv_XML(FileFormat, MediaPreprocessor):
         card_type = self.card_type_with_id("1")
         tag_names = [tag_name.strip() for \
             tag_name in extra_tag_names.split(",") if tag_name.strip()]
+        cards_data, learning_data = [], []
         for element in tree.find("cards").findall("card"):
             category = element.attrib["category"]
             commit = not (element.attrib["commit"] == "0")
@@ -107,36 +108,43 @@ class Smconv_XML(FileFormat, MediaPreprocessor):
             # Construct card.
             fact_data = {"f": question, "b": answer}
             self.preprocess_media(fact_data, tag_names)
-            card = self.controller().create_new_cards(fact_data, card_type,
-                grade=grade, tag_names=tag_names + [category],
-                check_for_duplicates=False, save=False)[0]
+            cards_data.append((fact_data, card_type, grade,
+                tag_names + [category]))
+            learning_data.append((card_other, interval, difficulty))
             if _("MISSING_MEDIA") in tag_names:
                 tag_names.remove(_("MISSING_MEDIA"))
-            if card_other is not None:
-                card.creation_time = int(time.mktime(time.strptime(\
-                    card_other.attrib["datecreate"], "%Y-%m-%d")))
-                card.modification_time = int(time.mktime(time.strptime(\
-                    card_other.attrib["datecommit"], "%Y-%m-%d")))
-                card.next_rep = self.scheduler().midnight_UTC(int(time.mktime(\
-                    time.strptime(card_other.attrib["datenexttest"],
-                    "%Y-%m-%d"))))
-                card.last_rep = card.next_rep - interval
-                card.lapses = int(card_other.attrib["lapses"])
-                # Try to fill acquisiton reps and retention reps.
-                # Since SM statistics are only available for commited
-                # cards, I take acq_reps = 0 and ret_reps = lapses + recalls.
-                card.ret_reps = card.lapses + int(card_other.attrib["recalls"])
-                # Try to derive an easines factor EF from [1.3 .. 3.2] from
-                # difficulty d from [1% .. 100%].
-                # The math below is set to translate
-                # difficulty=100% --> easiness = 1.3
-                # difficulty=40% --> easiness = 2.5
-                # difficulty=1% --> easiness = 3.2
-                dp = difficulty * 0.01
-                # Small values should be easy, large ones hard.
-                if dp > 0.4:
-                    card.easiness = 1.28 - 1.32 * math.log(dp)
-                else:
-                    card.easiness = 4.2 - 1.139 * math.exp(dp)
-                self.database().update_card(card)
+        # Create all the cards in one go, and then fill in the learning data.
+        all_cards = self.controller().create_new_cards_bulk(cards_data,
+            save=False)
+        for cards, (card_other, interval, difficulty) in \
+            zip(all_cards, learning_data):
+            if card_other is None:
+                continue
+            card = cards[0]
+            card.creation_time = int(time.mktime(time.strptime(\
+                card_other.attrib["datecreate"], "%Y-%m-%d")))
+            card.modification_time = int(time.mktime(time.strptime(\
+                card_other.attrib["datecommit"], "%Y-%m-%d")))
+            card.next_rep = self.scheduler().midnight_UTC(int(time.mktime(\
+                time.strptime(card_other.attrib["datenexttest"],
+                "%Y-%m-%d"))))
+            card.last_rep = card.next_rep - interval
+            card.lapses = int(card_other.attrib["lapses"])
+            # Try to fill acquisiton reps and retention reps.
+            # Since SM statistics are only available for commited
+            # cards, I take acq_reps = 0 and ret_reps = lapses + recalls.
+            card.ret_reps = card.lapses + int(card_other.attrib["recalls"])
+            # Try to derive an easines factor EF from [1.3 .. 3.2] from
+            # difficulty d from [1% .. 100%].
+            # The math below is set to translate
+            # difficulty=100% --> easiness = 1.3
+            # difficulty=40% --> easiness = 2.5
+            # difficulty=1% --> easiness = 3.2
+            dp = difficulty * 0.01
+            # Small values should be easy, large ones hard.
+            if dp > 0.4:
+                card.easiness = 1.28 - 1.32 * math.log(dp)
+            else:
+                card.easiness = 4.2 - 1.139 * math.exp(dp)
+            self.database().update_card(card)
         self.warned_about_missing_media = False
\ No newline at end of file
@@ -70,6 +70,7 @@ class SuperMemo7Txt(FileFormat, MediaPreprocessor):
         card_type = self.card_type_with_id("1")
         tag_names = [tag_name.strip() for \
             tag_name in extra_tag_names.split(",") if tag_name.strip()]
+        cards_data, learning_data = [], []
         while not error and state != "END-OF-FILE":
             line = self.read_line_sm7qa(f)
             # Perform the actions of the current state and calculate
@@ -174,24 +175,31 @@ class SuperMemo7Txt(FileFormat, MediaPreprocessor):
                 fact_data = {"f": saxutils.escape(question),
                     "b": saxutils.escape(answer)}
                 self.preprocess_media(fact_data, tag_names)
-                card = self.controller().create_new_cards(fact_data, card_type,
-                    grade=grade, tag_names=tag_names,
-                    check_for_duplicates=False, save=False)[0]
+                cards_data.append((fact_data, card_type, grade,
+                    list(tag_names)))
+                learning_data.append((easiness, lapses, repetitions, last,
+                    interval))
                 if _("MISSING_MEDIA") in tag_names:
                     tag_names.remove(_("MISSING_MEDIA"))
-                card.easiness = easiness
-                # There is no possibility to calculate the correct values for
-                # card.acq_reps and card.ret_reps from the SM file format.
-                card.acq_reps = 0
-                card.ret_reps = 0
-                card.lapses = lapses
-                # card.acq_reps_since_lapse cannot be reconstructed from SM.
-                card.ret_reps_since_lapse = max(0, repetitions - 1)
-                card.last_rep = self.scheduler().midnight_UTC(last)
-                card.next_rep = card.last_rep + interval
-                # The following information from SM is not used: UF, O_value.
-                self.database().update_card(card)
             state = next_state
+        # Create all the cards in one go, and then fill in the learning data.
+        all_cards = self.controller().create_new_cards_bulk(cards_data,
+            save=False)
+        for cards, (easiness, lapses, repetitions, last, interval) in \
+            zip(all_cards, learning_data):
+            card = cards[0]
+            card.easiness = easiness
+            # There is no possibility to calculate the correct values for
+            # card.acq_reps and card.ret_reps from the SM file format.
+            card.acq_reps = 0
+            card.ret_reps = 0
+            card.lapses = lapses
+            # card.acq_reps_since_lapse cannot be reconstructed from SM.
+            card.ret_reps_since_lapse = max(0, repetitions - 1)
+            card.last_rep = self.scheduler().midnight_UTC(last)
+            card.next_rep = card.last_rep + interval
+            # The following information from SM is not used: UF, O_value.
+            self.database().update_card(card)
         self.warned_about_missing_media = False
         if error:
             self.main_widget().show_error(_("An error occured while parsing."))
@@ -86,16 +86,17 @@ class Tsv(FileFormat, MediaPreprocessor):
         # Now that we know all the data is well-formed, create the cards.
         tag_names = [tag_name.strip() for \
             tag_name in extra_tag_names.split(",") if tag_name.strip()]
+        cards_data = []
         for fact_data in facts_data:
             if len(list(fact_data.keys())) == 2:
                 card_type = self.card_type_with_id("1")
             else:
                 card_type = self.card_type_with_id("3")
             self.preprocess_media(fact_data, tag_names)
-            self.controller().create_new_cards(fact_data, card_type, grade=-1,
-                tag_names=tag_names, check_for_duplicates=False, save=False)
+            cards_data.append((fact_data, card_type, -1, list(tag_names)))
             if _("MISSING_MEDIA") in tag_names:
                 tag_names.remove(_("MISSING_MEDIA"))
+        self.controller().create_new_cards_bulk(cards_data, save=False)
         self.warned_about_missing_media = False
 
     def process_string_for_text_export(self, text):
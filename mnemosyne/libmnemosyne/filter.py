@@ -21,5 +21,19 @@ class Filter(Component):
 
     component_type = "filter"
 
+    # Set to True if 'run' has no side effects and can safely be called from
+    # a thread other than the main one, e.g. to render upcoming cards in the
+    # background.
+    thread_safe = False
+
     def run(self, text, card, fact_key, **render_args):
         raise NotImplementedError
+
+    def is_thread_safe_for(self, text, card, fact_key, **render_args):
+
+        """Filters which are only unsafe for some texts, e.g. because they
+        need to create files, can override this.
+
+        """
+
+        return self.thread_safe
@@ -27,6 +27,8 @@ class RTLHandler(Filter):
 
     """
 
+    thread_safe = True
+
     def run(self, text, card, fact_key, **render_args):
         # Deal with corner cases.
         if len(text) <= 1:
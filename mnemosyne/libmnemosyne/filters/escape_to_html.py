@@ -9,6 +9,8 @@ class EscapeToHtml(Filter):
 
     """Escape literal < (unmatched tag) and newline from string."""
 
+    thread_safe = True
+
     def run(self, text, card, fact_key, **render_args):
         # Replace newline with <br>, but not when enclosed by tags like latex
         # or tables.
@@ -9,6 +9,8 @@ class EscapeToHtmlForCardBrowser(Filter):
 
     """Make sure tags like img, latex, ... show up as tags."""
 
+    thread_safe = True
+
     def run(self, text, card, fact_key, **render_args):
         if text:
             text = text.replace("<img", "&lt;img")
@@ -12,6 +12,8 @@ class ExpandPaths(Filter):
 
     """Fill out relative paths for src tags (e.g. img src or sound src)."""
 
+    thread_safe = True
+
     def run(self, text, card, fact_key, **render_args):
         text = self.expand_tag("src", text)
         text = self.expand_tag("data", text) # For Flash.
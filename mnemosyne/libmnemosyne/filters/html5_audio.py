@@ -75,6 +75,8 @@ class Html5Audio(Filter):
 
     """Incorporate media player supporting more than 1 sound file."""
 
+    thread_safe = True
+
     def run(self, text, card, fact_key, **render_args):
         if not re_audio.search(text):
             return text
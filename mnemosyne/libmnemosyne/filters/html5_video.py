@@ -13,6 +13,8 @@ class Html5Video(Filter):
 
     """Add autoplay and control tags to html5 video tags."""
 
+    thread_safe = True
+
     def run(self, text, card, fact_key, **render_args):
         options = ""
         if self.config()["media_autoplay"]:
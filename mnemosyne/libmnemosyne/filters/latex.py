@@ -126,6 +126,11 @@ class Latex(Filter):
         # should always run at the end.
         return "<img src=\"" + img_file + "\" align=middle>"
 
+    def is_thread_safe_for(self, text, card, fact_key, **render_args):
+        # Creating the images changes the working directory, uses shared
+        # temporary files and writes to the log.
+        return not (re1.search(text) or re2.search(text) or re3.search(text))
+
     def run(self, text, card, fact_key, **render_args):
 
         """The actual filter code called on the question or answer text."""
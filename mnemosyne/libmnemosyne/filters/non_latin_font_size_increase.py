@@ -31,6 +31,11 @@ class NonLatinFontSizeIncrease(Filter):
                 return True
         return False
 
+    def is_thread_safe_for(self, text, card, fact_key, **render_args):
+        # Determining the default font size needs the GUI.
+        return self.config()["non_latin_font_size_increase"] == 0 or \
+            all(self.is_in_latin_plane(char) for char in text)
+
     def run(self, text, card, fact_key, **render_args):
         if text == "" or self.config()["non_latin_font_size_increase"] == 0:
             return text
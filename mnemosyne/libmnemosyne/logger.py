@@ -70,6 +70,10 @@ class Logger(Component):
     def added_card(self, card):
         pass
 
+    def added_cards(self, cards):
+        for card in cards:
+            self.added_card(card)
+
     def edited_card(self, card):
         pass
 
@@ -101,6 +105,18 @@ class Logger(Component):
     def added_fact(self, fact):
         pass
 
+    def added_facts(self, facts):
+        for fact in facts:
+            self.added_fact(fact)
+
+    def added_facts_and_cards(self, facts, cards):
+        cards_for_fact = {}
+        for card in cards:
+            cards_for_fact.setdefault(card.fact._id, []).append(card)
+        for fact in facts:
+            self.added_fact(fact)
+            self.added_cards(cards_for_fact.get(fact._id, []))
+
     def edited_fact(self, fact):
         pass
 
@@ -186,11 +202,10 @@ class Logger(Component):
             index = self.log_index_of_last_upload() + 1
             archive_name = "%s_%s_%05d.bz2" % (user, machine, index)
             import bz2  # Not all platforms have bz.
-            f = bz2.open(os.path.join(data_dir, "history",
-                archive_name), "w")
-            for l in open(log_name):
-                f.write(l.encode("utf-8"))
-            f.close()
+            import shutil
+            with open(log_name, "rb") as log_file, bz2.open(os.path.join(\
+                data_dir, "history", archive_name), "wb") as archive_file:
+                shutil.copyfileobj(log_file, archive_file)
             os.remove(log_name)
 
     def deactivate(self):
@@ -61,6 +61,10 @@ class DatabaseLogger(Logger):
     def added_card(self, card):
         self.database().log_added_card(self.timestamp, card.id)
 
+    def added_cards(self, cards):
+        self.database().log_added_cards(self.timestamp,
+            [card.id for card in cards])
+
     def edited_card(self, card):
         self.database().log_edited_card(self.timestamp, card.id)
 
@@ -96,6 +100,17 @@ class DatabaseLogger(Logger):
     def added_fact(self, fact):
         self.database().log_added_fact(self.timestamp, fact.id)
 
+    def added_facts(self, facts):
+        self.database().log_added_facts(self.timestamp,
+            [fact.id for fact in facts])
+
+    def added_facts_and_cards(self, facts, cards):
+        card_ids_for_fact = {}
+        for card in cards:
+            card_ids_for_fact.setdefault(card.fact._id, []).append(card.id)
+        self.database().log_added_facts_and_cards(self.timestamp,
+            [(fact.id, card_ids_for_fact.get(fact._id, [])) for fact in facts])
+
     def edited_fact(self, fact):
         self.database().log_edited_fact(self.timestamp, fact.id)
 
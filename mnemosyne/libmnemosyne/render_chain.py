@@ -145,6 +145,20 @@ class RenderChain(Component):
             return self.renderer_for_card_type(parent)
         return self._renderer_for_card_type[None]
 
+    def is_thread_safe_for(self, card, **render_args):
+
+        """Whether 'card' can be rendered in a different thread, i.e. whether
+        all the filters are thread safe for all of its data.
+
+        """
+
+        for fact_key, text in card.card_type.fact_data(card).items():
+            for filter in self._filters:
+                if not filter.is_thread_safe_for(text, card, fact_key,
+                    **render_args):
+                    return False
+        return True
+
     def render_question(self, card, **render_args):
         fact_keys = card.fact_view.q_fact_keys
         decorators = card.fact_view.q_fact_key_decorators
@@ -78,6 +78,28 @@ class ReviewController(Component):
 
         raise NotImplementedError
 
+    def adjust_counters(self, old_counts, new_counts):
+
+        """To be called after adding, deleting or editing a few cards, with
+        their contributions to the counters before and after the change, as
+        returned by the scheduler's 'counts_for_cards'. For bulk operations,
+        use 'reload_counters' instead.
+
+        The default implementation simply reloads the counters.
+
+        """
+
+        self.reload_counters()
+
+    def invalidate_prefetched_cards(self):
+
+        """To be called when the rendering of cards could have changed, e.g.
+        after editing them, such that cards rendered in advance are discarded.
+
+        """
+
+        pass
+
     def update_dialog(self):
         raise NotImplementedError
 
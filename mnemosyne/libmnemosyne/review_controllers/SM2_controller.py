@@ -4,6 +4,8 @@
 
 from mnemosyne.libmnemosyne.gui_translator import _
 from mnemosyne.libmnemosyne.review_controller import ReviewController
+from mnemosyne.libmnemosyne.review_controllers.card_prefetcher import \
+     CardPrefetcher
 
 ACQ_PHASE = 0
 RET_PHASE = 1
@@ -40,7 +42,16 @@ class SM2Controller(ReviewController):
     tooltip[RET_PHASE][5] = \
         _("Correct answer, but without any difficulties. The interval was probably too short.")
 
+    def __init__(self, component_manager):
+        ReviewController.__init__(self, component_manager)
+        self.prefetcher = CardPrefetcher()
+
+    def deactivate(self):
+        self.prefetcher.shutdown()
+        ReviewController.deactivate(self)
+
     def reset(self, new_only=False):
+        self.prefetcher.clear()
         self.card = None
         self._state = "EMPTY"
         self.learning_ahead = False
@@ -114,6 +125,42 @@ _("You have no more work for today. Either add more cards or come back tomorrow.
                 self._state = "SELECT AHEAD"
         self.update_dialog()
         self.stopwatch().start()
+        self.prefetch_upcoming_cards()
+
+    def prefetch_upcoming_cards(self):
+
+        """Render the next cards in the queue in the background, while the
+        user is answering the current one. Revealing the answer can have side
+        effects, so we only do the question (and in adaptive mode, the answer
+        used for the layout). Cards for which not all the filters in the
+        render chain are thread safe (e.g. latex) are left to be rendered
+        when they are shown.
+
+        """
+
+        n = self.config()["prefetch_n_cards"]
+        if not n or self.card is None:
+            return
+        db = self.database()
+        render_chain = \
+            self.component_manager.render_chain_with_id[self.render_chain]
+        renderings = [("question", {})]
+        if self.config()["QA_split"] == "adaptive":
+            renderings.append(("answer", {"no_side_effects": True}))
+
+        def card_to_prefetch(_card_id):
+            card = db.card(_card_id, is_id_internal=True)
+            for side, render_args in renderings:
+                if not render_chain.is_thread_safe_for(card, **render_args):
+                    return None
+            return card
+
+        self.prefetcher.prefetch(self.scheduler().upcoming_card_ids(n),
+            card_to_prefetch, self.render_chain, renderings,
+            keep=[self.card._id])
+
+    def invalidate_prefetched_cards(self):
+        self.prefetcher.clear()
 
     def show_answer(self):
         if self._state == "SELECT AHEAD":
@@ -157,6 +204,7 @@ _("You have finished your scheduled reviews. Now, learn as many failed or new ca
             if self.rep_count % self.config()["save_after_n_reps"] == 0:
                 self.database().save()
             self.show_new_question()
+        self.check_counters()
         if self.config()["show_intervals"] == "status_bar":
             import math
             days = int(math.ceil(interval / (24.0 * 60 * 60)))
@@ -192,6 +240,32 @@ _("You have finished your scheduled reviews. Now, learn as many failed or new ca
         if previous_grade <= 1 and new_grade >= 2:
             self.non_memorised_count -= 1
 
+    def adjust_counters(self, old_counts, new_counts):
+        # If the counters have not been loaded yet, they will be loaded from
+        # the database later anyhow.
+        if self.scheduled_count is None:
+            return
+        self.scheduled_count += new_counts[0] - old_counts[0]
+        self.non_memorised_count += new_counts[1] - old_counts[1]
+        self.active_count += new_counts[2] - old_counts[2]
+        self.check_counters()
+
+    def check_counters(self):
+
+        """Debug mode ('check_counters' in the config): make sure that the
+        counters we keep in memory are the same as those in the database.
+
+        """
+
+        if not self.config()["check_counters"] or \
+            self.scheduled_count is None:
+            return
+        sch = self.scheduler()
+        assert (self.scheduled_count, self.non_memorised_count,
+            self.active_count) == (sch.scheduled_count(),
+            sch.non_memorised_count(), sch.active_count()), \
+            "Counters out of sync with the database."
+
     def update_dialog(self, redraw_all=False):
         self.update_qa_area(redraw_all)
         self.update_grades_area()
@@ -201,6 +275,8 @@ _("You have finished your scheduled reviews. Now, learn as many failed or new ca
         self.review_widget().redraw_now()
 
     def update_qa_area(self, redraw_all=False):
+        if redraw_all:
+            self.prefetcher.clear()
         if redraw_all and self.card:
             self.card = \
                 self.database().card(self.card._id, is_id_internal=True)
@@ -225,11 +301,12 @@ _("You have finished your scheduled reviews. Now, learn as many failed or new ca
         elif self._state == "SELECT SHOW" or redraw_all == True:
             # Giving the widget info about the answer even before it is shown
             # allows it to optimise its layout.
-            w.set_question(self.card.question(self.render_chain))
+            w.set_question(self.prefetcher.render(\
+                self.card, self.render_chain, "question"))
             if self.config()["QA_split"] == "adaptive" and \
                not self.card.fact_view.a_on_top_of_q:
-                w.set_answer(self.card.answer(\
-                    self.render_chain, no_side_effects=True))
+                w.set_answer(self.prefetcher.render(self.card,
+                    self.render_chain, "answer", no_side_effects=True))
             w.reveal_question()
         # Show answer.
         if self.card is None or self._state == "SELECT SHOW":
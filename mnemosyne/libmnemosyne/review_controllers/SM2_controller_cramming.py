@@ -46,6 +46,12 @@ class SM2ControllerCramming(SM2Controller):
     def update_counters(self, old_grade, new_grade):
         pass
 
+    def adjust_counters(self, old_counts, new_counts):
+        pass
+
+    def check_counters(self):
+        pass
+
     def update_grades_area(self):
         self.review_widget().set_grades_enabled(self.grades_enabled)
         if self.grades_enabled:
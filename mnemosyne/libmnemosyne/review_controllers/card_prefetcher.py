@@ -0,0 +1,102 @@
+#
+# card_prefetcher.py <Peter.Bienstman@UGent.be>
+#
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CardPrefetcher(object):
+
+    """Renders the cards which are coming up next in a worker thread, while
+    the user is still busy answering the current card.
+
+    The results are kept in a cache keyed on card _id, render chain, side
+    and render arguments, such that showing the next question becomes a
+    dictionary lookup. If the rendering is still in progress, we wait for it
+    instead of doing the work twice. If it failed, we simply render again in
+    the calling thread, so that errors show up there as usual.
+
+    The cards themselves need to be fetched from the database in the thread
+    owning the database connection. Only renderings without side effects
+    and with thread safe filters should be done ahead of time.
+
+    The cache should be cleared whenever the rendering of a card could have
+    changed, e.g. after editing a card or changing the configuration.
+
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._cache = {}
+
+    def _key(self, card, render_chain, side, render_args):
+        return (card._id, render_chain, side,
+                tuple(sorted(render_args.items())))
+
+    def _render(self, card, render_chain, side, render_args):
+        if side == "question":
+            return card.question(render_chain, **render_args)
+        else:
+            return card.answer(render_chain, **render_args)
+
+    def prefetch(self, _card_ids, card_with_id, render_chain, renderings,
+            keep=()):
+
+        """Start rendering the cards with '_card_ids' in the background.
+        'card_with_id' is called (in the calling thread) to fetch the cards
+        which are not yet in the cache, and can return None for cards which
+        should not be rendered in the background. 'renderings' is a list of
+        (side, render_args) tuples, with side either "question" or "answer".
+
+        Cached renderings of cards which are not in '_card_ids' or 'keep' are
+        discarded, such that the cache does not keep growing.
+
+        """
+
+        keep = set(_card_ids).union(keep)
+        cached_card_ids = set()
+        for key in list(self._cache.keys()):
+            if key[0] not in keep:
+                self._cache.pop(key).cancel()
+            elif key[1] == render_chain:
+                cached_card_ids.add(key[0])
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        for _card_id in _card_ids:
+            if _card_id in cached_card_ids:
+                continue
+            try:
+                card = card_with_id(_card_id)
+            except Exception: # E.g. the card was deleted in the meantime.
+                continue
+            if card is None:
+                continue
+            for side, render_args in renderings:
+                key = self._key(card, render_chain, side, render_args)
+                self._cache[key] = self._executor.submit(\
+                    self._render, card, render_chain, side, render_args)
+
+    def render(self, card, render_chain, side, **render_args):
+        future = self._cache.get(\
+            self._key(card, render_chain, side, render_args))
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception:
+                pass
+        return self._render(card, render_chain, side, render_args)
+
+    def is_prefetched(self, card, render_chain, side, **render_args):
+        return self._key(card, render_chain, side, render_args) \
+            in self._cache
+
+    def clear(self):
+        for future in self._cache.values():
+            future.cancel()
+        self._cache = {}
+
+    def shutdown(self):
+        self.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -87,6 +87,17 @@ class Scheduler(Component):
     def next_card(self, learn_ahead=False):
         raise NotImplementedError
 
+    def upcoming_card_ids(self, n):
+
+        """Returns the _ids of (at most) the next n different cards in the
+        queue, without removing them, such that they can be rendered in
+        advance. There is no guarantee that these cards will actually be
+        asked next.
+
+        """
+
+        return []
+
     def is_prefetch_allowed(self):
 
         """Can we display a new card before having processed the grading of
@@ -108,6 +119,16 @@ class Scheduler(Component):
     def active_count(self):
         raise NotImplementedError
 
+    def counts_for_cards(self, cards):
+
+        """Returns how much 'cards' contribute to the tuple (scheduled_count,
+        non_memorised_count, active_count), without querying the database.
+        This allows the review controller to update its counters in memory.
+
+        """
+
+        raise NotImplementedError
+
     def card_count_scheduled_n_days_from_now(self, n):
 
         """Yesterday: n=-1, today: n=0, tomorrow: n=1, ... .
@@ -118,6 +139,16 @@ class Scheduler(Component):
 
         raise NotImplementedError
 
+    def card_count_scheduled_per_day_from_now(self, first, last):
+
+        """Return a dictionary {n: card_count_scheduled_n_days_from_now(n)}
+        for n = first, ..., last, which should be computed in as few queries
+        as possible.
+
+        """
+
+        raise NotImplementedError
+
     def next_rep_to_interval_string(self, next_rep, now=None):
 
         """Converts next_rep to a string like 'tomorrow', 'in 2 weeks', ...
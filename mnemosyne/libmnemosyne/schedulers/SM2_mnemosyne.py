@@ -8,6 +8,7 @@ import datetime
 
 from mnemosyne.libmnemosyne.gui_translator import _
 from mnemosyne.libmnemosyne.scheduler import Scheduler
+from mnemosyne.libmnemosyne.schedulers.card_queue import CardQueue
 
 
 HOUR = 60 * 60  # Seconds in an hour.
@@ -63,11 +64,11 @@ class SM2Mnemosyne(Scheduler):
     def reset(self, new_only=False):
 
         """'_card_ids_in_queue' contains the _ids of the cards making up the
-        queue.
+        queue, as a CardQueue.
 
-        The corresponding fact._ids are also stored in '_fact_ids_in_queue',
-        which is needed to make sure that no sister cards can be together in
-        the queue at any time.
+        The corresponding fact._ids are also stored in the set
+        '_fact_ids_in_queue', which is needed to make sure that no sister
+        cards can be together in the queue at any time.
 
         '_fact_ids_memorised' has a different function and persists over the
         different stages invocations of 'rebuild_queue'. It can be used to
@@ -83,8 +84,8 @@ class SM2Mnemosyne(Scheduler):
 
         """
 
-        self._card_ids_in_queue = []
-        self._fact_ids_in_queue = []
+        self._card_ids_in_queue = CardQueue()
+        self._fact_ids_in_queue = set()
         self._fact_ids_memorised = self._fact_ids_learned_today()
         self._card_id_last = None
         self.new_only = new_only
@@ -148,16 +149,21 @@ class SM2Mnemosyne(Scheduler):
 
         """
 
-        while self.database().sister_card_count_scheduled_between\
-            (card, card.next_rep, card.next_rep + DAY):
-            card.next_rep += DAY
+        # Fetch all the sister cards which could possibly get in the way at
+        # once, rather than querying the database for each day.
+        for next_rep in sorted(self.database().sister_card_next_reps_from(\
+            card, card.next_rep)):
+            if next_rep >= card.next_rep + DAY:
+                break
+            if next_rep >= card.next_rep:
+                card.next_rep += DAY
 
     def rebuild_queue(self, learn_ahead=False):
         db = self.database()
         if not db.is_loaded() or not db.active_count():
             return
-        self._card_ids_in_queue = []
-        self._fact_ids_in_queue = []
+        self._card_ids_in_queue = CardQueue()
+        self._fact_ids_in_queue = set()
         self._warned_about_too_many_cards = self._already_warned_today()
 
         # Stage 1
@@ -181,7 +187,7 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
             for _card_id, _fact_id in db.cards_due_for_ret_rep(\
                 self.adjusted_now(), sort_key=sort_key, limit=50):
                 self._card_ids_in_queue.append(_card_id)
-                self._fact_ids_in_queue.append(_fact_id)
+                self._fact_ids_in_queue.add(_fact_id)
             if len(self._card_ids_in_queue):
                 return
             self.stage = 2
@@ -199,7 +205,7 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
                 if _fact_id not in self._fact_ids_in_queue:
                     if non_memorised_in_queue < limit:
                         self._card_ids_in_queue.append(_card_id)
-                        self._fact_ids_in_queue.append(_fact_id)
+                        self._fact_ids_in_queue.add(_fact_id)
                         non_memorised_in_queue += 1
                     if non_memorised_in_queue == limit:
                         break
@@ -209,11 +215,11 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
                     if non_memorised_in_queue < limit:
                         self._card_ids_in_queue.append(_card_id)
                         self._card_ids_in_queue.append(_card_id)
-                        self._fact_ids_in_queue.append(_fact_id)
+                        self._fact_ids_in_queue.add(_fact_id)
                         non_memorised_in_queue += 1
                     if non_memorised_in_queue == limit:
                         break
-            random.shuffle(self._card_ids_in_queue)
+            self._card_ids_in_queue.shuffle()
             # Only stop when we reach the non memorised limit. Otherwise, keep
             # going to add some extra cards to get more spread.
             if non_memorised_in_queue == limit:
@@ -233,7 +239,7 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
                 if _fact_id not in self._fact_ids_in_queue:
                     if non_memorised_in_queue < limit:
                         self._card_ids_in_queue.append(_card_id)
-                        self._fact_ids_in_queue.append(_fact_id)
+                        self._fact_ids_in_queue.add(_fact_id)
                         non_memorised_in_queue += 1
                     if non_memorised_in_queue == limit:
                         break
@@ -242,11 +248,11 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
                     if non_memorised_in_queue < limit:
                         self._card_ids_in_queue.append(_card_id)
                         self._card_ids_in_queue.append(_card_id)
-                        self._fact_ids_in_queue.append(_fact_id)
+                        self._fact_ids_in_queue.add(_fact_id)
                         non_memorised_in_queue += 1
                     if non_memorised_in_queue == limit:
                         break
-            random.shuffle(self._card_ids_in_queue)
+            self._card_ids_in_queue.shuffle()
             # Only stop when we reach the grade 0 limit. Otherwise, keep
             # going to add some extra cards to get more spread.
             if non_memorised_in_queue == limit:
@@ -272,7 +278,7 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
                 if _fact_id not in self._fact_ids_in_queue \
                     and _fact_id not in self._fact_ids_memorised:
                     self._card_ids_in_queue.append(_card_id)
-                    self._fact_ids_in_queue.append(_fact_id)
+                    self._fact_ids_in_queue.add(_fact_id)
                     non_memorised_in_queue += 1
                     if non_memorised_in_queue == limit:
                         if self.new_only == False:
@@ -286,7 +292,7 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
                         sort_key=sort_key, limit=min(limit, 50)):
                     if _fact_id not in self._fact_ids_in_queue:
                         self._card_ids_in_queue.append(_card_id)
-                        self._fact_ids_in_queue.append(_fact_id)
+                        self._fact_ids_in_queue.add(_fact_id)
                         non_memorised_in_queue += 1
                         if non_memorised_in_queue == limit:
                             if self.new_only == False:
@@ -322,11 +328,16 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
         return card._id in self._card_ids_in_queue
 
     def remove_from_queue_if_present(self, card):
-        try:
-            self._card_ids_in_queue.remove(card._id)
-            self._card_ids_in_queue.remove(card._id)
-        except:
-            pass
+        self._card_ids_in_queue.discard_all(card._id)
+
+    def upcoming_card_ids(self, n):
+        _card_ids = []
+        for _card_id in self._card_ids_in_queue:
+            if len(_card_ids) == n:
+                break
+            if _card_id not in _card_ids and _card_id != self._card_id_last:
+                _card_ids.append(_card_id)
+        return _card_ids
 
     def next_card(self, learn_ahead=False):
         db = self.database()
@@ -335,7 +346,7 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
             self.rebuild_queue(learn_ahead)
             if len(self._card_ids_in_queue) == 0:
                 return None
-        _card_id = self._card_ids_in_queue.pop(0)
+        _card_id = self._card_ids_in_queue.popleft()
         # Make sure we don't show the same card twice in succession.
         if self._card_id_last:
             while _card_id == self._card_id_last:
@@ -347,7 +358,7 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
                         return None
                     if set(self._card_ids_in_queue) == set([_card_id]):
                         return db.card(_card_id, is_id_internal=True)
-                _card_id = self._card_ids_in_queue.pop(0)
+                _card_id = self._card_ids_in_queue.popleft()
         self._card_id_last = _card_id
         return db.card(_card_id, is_id_internal=True)
 
@@ -362,7 +373,7 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
         # second copy from the queue in 'grade_answer', so we can't prefetch
         # if that second copy happens to be the one coming up.
         if self._card_ids_in_queue and \
-            card_to_grade._id == self._card_ids_in_queue[0]:
+            card_to_grade._id == self._card_ids_in_queue.first():
             return False
         # Make sure there are enough cards left to find one which is not a
         # duplicate.
@@ -526,6 +537,22 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
     def active_count(self):
         return self.database().active_count()
 
+    def counts_for_cards(self, cards):
+        # Should match the queries in 'SQLiteStatistics'.
+        now = self.adjusted_now()
+        max_ret_reps_since_lapse = self.config()["max_ret_reps_since_lapse"]
+        scheduled_count, non_memorised_count, active_count = 0, 0, 0
+        for card in cards:
+            if not card.active:
+                continue
+            active_count += 1
+            if card.grade < 2:
+                non_memorised_count += 1
+            elif card.next_rep <= now and \
+                card.ret_reps_since_lapse <= max_ret_reps_since_lapse:
+                scheduled_count += 1
+        return scheduled_count, non_memorised_count, active_count
+
     def card_count_scheduled_n_days_from_now(self, n):
 
         """Yesterday: n=-1, today: n=0, tomorrow: n=1, ... .
@@ -541,6 +568,20 @@ _("You appear to have missed some reviews. Don't worry too much about this backl
         else:
             return self.database().card_count_scheduled_n_days_ago(-n)
 
+    def card_count_scheduled_per_day_from_now(self, first, last):
+        counts = {}
+        if first <= 0:
+            for n, count in self.database().card_count_scheduled_per_day_ago(\
+                -first).items():
+                if -n <= last:
+                    counts[-n] = count
+        if last > 0:
+            for n, count in self.database().card_count_scheduled_per_day(\
+                self.adjusted_now(), last).items():
+                if n >= first:
+                    counts[n] = count
+        return counts
+
     def _fact_ids_learned_today(self):
         """It loads the learned _fact_ids back from the logs in order not
         to forget the learned cards when the app is closed and re-opened.
@@ -0,0 +1,93 @@
+#
+# card_queue.py <Peter.Bienstman@UGent.be>
+#
+
+import random
+from collections import deque, Counter
+
+
+class CardQueue(object):
+
+    """Queue of card _ids, in which the same _id can occur more than once
+    (e.g. a card with grade 0 is put in the queue twice).
+
+    Membership tests, appending and popping from the front are O(1), as
+    opposed to O(n) for a list. Removing an _id is O(1) too: it only gets
+    marked as removed, and is skipped when it reaches the front of the queue.
+    Like for a list, 'remove' removes the first occurrence of an _id.
+
+    """
+
+    def __init__(self, _card_ids=()):
+        self._queue = deque()
+        self._count = Counter() # Number of occurrences still in the queue.
+        self._removed = Counter() # Occurrences to skip at the front.
+        self._length = 0
+        for _card_id in _card_ids:
+            self.append(_card_id)
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length != 0
+
+    def __contains__(self, _card_id):
+        return self._count[_card_id] > 0
+
+    def __iter__(self):
+        removed = Counter(self._removed)
+        for _card_id in self._queue:
+            if removed[_card_id]:
+                removed[_card_id] -= 1
+            else:
+                yield _card_id
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return "CardQueue(%s)" % list(self)
+
+    def _discard_removed_at_front(self):
+        while self._queue and self._removed[self._queue[0]]:
+            self._removed[self._queue.popleft()] -= 1
+
+    def first(self):
+        self._discard_removed_at_front()
+        if not self._queue:
+            raise IndexError("first from an empty queue")
+        return self._queue[0]
+
+    def append(self, _card_id):
+        self._queue.append(_card_id)
+        self._count[_card_id] += 1
+        self._length += 1
+
+    def popleft(self):
+        _card_id = self.first()
+        self._queue.popleft()
+        self._count[_card_id] -= 1
+        self._length -= 1
+        return _card_id
+
+    def remove(self, _card_id):
+        if not self._count[_card_id]:
+            raise ValueError("%s not in queue" % (_card_id, ))
+        self._count[_card_id] -= 1
+        self._removed[_card_id] += 1
+        self._length -= 1
+
+    def discard_all(self, _card_id):
+
+        """Remove all the occurrences of '_card_id', if any."""
+
+        while self._count[_card_id]:
+            self.remove(_card_id)
+
+    def shuffle(self):
+        _card_ids = list(self)
+        random.shuffle(_card_ids)
+        self._queue = deque(_card_ids)
+        self._count = Counter(_card_ids)
+        self._removed = Counter()
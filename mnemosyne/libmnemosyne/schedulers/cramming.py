@@ -2,6 +2,7 @@
 # cramming.py <Peter.Bienstman@UGent.be>
 #
 
+from mnemosyne.libmnemosyne.schedulers.card_queue import CardQueue
 from mnemosyne.libmnemosyne.schedulers.SM2_mnemosyne import SM2Mnemosyne
 
 RANDOM = 0
@@ -35,8 +36,8 @@ class Cramming(SM2Mnemosyne):
         max_ret_reps = 1 if self.new_only else -1 # TODO: make configurable
         if self.new_only and db.recently_memorised_count(max_ret_reps) == 0:
             return
-        self._card_ids_in_queue = []
-        self._fact_ids_in_queue = []
+        self._card_ids_in_queue = CardQueue()
+        self._fact_ids_in_queue = set()
         self.criterion = db.current_criterion()
         # Determine sort key.
         if self.config()["cramming_order"] == RANDOM:
@@ -53,7 +54,7 @@ class Cramming(SM2Mnemosyne):
                     sort_key=sort_key, limit=25, max_ret_reps=max_ret_reps):
                 if _fact_id not in self._fact_ids_in_queue:
                     self._card_ids_in_queue.append(_card_id)
-                    self._fact_ids_in_queue.append(_fact_id)
+                    self._fact_ids_in_queue.add(_fact_id)
             if len(self._card_ids_in_queue):
                 return
             self.stage = 2
@@ -63,7 +64,7 @@ class Cramming(SM2Mnemosyne):
                     sort_key=sort_key, limit=25, max_ret_reps=max_ret_reps):
                 if _fact_id not in self._fact_ids_in_queue:
                     self._card_ids_in_queue.append(_card_id)
-                    self._fact_ids_in_queue.append(_fact_id)
+                    self._fact_ids_in_queue.add(_fact_id)
             if len(self._card_ids_in_queue):
                 return
         # Start again.
@@ -83,6 +84,9 @@ class Cramming(SM2Mnemosyne):
             card.scheduler_data = self.WRONG
         else:
             card.scheduler_data = self.RIGHT
+        if not dry_run:
+            self.database().set_scheduler_data_for_card(\
+                card, card.scheduler_data)
         # Run hooks.
         self.criterion.apply_to_card(card)
         for f in self.component_manager.all("hook", "after_repetition"):
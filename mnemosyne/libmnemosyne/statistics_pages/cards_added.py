@@ -36,11 +36,7 @@ class CardsAdded(PlotStatisticsPage):
         else:
             raise AttributeError("Invalid variant")
         self.main_widget().set_progress_text(_("Calculating statistics..."))
-        self.main_widget().set_progress_range(len(self.x))
-        self.main_widget().set_progress_update_interval(3)
-        self.y = []
-        for day in self.x:
-            self.y.append(self.database().card_count_added_n_days_ago(n=-day))
-            self.main_widget().increase_progress(1)
+        values = self.database().card_count_added_per_day_ago(n=-self.x[0])
+        self.y = [values[-day] for day in self.x]
         self.main_widget().close_progress()
 
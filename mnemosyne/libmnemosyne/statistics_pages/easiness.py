@@ -31,8 +31,7 @@ class Easiness(PlotStatisticsPage):
         elif variant == self.ACTIVE_CARDS:
             self.data = self.database().easinesses(active_only=True)
         else:
-            self.data = []
-            for tag in self.tag_tree.tags_in_subtree(self.nodes[variant]):
-                self.data.extend(self.database().easinesses_for_tag\
-                                 (tag, active_only=False))
+            self.data = self.database().easinesses_for_tags(\
+                self.tag_tree.tags_in_subtree(self.nodes[variant]),
+                active_only=False)
 
@@ -34,9 +34,7 @@ class Grades(PlotStatisticsPage):
             self.y = [self.database().card_count_for_grade \
                 (grade, active_only=True) for grade in self.x]
         else:
-            self.y = []
-            for grade in self.x:
-                self.y.append(0)
-                for tag in self.tag_tree.tags_in_subtree(self.nodes[variant]):
-                    self.y[-1] += self.database().card_count_for_grade_and_tag \
-                        (grade, tag, active_only=False)
+            counts = self.database().card_count_for_grades_and_tags(\
+                self.tag_tree.tags_in_subtree(self.nodes[variant]),
+                active_only=False)
+            self.y = [counts.get(grade, 0) for grade in self.x]
@@ -80,7 +80,10 @@ class SyncServer(Component, Server):
 
     def load_database(self, database_name):
         if self.server_only:
-            # First see if web server needs to release database.
+            # First see if web server needs to release database. Even in
+            # WAL mode, where both could keep a connection open, the web
+            # server needs to reload afterwards in order not to review
+            # stale cards.
             try:
                 con = http.client.HTTPConnection("127.0.0.1",
                     self.config()["web_server_port"])
@@ -37,29 +37,30 @@ class TagTree(Component, dict):
             self._recount()
 
     def _rebuild(self):
-        for key in dict(self):
-            del self[key]
+        self.clear()
         self["__ALL__"] = []
         self.display_name_for_node = {"__ALL__": _("All tags")}
         self.card_count_for_node = {}
         self.tag_for_node = {}
         # Preprocess tag names such that each tag results in a leaf of the
         # tree, i.e. if you have tags like "A::B" and "A", rename the latter
-        # to "A::Untagged".
+        # to "A::Untagged". Rather than comparing each tag with all the other
+        # tags, we collect everything that precedes a "::" in a tag name, so
+        # that this takes a time proportional to the total length of the
+        # tag names.
         tags = self.database().tags()
-        tag_names = [tag.name for tag in tags]
-        preprocessed_tag_name_for = {}
+        parent_names = set()
         for tag in tags:
-            preprocessed_tag_name_for[tag] = tag.name
-            for other_tag_name in tag_names:
-                if other_tag_name.startswith(tag.name + "::") \
-                    and other_tag_name != tag.name:
-                    preprocessed_tag_name_for[tag] = \
-                        tag.name + "::" + _("Untagged")
-                    break
-        # Build the actual tag tree.
+            index = tag.name.find("::")
+            while index != -1:
+                parent_names.add(tag.name[:index])
+                index = tag.name.find("::", index + 1)
+        # Build the actual tag tree, which is a trie on the levels of the tag
+        # names.
         for tag in tags:
-            name = preprocessed_tag_name_for[tag]
+            name = tag.name
+            if name in parent_names:
+                name += "::" + _("Untagged")
             self.tag_for_node[name] = tag
             parent = "__ALL__"
             partial_tag = ""
@@ -77,14 +78,24 @@ class TagTree(Component, dict):
             self.display_name_for_node["__UNTAGGED__"] = _("Untagged")
 
     def _recount(self):
-        for node in dict(self):
-            if node == "__ALL__":
-                self.card_count_for_node[node] = \
-                    self.database().card_count()
-            else:
-                self.card_count_for_node[node] = \
-                    self.database().card_count_for_tags(\
-                    self.tags_in_subtree(node), active_only=False)
+        # Rather than querying the database for each node, we get the card
+        # counts for each distinct combination of tags at once, and add them
+        # to all the nodes containing at least one of these tags. That way,
+        # a card with several tags in the same subtree is only counted once.
+        nodes_for_tag_id = {}
+        for name, tag in self.tag_for_node.items():
+            partial_tags = name.split("::")
+            nodes_for_tag_id[tag._id] = ["::".join(partial_tags[:i + 1]) \
+                for i in range(len(partial_tags))]
+        self.card_count_for_node = dict.fromkeys(self, 0)
+        for _tag_ids, count in \
+            self.database().card_count_for_tag_combinations():
+            nodes = set()
+            for _tag_id in _tag_ids:
+                nodes.update(nodes_for_tag_id.get(_tag_id, []))
+            for node in nodes:
+                self.card_count_for_node[node] += count
+        self.card_count_for_node["__ALL__"] = self.database().card_count()
 
     def tags_in_subtree(self, node):
         tags = []
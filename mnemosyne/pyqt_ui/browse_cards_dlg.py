@@ -712,6 +712,8 @@ class BrowseCardsDlg(QtWidgets.QDialog, BrowseCardsDialog,
         self.display_card_table()
 
     def load_qt_database(self):        
+        # Edits made in the browser could have postponed rendering.
+        self.database().regenerate_pregenerated_data()
         self.database().release_connection()
         qt_db = QtSql.QSqlDatabase.addDatabase("QSQLITE")
         qt_db.setDatabaseName(self.database().path())
@@ -719,6 +721,9 @@ class BrowseCardsDlg(QtWidgets.QDialog, BrowseCardsDialog,
             QtWidgets.QMessageBox.warning(None, _("Mnemosyne"),
                 _("Database error: ") + qt_db.lastError().text())
             sys.exit(1)
+        # Not all builds of SQLite support full text search.
+        self.can_use_full_text_index = QtSql.QSqlQuery().exec_(\
+            "select rowid from cards_fts limit 0")
 
     def unload_qt_database(self):
         # Don't save state twice when closing dialog.
@@ -869,8 +874,14 @@ _("You chose to sort this table. Operations in the card browser could now be slo
         if search_string:
             if filter:
                 filter += " and "
-            filter += "(question like '%%%s%%' or answer like '%%%s%%')" \
-                % (search_string, search_string)
+            fts_query = self.database().full_text_query(\
+                self.search_box.text())
+            if self.can_use_full_text_index and fts_query is not None:
+                filter += "_id in (select rowid from cards_fts where " + \
+                    "cards_fts match '%s')" % (fts_query.replace("'", "''"), )
+            else:
+                filter += "(question like '%%%s%%' or answer like '%%%s%%')" \
+                    % (search_string, search_string)
         self.card_model.setFilter(filter)
         self.card_model.select()
         self.update_card_counters()
@@ -26,6 +26,7 @@ class CompactThread(QtWorkerThread):
     def do_work(self):
         if self.archive_old_logs:
             self.mnemosyne.database().archive_old_logs()
+            self.mnemosyne.database().merge_archive_dir()
         if self.defragment_database:
             self.mnemosyne.database().defragment()
 
@@ -20,6 +20,10 @@ class MplayerAudio(Filter):
 
     """Play sound externally in mplayer."""
 
+    def is_thread_safe_for(self, text, card, fact_key, **render_args):
+        return render_args.get("no_side_effects") == True or \
+            not re_audio.search(text)
+
     def run(self, text, card, fact_key, **render_args):
         if "no_side_effects" in render_args and \
             render_args["no_side_effects"] == True:
@@ -20,6 +20,8 @@ class MnemosyneFormat(object):
             database_version == self.database.version
 
     def binary_filename(self, store_pregenerated_data, interested_in_old_reps):
+        if store_pregenerated_data:
+            self.database.regenerate_pregenerated_data()
         self.database.release_connection()
         # Copy the database to a temporary file.
         self.tmp_name = os.path.join(os.path.dirname(self.database._path),
@@ -30,6 +32,7 @@ class MnemosyneFormat(object):
             con = sqlite3.connect(self.tmp_name)
             con.execute("delete from log where event_type=?",
                 (EventTypes.REPETITION, ))
+            con.execute("delete from log_compact")
             con.commit()
             con.execute("vacuum")
             con.close()
@@ -38,6 +41,7 @@ class MnemosyneFormat(object):
             con = sqlite3.connect(self.tmp_name)
             con.executescript("""
             begin;
+            drop table if exists cards_fts;
             drop index i_cards;
             create table cards_new(
                 _id integer primary key,
@@ -54,6 +54,20 @@ def create_database():
         mnemosyne.database().update_card(card)
     mnemosyne.database().save()
 
+def create_database_bulk():
+    mnemosyne.database().new(mnemosyne.config()["last_database"])
+    facts_data = []
+    for i in range(number_of_facts):
+        fact_data = {"f": "question" + str(i),
+                     "b": "answer" + str(i)}
+        if i % 2:
+            card_type = mnemosyne.card_type_with_id("1")
+        else:
+            card_type = mnemosyne.card_type_with_id("2")
+        facts_data.append((fact_data, card_type, -1, ["default"]))
+    mnemosyne.controller().create_new_cards_bulk(facts_data, save=False)
+    mnemosyne.database().save()
+
 def queue():
     mnemosyne.review_controller().reset()
 
@@ -76,6 +90,73 @@ def grade_only():
     mnemosyne.scheduler().grade_answer(\
         mnemosyne.review_controller().card, 0)
 
+def hydrate():
+    # Fetch every card twice, e.g. to compare the timings with and without
+    # 'identity_map_size' set in the config.
+    db = mnemosyne.database()
+    _card_ids = [_card_id for _card_id, _fact_id in db.cards()]
+    for i in range(2):
+        for _card_id in _card_ids:
+            db.card(_card_id, is_id_internal=True)
+
+def queue_operations():
+    # Pure queue operations: every card twice in the queue, as for grade 0
+    # cards, and then take out the second copy when the first one comes up.
+    from mnemosyne.libmnemosyne.schedulers.card_queue import CardQueue
+    queue = CardQueue()
+    for _card_id in range(10000):
+        queue.append(_card_id)
+        queue.append(_card_id)
+    queue.shuffle()
+    while queue:
+        _card_id = queue.popleft()
+        if _card_id in queue:
+            queue.remove(_card_id)
+
+def relearn_queue():
+    # Put all the cards back in the acquisition phase with grade 0, and allow
+    # all of them in the queue at the same time.
+    mnemosyne.config()["non_memorised_cards_in_hand"] = 10000
+    mnemosyne.database().con.execute("""update cards set grade=0, lapses=0,
+        active=1""")
+    mnemosyne.scheduler().reset()
+    mnemosyne.scheduler().rebuild_queue()
+
+def grade_relearn_queue():
+    scheduler = mnemosyne.scheduler()
+    for i in range(10000):
+        card = scheduler.next_card()
+        if card is None:
+            break
+        scheduler.grade_answer(card, 2)
+
+def create_database_tags():
+    # 20000 hierarchical tags like "level_1::level_1_21::tag_421", some of
+    # which are also parents of other tags. We add them directly in SQL, as
+    # adding them one by one through the database updates the criteria each
+    # time.
+    create_database_bulk()
+    con = mnemosyne.database().con
+    tag_names = []
+    for i in range(20000):
+        tag_names.append("level_%d::level_%d_%d::tag_%d" % \
+            (i % 20, i % 20, i % 400, i))
+    for i in range(400):
+        tag_names.append("level_%d::level_%d_%d" % (i % 20, i % 20, i))
+    con.executemany("insert into tags(name, id) values(?,?)",
+        ((tag_name, tag_name) for tag_name in tag_names))
+    _tag_ids = [cursor[0] for cursor in \
+        con.execute("select _id from tags where name<>'default'")]
+    _card_ids = [cursor[0] for cursor in con.execute("select _id from cards")]
+    con.executemany("insert into tags_for_card(_card_id, _tag_id) values(?,?)",
+        ((_card_id, _tag_ids[(7 * i + j) % len(_tag_ids)]) \
+        for i, _card_id in enumerate(_card_ids) for j in range(2)))
+    mnemosyne.database().save()
+
+def tag_tree():
+    from mnemosyne.libmnemosyne.tag_tree import TagTree
+    TagTree(mnemosyne.component_manager)
+
 def count_active():
     mnemosyne.scheduler().active_count()
 
@@ -140,6 +221,12 @@ tests = ["startup()", "create_database()", "queue()", "new_question()", "display
 #tests = ["startup()", "create_database()", "new_question()", "display()",
 #    "grade()", "finalise()"]
 #tests = ["startup()", "create_database()", "activate()"]
+#tests = ["startup()", "create_database()", "hydrate()"]
+#tests = ["startup()", "create_database_bulk()", "finalise()"]
+#tests = ["queue_operations()"]
+#tests = ["startup()", "create_database_tags()", "tag_tree()", "finalise()"]
+#tests = ["startup()", "create_database_bulk()", "relearn_queue()",
+#    "grade_relearn_queue()", "finalise()"]
 #tests = ["startup()", "do_import()", "finalise()"]
 #tests = ["startup()", "queue()", "finalise()"]
 #tests = ["startup()", "activate()"]
@@ -451,3 +451,48 @@ class TestActivateCards(MnemosyneTest):
         self.controller().create_new_cards(fact_data, card_type_1,
             grade=-1, tag_names=["dummy::b"])
         assert self.database().active_count() == 2
+
+    def test_incremental(self):
+        import random
+        random.seed(0)
+        card_type_1 = self.card_type_with_id("1")
+        card_type_2 = self.card_type_with_id("2")
+        tag_names = ["a", "b", "c", "d"]
+        for i in range(40):
+            self.controller().create_new_cards({"f": "q%d" % i, "b": "a%d" % i},
+                random.choice([card_type_1, card_type_2]), grade=-1,
+                tag_names=random.sample(tag_names, random.randint(1, 2)))
+        _tag_ids = [self.database().get_or_create_tag_with_name(name)._id
+                    for name in tag_names]
+        applier = self.mnemosyne.component_manager.current(\
+            "criterion_applier", used_for=DefaultCriterion)
+        def activity():
+            return self.database().con.execute(\
+                "select _id, active from cards order by _id").fetchall()
+        c = self.database().current_criterion()
+        for i in range(20):
+            # Modify in place on purpose.
+            c._tag_ids_active = set(random.sample(_tag_ids, random.randint(1, 3)))
+            c._tag_ids_forbidden = set(random.sample(_tag_ids, random.randint(0, 1)))
+            c.deactivated_card_type_fact_view_ids = set(random.sample(\
+                [(card_type_2.id, card_type_2.fact_views[0].id),
+                 (card_type_2.id, card_type_2.fact_views[1].id)],
+                 random.randint(0, 1)))
+            self.database().set_current_criterion(c)
+            incremental = activity()
+            applier.apply_to_database(self.database().current_criterion())
+            assert incremental == activity()
+        # Bulk tag changes.
+        tag = self.database().get_or_create_tag_with_name("a")
+        self.database().add_tag_to_cards_with_internal_ids(tag, [1, 2, 3])
+        incremental = activity()
+        applier.apply_to_database(self.database().current_criterion())
+        assert incremental == activity()
+        self.database().remove_tag_from_cards_with_internal_ids(tag, [2, 3, 4])
+        incremental = activity()
+        applier.apply_to_database(self.database().current_criterion())
+        assert incremental == activity()
+        self.database().delete_tag(tag)
+        incremental = activity()
+        applier.apply_to_database(self.database().current_criterion())
+        assert incremental == activity()
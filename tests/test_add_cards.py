@@ -320,6 +320,46 @@ class TestAddCards(MnemosyneTest):
             "select event_type from log where _id=15").fetchone()
         assert sql_res[0] == EventTypes.REPETITION
 
+    def test_bulk(self):
+        card_type_1 = self.card_type_with_id("1")
+        card_type_2 = self.card_type_with_id("2")
+        all_cards = self.controller().create_new_cards_bulk([
+            ({"f": "1", "b": "b"}, card_type_1, -1, ["a"]),
+            ({"f": "2", "b": "b"}, card_type_2, 3, ["a", "b"]),
+            ({"f": "3", "b": ""}, card_type_1, -1, [])])
+        assert [len(cards) for cards in all_cards] == [1, 2, 1]
+        assert self.database().fact_count() == 3
+        assert self.database().card_count() == 4
+        for cards in all_cards:
+            for card in cards:
+                new_card = self.database().card(card._id, is_id_internal=True)
+                assert new_card.id == card.id
+                assert new_card.fact["f"] == card.fact["f"]
+                assert new_card.tag_string() == card.tag_string()
+                assert new_card.grade == card.grade
+                assert new_card.next_rep == card.next_rep
+        assert all_cards[1][0].grade == 3
+        assert all_cards[1][0].next_rep != all_cards[1][1].next_rep
+        assert all_cards[2][0].tag_string() == ""
+        assert self.database().con.execute(\
+            "select tags from cards where _id=?",
+            (all_cards[1][0]._id, )).fetchone()[0] == "a, b"
+        assert self.database().con.execute(\
+            "select count() from data_for_fact where key='b'").fetchone()[0] \
+            == 2
+        for event_type, count in ((EventTypes.ADDED_FACT, 3),
+            (EventTypes.ADDED_CARD, 4), (EventTypes.REPETITION, 2)):
+            assert self.database().con.execute(\
+                "select count() from log where event_type=?",
+                (event_type, )).fetchone()[0] == count
+        # Each fact is logged followed by its cards, as for 'create_new_cards'.
+        assert [cursor[0] for cursor in self.database().con.execute(\
+            """select object_id from log where event_type in (?,?)
+            order by _id""", (EventTypes.ADDED_FACT,
+            EventTypes.ADDED_CARD))][-7:] == [all_cards[0][0].fact.id,
+            all_cards[0][0].id, all_cards[1][0].fact.id, all_cards[1][0].id,
+            all_cards[1][1].id, all_cards[2][0].fact.id, all_cards[2][0].id]
+
     def test_different_tags_per_sister_card(self):
         fact_data = {"f": "question",
                      "b": "answer"}
@@ -11,6 +11,7 @@ from mnemosyne_test import MnemosyneTest
 from mnemosyne.libmnemosyne import Mnemosyne
 from mnemosyne.libmnemosyne.ui_components.dialogs import ImportDialog
 from mnemosyne.libmnemosyne.ui_components.main_widget import MainWidget
+from openSM2sync.log_entry import EventTypes
 
 
 class TestAnkiImport(MnemosyneTest):
@@ -105,6 +106,26 @@ class TestAnkiImport(MnemosyneTest):
         self.review_controller().reset()
         self._test_database()
 
+    def test_anki_duplicate_guid(self):
+        anki_dir = os.path.join(os.path.abspath("dot_test"), "anki1")
+        shutil.copytree(os.path.join(os.getcwd(), "tests", "files", "anki1"),
+            anki_dir)
+        filename = os.path.join(anki_dir, "collection.anki2")
+        import sqlite3
+        con = sqlite3.connect(filename)
+        con.execute("""update notes set guid='M7um9Jp|v3' where
+            id=1502277582974""")
+        con.commit()
+        con.close()
+        self.anki_importer().do_import(filename)
+        # The second note updated the fact of the first one.
+        assert self.database().fact_count() == 5
+        fact = self.database().fact("M7um9Jp|v3", is_id_internal=False)
+        assert "1" in fact.data.values()
+        assert self.database().con.execute("""select count() from log where
+            event_type=? and object_id='M7um9Jp|v3'""",
+            (EventTypes.EDITED_FACT, )).fetchone()[0] == 1
+
     def test_anki_apkg(self):
         filename = os.path.join(os.getcwd(), "tests", "files", "anki1.apkg",)
         self.anki_importer().do_import(filename)
@@ -159,3 +159,79 @@ class TestCrammingScheduler(MnemosyneTest):
         self.database().unload()
         self.review_controller().reset()
         self.restart()
+
+    def test_session(self):
+        from mnemosyne.libmnemosyne.schedulers.cramming import Cramming
+
+        card_type = self.card_type_with_id("1")
+        for data in ["1", "2", "3"]:
+            fact_data = {"f": data, "b": "b"}
+            self.controller().create_new_cards(fact_data, card_type,
+                grade=-1, tag_names=["default"])
+        self.review_controller().reset()
+        self.review_controller().grade_answer(0)
+        self.review_controller().grade_answer(5)
+        # Only the cards which were seen are stored.
+        assert self.database().con.execute(\
+            "select count() from scheduler_data_for_session").fetchone()[0] == 2
+        assert self.database().scheduler_data_count(Cramming.UNSEEN) == 1
+        assert self.database().scheduler_data_count(Cramming.WRONG) == 1
+        assert self.database().scheduler_data_count(Cramming.RIGHT) == 1
+        # Starting a new session does not touch the cards.
+        self.database().set_scheduler_data(Cramming.UNSEEN)
+        assert self.database().scheduler_data_count(Cramming.UNSEEN) == 3
+        assert len(list(self.database().cards_with_scheduler_data(\
+            Cramming.UNSEEN))) == 3
+        assert len(list(self.database().cards_with_scheduler_data(\
+            Cramming.WRONG))) == 0
+        self.database().set_scheduler_data(Cramming.WRONG)
+        assert self.database().scheduler_data_count(Cramming.WRONG) == 3
+
+    def test_session_logged(self):
+        from mnemosyne.libmnemosyne.schedulers.cramming import Cramming
+
+        card_type = self.card_type_with_id("1")
+        fact_data = {"f": "1", "b": "b"}
+        card = self.controller().create_new_cards(fact_data, card_type,
+            grade=-1, tag_names=["default"])[0]
+        self.review_controller().reset()
+        self.review_controller().grade_answer(0)
+        assert self.database().con.execute(\
+            "select scheduler_data from cards where _id=?",
+            (card._id, )).fetchone()[0] == Cramming.WRONG
+        # Cards get the data of the new session, also when they are
+        # reviewed with a different scheduler.
+        self.database().set_scheduler_data(Cramming.RIGHT)
+        card = self.database().card(card._id, is_id_internal=True)
+        assert card.scheduler_data == Cramming.RIGHT
+        self.controller().set_study_mode(\
+            self.mnemosyne.study_mode_with_id("ScheduledForgottenNew"))
+        self.review_controller().learning_ahead = True
+        self.review_controller().show_new_question()
+        self.review_controller().grade_answer(5)
+        from openSM2sync.log_entry import EventTypes
+        assert self.database().con.execute("""select scheduler_data from log
+            where event_type=? order by _id desc limit 1""",
+            (EventTypes.REPETITION, )).fetchone()[0] == Cramming.RIGHT
+        assert self.database().con.execute(\
+            "select scheduler_data from cards where _id=?",
+            (card._id, )).fetchone()[0] == Cramming.RIGHT
+
+    def test_upgrade(self):
+        from mnemosyne.libmnemosyne.schedulers.cramming import Cramming
+
+        card_type = self.card_type_with_id("1")
+        for data in ["1", "2", "3"]:
+            fact_data = {"f": data, "b": "b"}
+            self.controller().create_new_cards(fact_data, card_type,
+                grade=-1, tag_names=["default"])
+        # Simulate a database which stored the state in the cards table.
+        con = self.database().con
+        con.execute("drop table scheduler_data_for_session")
+        con.execute("""delete from global_variables where key in
+            ('scheduler_data_session', 'scheduler_data_default')""")
+        con.execute("update cards set scheduler_data=? where _id=1",
+            (Cramming.WRONG, ))
+        self.database()._create_scheduler_data_for_session()
+        assert self.database().scheduler_data_count(Cramming.WRONG) == 1
+        assert self.database().scheduler_data_count(Cramming.UNSEEN) == 2
@@ -13,7 +13,7 @@ from openSM2sync.log_entry import EventTypes
 from mnemosyne_test import MnemosyneTest
 from mnemosyne.libmnemosyne.tag import Tag
 from mnemosyne.libmnemosyne import Mnemosyne
-from mnemosyne.libmnemosyne.utils import expand_path
+from mnemosyne.libmnemosyne.utils import expand_path, MnemosyneError
 from mnemosyne.libmnemosyne.ui_components.main_widget import MainWidget
 
 HOUR = 60 * 60  # Seconds in an hour.
@@ -59,6 +59,239 @@ class TestDatabase(MnemosyneTest):
         self.database().abandon()
         self.database().new("default.mem")
 
+    def test_read_while_writing(self):
+        import threading
+        self.config()["wal_mode"] = True
+        self.database().release_connection()
+        fact_data = {"f": "question",
+                     "b": "answer"}
+        card_type = self.card_type_with_id("1")
+        self.controller().create_new_cards(fact_data, card_type,
+                     grade=-1, tag_names=["default"])
+        self.database().save()
+        # Uncommitted change in the thread holding the connection.
+        self.database().con.execute("delete from cards")
+        assert self.database().card_count() == 0
+        counts = []
+        def read():
+            counts.append(self.database().card_count())
+            counts.append(self.database().card_count())
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        assert counts == [1, 1]
+        assert len(self.database()._readers) == 1
+        self.database().con.commit()
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        assert counts == [1, 1, 0, 0]
+        # Backups include the changes which are still in the write-ahead log.
+        import sqlite3
+        backup_con = sqlite3.connect(self.database().backup())
+        assert backup_con.execute("select count() from cards").\
+            fetchone()[0] == 0
+        backup_con.close()
+        # Checkpointing does not commit an open transaction.
+        self.database().con.execute("update cards set grade=5")
+        self.database().checkpoint()
+        assert self.database().con.in_transaction
+        self.database().con.rollback()
+        # Connections are only closed once their thread has finished.
+        self.database()._readers.max_size = 1
+        started, stop = threading.Event(), threading.Event()
+        def read_and_wait():
+            read()
+            started.set()
+            stop.wait()
+            read()
+        thread_1 = threading.Thread(target=read_and_wait)
+        thread_1.start()
+        started.wait()
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        assert len(self.database()._readers) == 2
+        stop.set()
+        thread_1.join()
+        assert counts == [1, 1, 0, 0, 0, 0, 0, 0, 0, 0]
+        self.database()._readers._close_connections_of_finished_threads()
+        assert len(self.database()._readers) == 0
+        # The heartbeat commits its own changes, but not those of others.
+        self.log().saved_database()
+        self.controller().heartbeat()
+        assert not self.database().in_transaction()
+        self.database().con.execute("update cards set grade=5")
+        self.controller().heartbeat()
+        assert self.database().in_transaction()
+        self.database().con.rollback()
+        self.database().checkpoint("truncate")
+        assert os.path.getsize(self.database().path() + "-wal") == 0
+        self.database().release_connection()
+        assert self.database()._readers is None
+
+    def test_query_statistics(self):
+        assert self.database().query_statistics() is None
+        assert self.database().dump_query_statistics() is None
+        self.config()["database_profiling"] = True
+        self.config()["slow_query_threshold"] = 0.000001
+        self.database().release_connection()
+        for i in range(3):
+            self.database().con.execute("select _id from cards where _id=?",
+                (i, )).fetchall()
+            self.database().con.execute(\
+                "select _id from cards where _id in (%d, %d)" % (i, i + 1))
+        self.database().tags()
+        report = self.database().query_statistics().report()
+        assert report[0]["time"] >= report[-1]["time"]
+        sql_list = [result["sql"] for result in report]
+        assert "select _id from cards where _id=?" in sql_list
+        assert "select _id from cards where _id in (?)" in sql_list
+        for result in report:
+            if result["sql"] == "select _id from tags":
+                assert result["calls"] == 1
+                assert result["rows"] == 1
+            elif result["sql"].startswith("select _id from cards"):
+                assert result["calls"] == 3
+                assert result["rows"] == 0
+            assert result["p50"] <= result["p99"]
+        filename = self.database().dump_query_statistics()
+        assert "select _id from tags" in open(filename).read()
+        assert "select _id from tags" in open(os.path.join(\
+            self.config().data_dir, "slow_queries.txt")).read()
+        self.database().reset_query_statistics()
+        assert self.database().query_statistics().report() == []
+        # Changing the settings takes effect without a new connection.
+        self.config()["slow_query_threshold"] = 0
+        query_statistics = self.database().query_statistics()
+        assert query_statistics._slow_query_handler is None
+        assert self.database().con.query_statistics is query_statistics
+        self.config()["database_profiling"] = False
+        assert self.database().query_statistics() is None
+        assert self.database().con.query_statistics is None
+        # Unloading closes the slow query log.
+        self.config()["slow_query_threshold"] = 0.000001
+        query_statistics = self.database().query_statistics()
+        self.database().con.execute("select _id from tags").fetchall()
+        assert query_statistics._slow_query_handler.stream is not None
+        self.database().unload()
+        assert query_statistics._slow_query_handler is None
+
+    def test_deferred_pregenerated_data(self):
+        self.config()["defer_pregenerated_data"] = True
+        card_type = self.card_type_with_id("1")
+        for i in range(3):
+            fact_data = {"f": "question%d" % i,
+                         "b": "answer%d" % i}
+            card = self.controller().create_new_cards(fact_data, card_type,
+                     grade=-1, tag_names=["default"])[0]
+        sql = "select question, answer, tags from cards where _id=?"
+        assert self.database().con.execute(sql, (card._id, )).fetchone() == \
+            (None, None, "default")
+        assert self.database().regenerate_pregenerated_data(max_count=2) == 2
+        assert self.database().regenerate_pregenerated_data() == 1
+        assert self.database().regenerate_pregenerated_data() == 0
+        assert self.database().con.execute(sql, (card._id, )).fetchone() == \
+            ("question2", "answer2", "default")
+        card.fact.data["f"] = "new question"
+        self.controller().edit_card_and_sisters(card, card.fact.data,
+            card_type, ["default"], {})
+        assert self.database().con.execute(sql, (card._id, )).fetchone()[0] \
+            is None
+        self.controller().heartbeat()
+        assert self.database().con.execute(sql, (card._id, )).fetchone()[0] \
+            == "new question"
+        # Changing only the tags does not require rendering again.
+        self.controller().edit_card_and_sisters(card, card.fact.data,
+            card_type, ["other"], {})
+        assert self.database().con.execute(sql, (card._id, )).fetchone() == \
+            ("new question", "answer2", "other")
+        plan = self.database().con.execute("""explain query plan
+            select _id from cards where question is null""").fetchall()
+        assert "i_cards_4" in str(plan)
+        self.config()["defer_pregenerated_data"] = False
+        card.fact.data["f"] = "newer question"
+        self.controller().edit_card_and_sisters(card, card.fact.data,
+            card_type, ["default"], {})
+        assert self.database().con.execute(sql, (card._id, )).fetchone()[0] \
+            == "newer question"
+
+    def test_search_cards(self):
+        card_type = self.card_type_with_id("1")
+        _card_ids = []
+        for question, answer, tag in [("apple pie", "dessert", "food"),
+                ("apple", "fruit", "food"), ("banana", "fruit", "other"),
+                ("我喜欢苹果", "I like them", "other")]:
+            fact_data = {"f": question, "b": answer}
+            card = self.controller().create_new_cards(fact_data, card_type,
+                grade=-1, tag_names=[tag])[0]
+            _card_ids.append(card._id)
+        assert self.database().search_cards("") == []
+        assert set(self.database().search_cards("fruit")) == \
+            set(_card_ids[1:3])
+        assert set(self.database().search_cards("app")) == \
+            set(_card_ids[:2])
+        assert self.database().search_cards("apple FOOD fru") == \
+            [_card_ids[1]]
+        assert self.database().search_cards('"pie') == []
+        # Matches in the middle of words, and in scripts without spaces.
+        assert self.database().search_cards("ana") == [_card_ids[2]]
+        assert self.database().search_cards("苹果") == [_card_ids[3]]
+        assert self.database().search_cards("喜欢苹") == \
+            [_card_ids[3]]
+        assert self.database().search_cards("pi") == [_card_ids[0]]
+        assert set(self.database().search_cards("p%e")) == \
+            set(_card_ids[:2])
+        assert len(self.database().search_cards("food", limit=1)) == 1
+        assert len(self.database().search_cards("food", limit=1,
+            offset=1)) == 1
+        # Index is kept up to date.
+        card = self.database().card(_card_ids[2], is_id_internal=True)
+        card.fact.data["f"] = "cherry"
+        self.controller().edit_card_and_sisters(card, card.fact.data,
+            card_type, ["other"], {})
+        assert self.database().search_cards("banana") == []
+        assert self.database().search_cards("cherry") == [_card_ids[2]]
+        self.controller().delete_facts_and_their_cards([card.fact])
+        assert self.database().search_cards("cherry") == []
+        # Rebuilt for older databases, or when only part of it is left.
+        assert self.database()._has_full_text_index
+        self.database().con.execute("drop table cards_fts")
+        self.database().save()
+        self.database().load(self.database().path())
+        assert self.database()._has_full_text_index
+        assert self.database().search_cards("fruit") == [_card_ids[1]]
+        self.database().con.execute("drop trigger cards_fts_update")
+        self.database().save()
+        self.database().load(self.database().path())
+        assert self.database()._has_full_text_index
+        card = self.database().card(_card_ids[1], is_id_internal=True)
+        card.fact.data["b"] = "grape"
+        self.controller().edit_card_and_sisters(card, card.fact.data,
+            card_type, ["food"], {})
+        assert self.database().search_cards("grape") == [_card_ids[1]]
+        self.database().load(self.database().path())
+        assert self.database()._has_full_text_index
+        # Index which only matched whole words.
+        self.database().con.execute("drop table cards_fts")
+        self.database().con.execute("""create virtual table cards_fts using
+            fts5(question, answer, tags, content='cards',
+            content_rowid='_id')""")
+        self.database().save()
+        self.database().load(self.database().path())
+        assert self.database().search_cards("rape") == [_card_ids[1]]
+        # Rebuilding does not commit pending changes.
+        self.database().save()
+        self.database().con.execute("delete from tags")
+        self.database()._create_full_text_index()
+        assert self.database().in_transaction()
+        self.database().con.rollback()
+        assert self.database().search_cards("rape") == [_card_ids[1]]
+        # Fallback.
+        self.database()._has_full_text_index = False
+        assert set(self.database().search_cards("app FOOD")) == \
+            set(_card_ids[:2])
+
     def test_tags(self):
         tag = Tag("test")
         self.database().add_tag(tag)
@@ -160,6 +393,104 @@ class TestDatabase(MnemosyneTest):
             "select count() from log where event_type=?",
             (EventTypes.EDITED_CARD, )).fetchone()[0] == 1
 
+    def test_identity_map(self):
+        self.config()["identity_map_size"] = 2
+        self.database().load(self.config()["last_database"])
+        card_type = self.card_type_with_id("1")
+        card_1 = self.controller().create_new_cards({"f": "1", "b": "b"},
+            card_type, grade=-1, tag_names=["default"])[0]
+        card_2 = self.controller().create_new_cards({"f": "2", "b": "b"},
+            card_type, grade=-1, tag_names=["default"])[0]
+        card_3 = self.controller().create_new_cards({"f": "3", "b": "b"},
+            card_type, grade=-1, tag_names=["default"])[0]
+        db = self.database()
+        card = db.card(card_1._id, is_id_internal=True)
+        assert db.card(card_1._id, is_id_internal=True) is card
+        assert db.card(card_1.id, is_id_internal=False) is card
+        assert db.fact(card_1.fact._id, is_id_internal=True) is card.fact
+        # Eviction.
+        db.card(card_2._id, is_id_internal=True)
+        db.card(card_3._id, is_id_internal=True)
+        assert db.card(card_1._id, is_id_internal=True) is not card
+        # Updating cards.
+        card = db.card(card_1._id, is_id_internal=True)
+        card.grade = 5
+        db.update_card(card)
+        new_card = db.card(card_1._id, is_id_internal=True)
+        assert new_card is not card
+        assert new_card.grade == 5
+        # Updating facts.
+        fact = db.fact(card_1.fact._id, is_id_internal=True)
+        fact.data = {"f": "1a", "b": "b"}
+        db.update_fact(fact)
+        assert db.card(card_1._id, is_id_internal=True).fact["f"] == "1a"
+        # Updating tags.
+        tag = db.get_or_create_tag_with_name("default")
+        tag.name = "renamed"
+        db.update_tag(tag)
+        assert db.card(card_1._id, is_id_internal=True).tag_string() == \
+            "renamed"
+        assert db.tag(tag._id, is_id_internal=True).name == "renamed"
+        # Bulk operations.
+        db.remove_tag_from_cards_with_internal_ids(tag, [card_1._id])
+        assert db.card(card_1._id, is_id_internal=True).tag_string() == ""
+        # Deleting.
+        self.controller().delete_facts_and_their_cards([card_1.fact])
+        try:
+            db.card(card_1._id, is_id_internal=True)
+            assert False
+        except MnemosyneError:
+            pass
+        self.config()["identity_map_size"] = 0
+
+    def test_cards_with_internal_ids(self):
+        card_type = self.card_type_with_id("2")
+        _card_ids = []
+        for i in range(3):
+            cards = self.controller().create_new_cards({"f": str(i), "b": "b"},
+                card_type, grade=-1, tag_names=["a", "b"])
+            _card_ids += [card._id for card in cards]
+        _card_ids.reverse()
+        db = self.database()
+        cards = list(db.cards_with_internal_ids(_card_ids + [-1]))
+        assert [card._id for card in cards] == _card_ids
+        for card in cards:
+            old_card = db.card(card._id, is_id_internal=True)
+            assert card.id == old_card.id
+            assert card.fact.id == old_card.fact.id
+            assert card.fact.data == old_card.fact.data
+            assert card.fact_view.id == old_card.fact_view.id
+            assert card.tag_string() == old_card.tag_string()
+            assert card.next_rep == old_card.next_rep
+        assert list(db.cards_with_internal_ids([])) == []
+        facts = [card.fact for card in cards]
+        assert len(list(db.cards_from_facts(facts))) == 6
+        assert [fact.id for fact in db.facts_with_internal_ids(\
+            [fact._id for fact in facts])] == [fact.id for fact in facts]
+
+    def test_tag_strings(self):
+        card_type = self.card_type_with_id("1")
+        card_1 = self.controller().create_new_cards({"f": "1", "b": "b"},
+            card_type, grade=-1, tag_names=["b10", "a"])[0]
+        card_2 = self.controller().create_new_cards({"f": "2", "b": "b"},
+            card_type, grade=-1, tag_names=["b10"])[0]
+        db = self.database()
+        tag_string = lambda card: db.con.execute(\
+            "select tags from cards where _id=?", (card._id, )).fetchone()[0]
+        tag = db.get_or_create_tag_with_name("b2")
+        db.add_tag_to_cards_with_internal_ids(tag, [card_1._id, card_2._id])
+        assert tag_string(card_1) == "a, b2, b10"
+        assert tag_string(card_2) == "b2, b10"
+        tag = db.get_or_create_tag_with_name("b10")
+        tag.name = "b1"
+        db.update_tag(tag)
+        assert tag_string(card_1) == "a, b1, b2"
+        db.remove_tag_from_cards_with_internal_ids(tag, [card_2._id])
+        assert tag_string(card_2) == "b2"
+        db.delete_tag(db.get_or_create_tag_with_name("b2"))
+        assert tag_string(card_1) == "a, b1"
+        assert tag_string(card_2) == ""
+
     def test_empty_argument(self):
         assert self.database().tags_from_cards_with_internal_ids([]) == []
 
@@ -372,6 +703,13 @@ class TestDatabase(MnemosyneTest):
             grade=-1, tag_names=["default"], check_for_duplicates=False)
         assert len(self.database().duplicates_for_fact(fact, card_type)) == 1
 
+    def test_duplicates_index_upgrade(self):
+        self.database().con.execute("drop index i_data_for_fact_2")
+        self.database().save()
+        self.database().load(self.config()["last_database"])
+        assert self.database().con.execute("""select 1 from sqlite_master
+            where type='index' and name='i_data_for_fact_2'""").fetchone()
+
     def test_card_types_in_use(self):
         fact_data = {"f": "question",
                      "b": "answer"}
@@ -417,6 +755,9 @@ class TestDatabase(MnemosyneTest):
         assert self.database().sister_card_count_scheduled_between(card_2, card_1.next_rep, card_1.next_rep+DAY) == 1
         assert self.database().sister_card_count_scheduled_between(card_3, card_1.next_rep, card_1.next_rep+DAY) == 0
         assert self.database().sister_card_count_scheduled_between(card_1, card_1.next_rep, card_1.next_rep+DAY) == 0
+        assert self.database().sister_card_next_reps_from(card_2, card_1.next_rep) == [card_1.next_rep]
+        assert self.database().sister_card_next_reps_from(card_2, card_1.next_rep + 1) == []
+        assert self.database().sister_card_next_reps_from(card_4, 0) == [card_1.next_rep]
 
     def test_purge_backups(self):
         backup_dir = os.path.join(self.config().data_dir, "backups")
@@ -722,6 +1063,14 @@ class TestDatabase(MnemosyneTest):
         assert "DUPLICATE" in card_1.tag_string()
         assert "DUPLICATE" in card_2.tag_string()
         assert "DUPLICATE" not in card_3.tag_string()
+        # Duplicates in different card types are allowed.
+        card_4 = self.controller().create_new_cards(fact_data,
+            self.card_type_with_id("2"), grade=-1, tag_names=["a"])[0]
+        self.database().tag_all_duplicates()
+        card_3 = self.database().card(card_3._id, is_id_internal=True)
+        card_4 = self.database().card(card_4._id, is_id_internal=True)
+        assert "DUPLICATE" not in card_3.tag_string()
+        assert "DUPLICATE" not in card_4.tag_string()
 
     def test_is_accessible(self):
     #    from threading import Thread
@@ -386,8 +386,261 @@ class TestLogging(MnemosyneTest):
         arch_con = sqlite3.connect(archive_path)
         assert arch_con.execute("select count() from log").fetchone()[0] == 11
 
+    def test_archive_old_logs_incremental(self):
+        filename = os.path.join(os.getcwd(), "tests", "files", "basedir_bz2",
+                                "default.mem")
+        self.mem_importer().do_import(filename)
+        assert self.database().con.execute("select count() from log").fetchone()[0] == 23
+        # Pretend this database predates incremental vacuuming.
+        self.database().save()
+        self.database().con.execute("pragma auto_vacuum=none")
+        self.database().con.execute("vacuum")
+        assert self.database().con.execute(\
+            "pragma auto_vacuum").fetchone()[0] == 0
+        self.config()["log_archive_chunk_size"] = 2
+        assert self.database().is_archiving_old_logs() == False
+        assert self.database().archive_old_logs(max_count=2) == False
+        assert self.database().is_archiving_old_logs() == True
+        # Resume after a restart.
+        self.mnemosyne.finalise()
+        self.restart()
+        self.config()["log_archive_chunk_size"] = 2
+        assert self.database().is_archiving_old_logs() == True
+        # Redoing a chunk which was already copied does not duplicate it.
+        self.database().con.execute("""update global_variables set value=0
+            where key='log_archive_at_id'""")
+        # Don't commit an open transaction from the heartbeat.
+        assert self.database().archive_old_logs(max_count=2) == False
+        assert self.database().con.in_transaction
+        self.database().save()
+        n = 0
+        while not self.database().archive_old_logs(max_count=2):
+            n += 1
+        assert n > 1
+        assert self.database().is_archiving_old_logs() == False
+        assert self.database().con.execute(\
+            "select count() from log where timestamp<?",
+            (int(time.time()) - 356 * 24 * 60 * 60, )).fetchone()[0] == 0
+        archive_dir = os.path.join(os.getcwd(), "dot_test", "archive")
+        assert len(os.listdir(archive_dir)) == 1
+        import sqlite3
+        arch_con = sqlite3.connect(os.path.join(archive_dir,
+            os.listdir(archive_dir)[0]))
+        assert arch_con.execute("select count() from log").fetchone()[0] == 11
+        # Loading the database after the restart switched it to incremental
+        # vacuuming.
+        assert self.database().con.execute(\
+            "pragma auto_vacuum").fetchone()[0] == 2 # Incremental.
+
+    def test_merge_archive_dir(self):
+        archive_dir = os.path.join(os.getcwd(), "dot_test", "archive")
+        os.makedirs(archive_dir)
+        import sqlite3
+        entries = [(EventTypes.REPETITION, 10 + i, "card_%d" % (i % 3))
+                   for i in range(20)]
+        entries.append((EventTypes.LOADED_DATABASE, 5, "machine_1"))
+        entries.append((EventTypes.LOADED_DATABASE, 5, "machine_2"))
+        entries.append((EventTypes.STARTED_PROGRAM, 5, None))
+        for name, part in [("default-a.db", entries[:15] + entries[-3:]),
+                           ("default-b.db", entries[5:] + entries[-3:-1]),
+                           ("default-c.db", entries[::2]),
+                           ("other-a.db", entries[:5])]:
+            filename = os.path.join(archive_dir, name)
+            self.database()._create_log_archive(filename)
+            con = sqlite3.connect(filename)
+            con.executemany("""insert into log(event_type, timestamp,
+                object_id) values(?,?,?)""", part[::-1])
+            con.commit()
+            con.close()
+        duplicates = self.database().merge_archive_dir()
+        assert duplicates == 18 + 20 + 12 - len(entries)
+        # Archives of other databases are left alone.
+        assert sorted(os.listdir(archive_dir))[1] == "other-a.db"
+        os.remove(os.path.join(archive_dir, "other-a.db"))
+        assert len(os.listdir(archive_dir)) == 1
+        merged = os.path.join(archive_dir, os.listdir(archive_dir)[0])
+        con = sqlite3.connect(merged)
+        assert con.execute("""select event_type, timestamp, object_id from log
+            order by _id""").fetchall() == \
+            sorted(entries, key=lambda x: (x[1], x[0], x[2] or ""))
+        con.close()
+        # The verifier notices entries which got lost.
+        from mnemosyne.libmnemosyne.utils import MnemosyneError
+        filename = os.path.join(archive_dir, "d.db")
+        shutil.copy(merged, filename)
+        con = sqlite3.connect(merged)
+        con.execute("delete from log where _id=3")
+        con.commit()
+        con.close()
+        try:
+            self.database().verify_merged_log_archive([filename], merged)
+            assert False
+        except MnemosyneError:
+            pass
+        assert self.database().verify_merged_log_archive(\
+            [filename, filename], filename) == len(entries)
+
+    def test_compact_log(self):
+        card_type = self.card_type_with_id("1")
+        fact_data = {"f": "1", "b": "b"}
+        card = self.controller().create_new_cards(fact_data, card_type,
+                     grade=-1, tag_names=["default"])[0]
+        fact_data = {"f": "2", "b": "b"}
+        self.controller().create_new_cards(fact_data, card_type,
+                     grade=-1, tag_names=["default"])
+        self.review_controller().show_new_question()
+        self.review_controller().grade_answer(2)
+        self.review_controller().show_new_question()
+        self.review_controller().grade_answer(5)
+        con = self.database().con
+        con.execute("""update log set timestamp=timestamp-100*86400 where
+            _id=(select min(_id) from log where event_type=?)""",
+            (EventTypes.REPETITION, ))
+        log = con.execute("select * from log order by _id").fetchall()
+        thinking_time = self.database().total_thinking_time(card)
+        self.database().rebuild_statistics_summary()
+        summary = con.execute("select * from repetitions_for_day").fetchall()
+        self.config()["compact_log_after_days"] = 30
+        self.database().compact_log()
+        assert con.execute("select count() from log where event_type=?",
+            (EventTypes.REPETITION, )).fetchone()[0] == 1
+        assert con.execute("select count() from log_compact").fetchone()[0] == 1
+        assert con.execute("select * from log_all order by _id").fetchall() \
+            == log
+        assert self.database().total_thinking_time(card) == thinking_time
+        self.database().rebuild_statistics_summary()
+        assert con.execute("select * from repetitions_for_day").fetchall() \
+            == summary
+        self.config()["upload_science_logs"] = True
+        self.database().dump_to_science_log()
+        logfile = os.path.join(os.path.abspath("dot_test"), "log.txt")
+        assert len([line for line in open(logfile) if " : R " in line]) == 2
+        # Move everything back.
+        self.config()["compact_log_after_days"] = None
+        self.database().compact_log()
+        assert con.execute("select count() from log_compact").fetchone()[0] == 0
+        assert con.execute("select count() from log_object_ids")\
+            .fetchone()[0] == 0
+        assert con.execute("select * from log order by _id").fetchall() == log
+        # The log index takes the compacted repetitions into account.
+        self.config()["compact_log_after_days"] = 30
+        self.database().compact_log()
+        _id = con.execute("select _id from log_compact").fetchone()[0]
+        con.execute("delete from log where _id>?", (_id, ))
+        assert self.database().current_log_index() == _id
+
     def test_log_warn_about_too_many_cards(self):
         timestamp = int(time.time())
         self.database().log_warn_about_too_many_cards(timestamp)
         results = self.database().con.execute("""select timestamp from log WHERE event_type=? and timestamp = ?""", (EventTypes.WARNED_TOO_MANY_CARDS, timestamp)).fetchall()
         assert 1 == len(results)
+
+    def test_log_buffer(self):
+        con = self.database().con
+        index = self.database().current_log_index()
+        assert len(con._deferred) == 0
+        timestamp = int(time.time())
+        for i in range(5):
+            self.database().log_added_tag(timestamp, str(i))
+            self.database().log_edited_tag(timestamp, str(i))
+        assert len(con._deferred) == 10
+        # Queries which don't involve the log don't flush the buffer.
+        con.execute("select count() from cards").fetchone()
+        assert len(con._deferred) == 10
+        # Reading the log does, and the order is preserved.
+        sql_res = con.execute("""select event_type, object_id from log
+            where _id>? order by _id""", (index, )).fetchall()
+        assert len(con._deferred) == 0
+        assert sql_res == [(event_type, str(i)) for i in range(5) for \
+            event_type in (EventTypes.ADDED_TAG, EventTypes.EDITED_TAG)]
+        # So does committing.
+        self.database().log_deleted_tag(timestamp, "0")
+        self.database().save()
+        assert len(con._deferred) == 0
+        # The buffer has a maximum size.
+        con.max_deferred = 3
+        for i in range(3):
+            self.database().log_deleted_tag(timestamp, str(i))
+        assert len(con._deferred) == 0
+        con.max_deferred = 0
+        self.database().log_deleted_tag(timestamp, "3")
+        assert len(con._deferred) == 0
+        assert self.database().current_log_index() == index + 15
+        # Failing to flush does not lose anything.
+        con.max_deferred = 100
+        self.database().log_deleted_tag(timestamp, "4")
+        con.execute_deferred("insert into log(no_such_column) values(?)",
+            (1, ), ("log", ))
+        self.database().log_deleted_tag(timestamp, "5")
+        try:
+            con.flush_deferred()
+            assert False
+        except Exception:
+            pass
+        assert len(con._deferred) == 2
+        con._deferred.pop(0)
+        self.database().save()
+        assert self.database().current_log_index() == index + 17
+        # Only the thread owning the connection can use the buffer.
+        import threading
+        errors = []
+        def log_from_thread():
+            try:
+                self.database().log_deleted_tag(timestamp, "6")
+            except AssertionError as e:
+                errors.append(e)
+        thread = threading.Thread(target=log_from_thread)
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+        assert len(con._deferred) == 0
+
+    def test_dump_to_science_log_rotate(self):
+        self.config()["upload_science_logs"] = True
+        self.config()["science_log_chunk_size"] = 7
+        self.config()["max_log_size_before_upload"] = 500
+        timestamp = int(time.time())
+        for i in range(40):
+            self.database().log_deleted_card(timestamp, "card_%d" % i)
+        self.database().dump_to_science_log()
+        # Everything got dumped and the high-water mark was moved forward.
+        assert self.database().con.execute(\
+            "select _last_log_id from partnerships where partner=?",
+            ("log.txt", )).fetchone()[0] == \
+            self.database().current_log_index()
+        # log.txt was rotated into compressed chunks along the way.
+        import bz2
+        history_dir = os.path.join(os.path.abspath("dot_test"), "history")
+        archives = sorted(x for x in os.listdir(history_dir) \
+            if x.endswith(".bz2"))
+        assert len(archives) > 1
+        logname = os.path.join(os.path.abspath("dot_test"), "log.txt")
+        lines = []
+        for archive in archives:
+            lines += bz2.open(os.path.join(history_dir, archive), "rt")\
+                .readlines()
+        if os.path.exists(logname):
+            assert os.stat(logname).st_size <= 500
+            lines += open(logname).readlines()
+        deleted = [line for line in lines if "Deleted item" in line]
+        assert len(deleted) == 40
+        assert deleted[-1].strip().endswith("card_39")
+        # A second dump does not write anything.
+        self.database().dump_to_science_log()
+        assert len([x for x in os.listdir(history_dir) \
+            if x.endswith(".bz2")]) == len(archives)
+        # The high-water mark is committed with each chunk, so that after a
+        # crash, chunks which were written already are not dumped again.
+        for i in range(10):
+            self.database().log_deleted_card(timestamp, "card_b_%d" % i)
+        self.log().archive_old_log = None # Crash after the first chunk.
+        try:
+            self.database().dump_to_science_log()
+        except TypeError:
+            pass
+        del self.log().archive_old_log
+        self.database().con.rollback()
+        assert self.database().con.execute(\
+            "select _last_log_id from partnerships where partner=?",
+            ("log.txt", )).fetchone()[0] == \
+            self.database().current_log_index() - 3
@@ -150,6 +150,8 @@ class TestReviewController(MnemosyneTest):
         card = self.controller().create_new_cards(fact_data, card_type, grade=5, tag_names=[])[0]
         card.next_rep = 0
         self.database().update_card(card)
+        # We modified the database behind the review controller's back.
+        self.review_controller().reload_counters()
         expected_scheduled_count = 1
         self.review_controller().show_new_question()
         assert self.review_controller().scheduled_count == 1
@@ -168,6 +170,8 @@ class TestReviewController(MnemosyneTest):
             card = self.controller().create_new_cards(fact_data, card_type, grade=5, tag_names=[])[0]
             card.next_rep = 0
             self.database().update_card(card)
+        # We modified the database behind the review controller's back.
+        self.review_controller().reload_counters()
         expected_scheduled_count = 4
         self.review_controller().show_new_question()
         assert self.review_controller().scheduled_count == 4
@@ -177,3 +181,85 @@ class TestReviewController(MnemosyneTest):
         self.review_controller().grade_answer(3)
         assert self.review_controller().scheduled_count == 3
         assert self.review_controller().counters()[0] == 3
+
+    def test_counters_incremental(self):
+        self.config()["check_counters"] = True
+        self.review_controller().reset()
+        c = DefaultCriterion(self.mnemosyne.component_manager)
+        c.deactivated_card_type_fact_view_ids = set()
+        c._tag_ids_active = set([self.database().get_or_create_tag_with_name("__UNTAGGED__")._id,
+            self.database().get_or_create_tag_with_name("active")._id])
+        c._tag_ids_forbidden = set([self.database().get_or_create_tag_with_name("forbidden")._id])
+        self.database().set_current_criterion(c)
+        self.review_controller().reset()
+        card_type_1 = self.card_type_with_id("1")
+        card_type_2 = self.card_type_with_id("2")
+        card_type_3 = self.card_type_with_id("3")
+        for grade in [-1, 2, 5]:
+            fact_data = {"f": str(grade), "b": "b"}
+            card = self.controller().create_new_cards(fact_data, card_type_1,
+                grade=grade, tag_names=["active"])[0]
+        assert self.review_controller().counters() == (0, 1, 3)
+        self.review_controller().show_new_question()
+        self.review_controller().show_answer()
+        self.review_controller().grade_answer(2)
+        self.review_controller().show_answer()
+        self.review_controller().grade_answer(0)
+        # Change the card type with and without a converter.
+        fact_data = {"f": "f", "b": "b"}
+        card = self.controller().create_new_cards(fact_data, card_type_1,
+            grade=-1, tag_names=["active"])[0]
+        self.controller().edit_card_and_sisters(card, fact_data,
+            card_type_2, ["active"], correspondence=[])
+        card = self.database().cards_from_fact(card.fact)[0]
+        self.controller().edit_card_and_sisters(card, {"f": "f", "m_1": "b"},
+            card_type_3, ["active"], correspondence={"f": "f", "b": "m_1"})
+        card = self.database().cards_from_fact(card.fact)[0]
+        # Deactivate and reactivate cards through their tags.
+        active_count = self.review_controller().counters()[2]
+        self.controller().edit_card_and_sisters(card, card.fact.data,
+            card.card_type, ["active", "forbidden"], correspondence=[])
+        assert self.review_controller().counters()[2] == active_count - 2
+        self.controller().edit_card_and_sisters(card, card.fact.data,
+            card.card_type, ["active"], correspondence=[])
+        assert self.review_controller().counters()[2] == active_count
+
+    def test_prefetch(self):
+        card_type = self.card_type_with_id("1")
+        for data in ['1', '2', '3', '4', '5']:
+            fact_data = {"f": data, "b": data}
+            self.controller().create_new_cards(fact_data, card_type,
+                grade=-1, tag_names=[])
+        self.review_controller().show_new_question()
+        prefetcher = self.review_controller().prefetcher
+        _card_ids = self.scheduler().upcoming_card_ids(3)
+        assert len(_card_ids) == 3
+        assert self.review_controller().card._id not in _card_ids
+        card = self.database().card(_card_ids[0], is_id_internal=True)
+        assert prefetcher.is_prefetched(card, "default", "question")
+        assert prefetcher.render(card, "default", "question") == \
+            card.question("default")
+        # Editing invalidates the cache.
+        self.controller().edit_card_and_sisters(card, {"f": "edited",
+            "b": "b"}, card_type, [], correspondence=[])
+        assert not prefetcher.is_prefetched(card, "default", "question")
+        card = self.database().card(card._id, is_id_internal=True)
+        assert "edited" in prefetcher.render(card, "default", "question")
+        # Prefetching again only keeps the upcoming cards.
+        self.review_controller().show_answer()
+        self.review_controller().grade_answer(0)
+        for key in prefetcher._cache:
+            assert key[0] in self.scheduler().upcoming_card_ids(3) + \
+                [self.review_controller().card._id]
+        # Cards with filters which are not thread safe are not prefetched.
+        _card_ids = self.scheduler().upcoming_card_ids(3)
+        card = self.database().card(_card_ids[0], is_id_internal=True)
+        self.controller().edit_card_and_sisters(card, {"f": "<$>x</$>",
+            "b": "b"}, card_type, [], correspondence=[])
+        card = self.database().card(card._id, is_id_internal=True)
+        assert not self.render_chain("default").is_thread_safe_for(card)
+        self.review_controller().prefetch_upcoming_cards()
+        assert not prefetcher.is_prefetched(card, "default", "question")
+        card = self.database().card(_card_ids[1], is_id_internal=True)
+        assert self.render_chain("default").is_thread_safe_for(card)
+        assert prefetcher.is_prefetched(card, "default", "question")
@@ -8,6 +8,7 @@ import time
 import datetime
 import calendar
 from mnemosyne_test import MnemosyneTest
+from mnemosyne.libmnemosyne.schedulers.card_queue import CardQueue
 
 HOUR = 60 * 60 # Seconds in an hour.
 DAY = 24 * HOUR # Seconds in a day.
@@ -363,6 +364,30 @@ class TestScheduler(MnemosyneTest):
             cards.add(self.review_controller().card._id)
         assert card_2._id in cards
 
+    def test_avoid_sister_cards(self):
+        from mnemosyne.libmnemosyne.card_types.cloze import ClozePlugin
+        for plugin in self.plugins():
+            if isinstance(plugin, ClozePlugin):
+                plugin.activate()
+                break
+        card_type = self.card_type_with_id("5")
+        fact_data = {"text": "[a] [b] [c] [d] [e]"}
+        cards = self.controller().create_new_cards(fact_data,
+          card_type, grade=-1, tag_names=["default"])
+        start = self.scheduler().midnight_UTC(int(time.time())) + 10 * DAY
+        # Sisters on days 0, 1 and 3, and an inactive one on day 2.
+        for card, day, active in [(cards[1], 0, True), (cards[2], 1, True),
+            (cards[3], 3, True), (cards[4], 2, False)]:
+            card.grade = 2
+            card.next_rep = start + day * DAY
+            card.active = active
+            self.database().update_card(card, repetition_only=True)
+        card = cards[0]
+        for day, new_day in [(-1, -1), (0, 2), (1, 2), (2, 2), (3, 4)]:
+            card.next_rep = start + day * DAY
+            self.scheduler().avoid_sister_cards(card)
+            assert card.next_rep == start + new_day * DAY
+
     def test_order(self):
         card_type = self.card_type_with_id("1")
         fact_data = {"f": "1", "b": "b"}
@@ -611,6 +636,42 @@ class TestScheduler(MnemosyneTest):
         assert sch.last_rep_to_interval_string(last_rep, now) == "yesterday"
 
 
+    def test_card_queue(self):
+        import random
+        random.seed(0)
+        queue, reference = CardQueue(), []
+        for i in range(2000):
+            _card_id = random.randint(0, 20)
+            action = random.random()
+            if action < 0.4:
+                queue.append(_card_id)
+                reference.append(_card_id)
+            elif action < 0.6 and reference:
+                assert queue.popleft() == reference.pop(0)
+            elif action < 0.8:
+                assert (_card_id in queue) == (_card_id in reference)
+                if _card_id in reference:
+                    queue.remove(_card_id)
+                    reference.remove(_card_id)
+            elif action < 0.9:
+                queue.discard_all(_card_id)
+                reference = [x for x in reference if x != _card_id]
+            elif action < 0.95:
+                queue.shuffle()
+                reference = list(queue)
+            assert len(queue) == len(reference)
+            assert list(queue) == reference
+            if reference:
+                assert queue.first() == reference[0]
+        queue = CardQueue([1, 2, 1])
+        queue.remove(1)
+        assert queue == [2, 1]
+        try:
+            queue.remove(3)
+            assert False
+        except ValueError:
+            pass
+
     def test_prefetch(self):
         fact_data = {"f": "question1",
                      "b": "answer1"}
@@ -622,7 +683,8 @@ class TestScheduler(MnemosyneTest):
         card_1 = self.controller().create_new_cards(fact_data, card_type,
                                               grade=-1, tag_names=["default"])[0]
 
-        self.scheduler()._card_ids_in_queue = [card_0._id, card_1._id, card_1._id]
+        self.scheduler()._card_ids_in_queue = \
+            CardQueue([card_0._id, card_1._id, card_1._id])
         assert self.scheduler().is_prefetch_allowed(card_to_grade=card_0) == False
 
     def test_prefetch_2(self):
@@ -636,7 +698,8 @@ class TestScheduler(MnemosyneTest):
         card_1 = self.controller().create_new_cards(fact_data, card_type,
                                               grade=-1, tag_names=["default"])[0]
 
-        self.scheduler()._card_ids_in_queue = [card_0._id, card_1._id, card_0._id]
+        self.scheduler()._card_ids_in_queue = \
+            CardQueue([card_0._id, card_1._id, card_0._id])
         self.review_controller().show_new_question()
         self.review_controller().show_answer()
         self.review_controller().grade_answer(0)
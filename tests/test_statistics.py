@@ -151,6 +151,153 @@ class TestStatistics(MnemosyneTest):
         page = RetentionScore(self.mnemosyne.component_manager)
         page.prepare_statistics(0)
 
+    def test_per_day(self):
+        card_type = self.card_type_with_id("1")
+        for i in range(10):
+            fact_data = {"f": "question %d" % i, "b": "answer"}
+            card = self.controller().create_new_cards(fact_data, card_type,
+                grade=4, tag_names=["default"])[0]
+            card.next_rep = self.scheduler().adjusted_now() + i * DAY / 3
+            self.database().update_card(card)
+        con = self.database().con
+        for days_ago, machine, count in [(1, "A", 20), (1, "A", 10),
+            (1, "B", 40), (2, "A.fut", 5), (2, "B.fut", 7), (4, None, 3)]:
+            con.execute("""insert into log(event_type, timestamp, object_id,
+                acq_reps,ret_reps, lapses) values(?,?,?,?,?,?)""",
+                (EventTypes.LOADED_DATABASE, time.time() - days_ago * DAY,
+                machine, count, -666, -666))
+        for days_ago, grade, scheduled_interval in [(0, 1, DAY),
+            (0, 4, DAY), (3, 5, DAY), (3, 4, 0), (3, 0, DAY), (3, 3, DAY)]:
+            con.execute("""insert into log(event_type, timestamp, object_id,
+                grade, ret_reps, scheduled_interval) values(?,?,?,?,?,?)""",
+                (EventTypes.REPETITION, time.time() - days_ago * DAY,
+                "id", grade, 1, scheduled_interval))
+        counts = self.scheduler().card_count_scheduled_per_day_from_now(-7, 7)
+        assert sorted(counts.keys()) == list(range(-7, 8))
+        for n in range(-7, 8):
+            assert counts[n] == \
+                self.scheduler().card_count_scheduled_n_days_from_now(n)
+        assert counts[-1] == 20
+        assert counts[-2] == 7
+        assert counts[-4] == 3
+        assert sum(counts[n] for n in range(1, 8)) == 10
+        added = self.database().card_count_added_per_day_ago(7)
+        learned = self.database().card_count_learned_per_day_ago(7)
+        scores = self.database().retention_score_per_day_ago(7)
+        for n in range(8):
+            assert added[n] == self.database().card_count_added_n_days_ago(n)
+            assert learned[n] == \
+                self.database().card_count_learned_n_days_ago(n)
+            assert scores[n] == self.database().retention_score_n_days_ago(n)
+        assert added[0] == 10
+        assert scores[0] == 50
+        assert scores[3] == 200 / 3.
+        assert self.database().average_grade_per_day_ago(7) == \
+            {0: 2.5, 3: 8 / 3.}
+
+    def test_statistics_summary(self):
+        con = self.database().con
+
+        def add_repetitions(days_ago, grades):
+            for grade in grades:
+                con.execute("""insert into log(event_type, timestamp,
+                    object_id, grade, ret_reps, scheduled_interval,
+                    thinking_time) values(?,?,?,?,?,?,?)""",
+                    (EventTypes.REPETITION, time.time() - days_ago * DAY,
+                    "id", grade, 1, DAY, 2))
+
+        add_repetitions(1, [0, 5, 5, 5])
+        assert self.database().retention_score_n_days_ago(1) == 75
+        assert self.database().thinking_time_per_day_ago(1) == {0: 0, 1: 8}
+        # Only the new entries get processed.
+        add_repetitions(1, [1, 1, 1, 1])
+        add_repetitions(0, [4])
+        assert self.database().retention_score_per_day_ago(1) == \
+            {0: 100, 1: 37.5}
+        _last_log_id = int(self.database()._global_variable(\
+            "statistics_summary_last_log_id"))
+        assert _last_log_id == \
+            con.execute("select max(_id) from log").fetchone()[0]
+        summary = list(con.execute(\
+            "select * from repetitions_for_day order by day, grade"))
+        self.database().rebuild_statistics_summary()
+        assert list(con.execute(\
+            "select * from repetitions_for_day order by day, grade")) == summary
+        # Deleting log entries needs a rebuild.
+        con.execute("delete from log where _id>?", (_last_log_id - 1, ))
+        self.database().invalidate_statistics_summary()
+        assert self.database().retention_score_per_day_ago(1) == \
+            {0: 0, 1: 37.5}
+        # As does changing the start of the day.
+        self.config()["day_starts_at"] = 0
+        self.database().update_statistics_summary()
+        assert self.database()._global_variable(\
+            "statistics_summary_settings").startswith("0 ")
+
+    def test_statistics_for_tags(self):
+        card_type = self.card_type_with_id("1")
+        for i, (grade, tag_names) in enumerate([(-1, ["a"]),
+            (2, ["a", "b"]), (4, ["b"]), (5, ["b"])]):
+            fact_data = {"f": "question %d" % i, "b": "answer"}
+            card = self.controller().create_new_cards(fact_data, card_type,
+                grade=grade, tag_names=tag_names)[0]
+            card.easiness = 2.0 + i / 10.
+            if i == 3:
+                card.next_rep = self.scheduler().adjusted_now() + 10 * DAY
+            else:
+                card.next_rep = self.scheduler().adjusted_now() - DAY
+            self.database().update_card(card)
+            if i == 2:
+                self.database().con.execute(\
+                    "update cards set active=0 where _id=?", (card._id, ))
+        tag_a = self.database().get_or_create_tag_with_name("a")
+        tag_b = self.database().get_or_create_tag_with_name("b")
+        statistics = self.database().statistics_for_tags(\
+            self.scheduler().adjusted_now())
+        assert statistics[tag_a._id] == (2, 2, 2.1, 1)
+        assert statistics[tag_b._id][:2] == (3, 2)
+        assert abs(statistics[tag_b._id][2] - 2.2) < 1e-10
+        assert statistics[tag_b._id][3] == 1
+        tag_c = self.database().get_or_create_tag_with_name("c")
+        statistics = self.database().statistics_for_tags(0)
+        assert statistics[tag_c._id] == (0, 0, None, 0)
+
+    def test_card_count_for_grades_and_tags(self):
+        card_type = self.card_type_with_id("1")
+        for i, (grade, tag_names) in enumerate([(-1, ["a"]),
+            (2, ["a", "b"]), (4, ["b"]), (5, ["b"])]):
+            fact_data = {"f": "question %d" % i, "b": "answer"}
+            card = self.controller().create_new_cards(fact_data, card_type,
+                grade=grade, tag_names=tag_names)[0]
+            card.easiness = 2.0 + i / 10.
+            self.database().update_card(card)
+            if i == 2:
+                self.database().con.execute(\
+                    "update cards set active=0 where _id=?", (card._id, ))
+        tag_a = self.database().get_or_create_tag_with_name("a")
+        tag_b = self.database().get_or_create_tag_with_name("b")
+        assert self.database().card_count_for_grades_and_tags(\
+            [tag_a, tag_b], active_only=False) == {-1: 1, 2: 1, 4: 1, 5: 1}
+        assert self.database().card_count_for_grades_and_tags(\
+            [tag_b], active_only=True) == {2: 1, 5: 1}
+        assert self.database().card_count_for_grades_and_tags(\
+            [], active_only=True) == {}
+        assert sorted(self.database().easinesses_for_tags(\
+            [tag_a, tag_b], active_only=False)) == [2.1, 2.2, 2.3]
+        assert self.database().easinesses_for_tags(\
+            [tag_b], active_only=True) == [2.1, 2.3]
+        # Many tags are queried in chunks, without counting cards twice.
+        tags = [tag_a] + [self.database().get_or_create_tag_with_name(\
+            "tag %d" % i) for i in range(600)] + [tag_b]
+        assert self.database().card_count_for_grades_and_tags(\
+            tags, active_only=False) == {-1: 1, 2: 1, 4: 1, 5: 1}
+        assert sorted(self.database().easinesses_for_tags(\
+            tags, active_only=False)) == [2.1, 2.2, 2.3]
+        from mnemosyne.libmnemosyne.statistics_pages.grades import Grades
+        page = Grades(component_manager=self.mnemosyne.component_manager)
+        page.prepare_statistics(page.nodes.index("b"))
+        assert page.y == [0, 0, 0, 1, 0, 1, 1]
+
     def test_card_count_for_tags(self):
         assert self.database().card_count_for_tags([], active_only=False) == 0
 
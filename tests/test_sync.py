@@ -194,7 +194,8 @@ class MyClient(Client):
         for i in range(20):
             last_error = None
             self.sync("localhost", PORT, self.user, self.password)
-            if not last_error or not "Could not connect to server" in last_error:
+            if not last_error or not ("Could not connect to server" in \
+                last_error or "Connection refused" in last_error):
                 return
             time.sleep(0.3)
 
@@ -845,6 +846,52 @@ class TestSync(object):
         assert self.client.mnemosyne.database().con.execute(\
             "select count() from log").fetchone()[0] == 29
 
+    def test_repetition_compact_log(self):
+
+        def test_server(self):
+            db = self.mnemosyne.database()
+            card = db.card(self.client_card.id, is_id_internal=False)
+            assert card.acq_reps == self.client_card.acq_reps
+            assert card.ret_reps == self.client_card.ret_reps == 1
+            assert card.last_rep == self.client_card.last_rep
+            assert card.next_rep == self.client_card.next_rep
+            timestamps = [cursor[0] for cursor in db.con.execute(\
+                "select timestamp from log where event_type=? order by _id",
+                (EventTypes.REPETITION, ))]
+            assert timestamps == sorted(timestamps)
+
+        self.server = MyServer()
+        self.server.test_server = test_server
+        self.server.start()
+
+        self.client = MyClient()
+        fact_data = {"f": "question",
+                     "b": "answer"}
+        card_type = self.client.mnemosyne.card_type_with_id("1")
+        card = self.client.mnemosyne.controller().create_new_cards(fact_data,
+            card_type, grade=-1, tag_names=["tag_1"])[0]
+        db = self.client.mnemosyne.database()
+        review_controller = self.client.mnemosyne.review_controller()
+        review_controller.learning_ahead = True
+        review_controller.show_new_question()
+        review_controller.grade_answer(2)
+        # Make the first repetition old enough to get compacted, such that
+        # it ends up in 'log_compact' in between live log entries.
+        db.con.execute("""update log set timestamp=timestamp-100*86400 where
+            event_type=?""", (EventTypes.REPETITION, ))
+        review_controller.show_new_question()
+        review_controller.grade_answer(5)
+        self.client.mnemosyne.config()["compact_log_after_days"] = 30
+        db.compact_log()
+        assert db.con.execute("select count() from log_compact").\
+            fetchone()[0] == 1
+        assert db.con.execute("select count() from log where _id>?",
+            (db.con.execute("select _id from log_compact").fetchone()[0], )).\
+            fetchone()[0] > 0
+        self.client.mnemosyne.controller().save_file()
+        self.server.client_card = db.card(card.id, is_id_internal=False)
+        self.client.do_sync(); assert last_error is None
+
     def test_add_media(self):
 
         def fill_server_database(self):
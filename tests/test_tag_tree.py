@@ -344,6 +344,27 @@ class TestTagTree(MnemosyneTest):
         assert self.tree.card_count_for_node["__ALL__"] == 2
         assert self.tree.card_count_for_node["X"] == 2
 
+    def test_count_3(self):
+        card_type = self.card_type_with_id("1")
+        for i, tag_names in enumerate([["a", "a::b"], ["a::b::c", "d"],
+            ["a::b", "a::c"], ["d::e"], ["a::c", "d::e", "f"], [], ["f"]]):
+            fact_data = {"f": "question %d" % i,  "b": "answer"}
+            self.controller().create_new_cards(fact_data, card_type,
+                grade=-1, tag_names=tag_names)
+
+        from mnemosyne.libmnemosyne.tag_tree import TagTree
+        self.tree = TagTree(self.mnemosyne.component_manager)
+
+        assert self.tree.card_count_for_node["__ALL__"] == 7
+        assert self.tree.card_count_for_node["a"] == 4
+        assert self.tree.card_count_for_node["a::b"] == 3
+        assert self.tree.card_count_for_node["d"] == 3
+        assert self.tree.card_count_for_node["__UNTAGGED__"] == 1
+        for node in self.tree.nodes():
+            assert self.tree.card_count_for_node[node] == \
+                self.database().card_count_for_tags(\
+                self.tree.tags_in_subtree(node), active_only=False)
+
     def test_delete_forbidden(self):
         card_type = self.card_type_with_id("1")
         fact_data = {"f": "question",  "b": "answer"}